@@ -21,6 +21,7 @@ app = FastAPI(title="ALOY", description="Audit & Anomaly Detection Agent", versi
 EVENT_BUS_URL = os.getenv("EVENT_BUS_URL", "http://event-bus:8099")
 HERMES_URL = os.getenv("HERMES_URL", "http://hermes:8014")
 DB_PATH = os.getenv("ALOY_DB_PATH", "/app/data/aloy.db")
+MAX_EVENT_PAGES = int(os.getenv("ALOY_MAX_EVENT_PAGES", "20"))  # 500 events per page
 
 # Anomaly detection rules (Option A - simple rule-based)
 ANOMALY_RULES = {
@@ -131,25 +132,35 @@ async def send_alert_to_hermes(severity: str, message: str, rule_name: str):
 
 async def fetch_recent_events(minutes: int = 60, agent: str = None) -> List[Dict]:
     """Fetch recent events from Event Bus"""
+    cutoff = datetime.utcnow() - timedelta(minutes=minutes)
+    events = []
     try:
         async with httpx.AsyncClient() as client:
-            params = {"limit": 500}
+            params = {
+                "limit": 500,
+                "since": cutoff.strftime("%Y-%m-%d %H:%M:%S"),
+                "fields": "id,timestamp,source_agent,action,target,details",
+            }
             if agent:
                 params["source_agent"] = agent
-            resp = await client.get(
-                f"{EVENT_BUS_URL}/events",
-                params=params,
-                timeout=10.0
-            )
-            if resp.status_code == 200:
-                events = resp.json().get("events", [])
-                # Filter by time window
-                cutoff = datetime.utcnow() - timedelta(minutes=minutes)
-                cutoff_str = cutoff.strftime("%Y-%m-%d %H:%M:%S")
-                return [e for e in events if e.get("timestamp", "") >= cutoff_str]
+
+            # Page through the window with the keyset cursor
+            for _ in range(MAX_EVENT_PAGES):
+                resp = await client.get(
+                    f"{EVENT_BUS_URL}/events",
+                    params=params,
+                    timeout=10.0
+                )
+                if resp.status_code != 200:
+                    break
+                data = resp.json()
+                events.extend(data.get("events", []))
+                if not data.get("next_cursor"):
+                    break
+                params["before_id"] = data["next_cursor"]
     except Exception as e:
         print(f"Failed to fetch events: {e}")
-    return []
+    return events
 
 async def check_anomaly_rules(events: List[Dict]) -> List[Dict]:
     """Check events against anomaly rules"""
@@ -319,11 +319,14 @@ async def force_chunk(request: ChunkRequest):
     """
     try:
         conv = await UnifiedConversation.get_or_create(request.user_id)
-        engine = ChunkingEngine(conv)
+        embedding_service = EmbeddingService()
+        engine = ChunkingEngine(conv, embedding_service=embedding_service)
 
+        # Embeds the new chunk and adds it to the local vector index
         chunk = await engine.auto_chunk()
 
         await engine.close()
+        await embedding_service.close()
         await conv.close()
 
         if chunk:
@@ -372,25 +375,18 @@ async def get_stats(user_id: str):
 async def auto_chunk_if_needed(conv: UnifiedConversation):
     """Background task to check and perform auto-chunking."""
     try:
-        engine = ChunkingEngine(conv)
+        embedding_service = EmbeddingService()
+        engine = ChunkingEngine(conv, embedding_service=embedding_service)
 
         # Check if chunking needed (more than 2x buffer size)
         if await conv.needs_chunking(conv.primary_buffer_size * 2):
+            # Embeds the new chunk and adds it to the local vector index
             chunk = await engine.auto_chunk()
             if chunk:
                 logger.info(f"Auto-chunked {chunk.message_count} messages for user {conv.user_id}")
 
-                # Generate embedding for the chunk
-                embedding_service = EmbeddingService()
-                try:
-                    await embedding_service.embed_and_store(chunk.id, chunk.content)
-                    logger.info(f"Generated embedding for chunk {chunk.id}")
-                except Exception as e:
-                    logger.warning(f"Failed to generate embedding: {e}")
-                finally:
-                    await embedding_service.close()
-
         await engine.close()
+        await embedding_service.close()
 
     except Exception as e:
         logger.error(f"Auto-chunk error: {e}")
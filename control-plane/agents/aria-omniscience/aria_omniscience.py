@@ -21,6 +21,10 @@ import httpx
 from fastapi import FastAPI, HTTPException, BackgroundTasks
 from pydantic import BaseModel, Field
 
+# Add shared modules to path
+sys.path.insert(0, "/opt/leveredge/control-plane/shared")
+from unified_threading.embeddings import EmbeddingService
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -36,6 +40,7 @@ EVENT_BUS_URL = os.getenv("EVENT_BUS_URL", "http://event-bus:8099")
 SUPABASE_URL = os.getenv("SUPABASE_URL", "http://supabase-kong:8000")
 SUPABASE_KEY = os.getenv("SUPABASE_SERVICE_KEY", "")
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "")  # For embeddings
+EMBEDDING_MODEL = "text-embedding-3-small"
 
 # Polling configuration
 POLL_INTERVAL_SECONDS = 5
@@ -144,6 +149,8 @@ class OmniscienceIngest:
         self.polling_active = False
         self._poll_task: Optional[asyncio.Task] = None
         self._last_processed_id: Optional[str] = None
+        # Batches concurrent embedding calls into shared OpenAI requests
+        self.embeddings = EmbeddingService(openai_api_key=OPENAI_API_KEY, model=EMBEDDING_MODEL)
 
     async def start_polling(self):
         """Start the event polling loop"""
@@ -164,6 +171,7 @@ class OmniscienceIngest:
                 await self._poll_task
             except asyncio.CancelledError:
                 pass
+        await self.embeddings.close()
         logger.info("Event polling stopped")
 
     async def _poll_loop(self):
@@ -191,8 +199,8 @@ class OmniscienceIngest:
 
                 if response.status_code == 200:
                     events = response.json()
-                    for event in events:
-                        await self.process_event(event)
+                    # Concurrently, so their embeddings go out as one batched request
+                    await asyncio.gather(*(self.process_event(event) for event in events))
                 elif response.status_code == 404:
                     # No pending events - this is normal
                     pass
@@ -550,24 +558,7 @@ class OmniscienceIngest:
             return None
 
         try:
-            async with httpx.AsyncClient() as client:
-                response = await client.post(
-                    "https://api.openai.com/v1/embeddings",
-                    headers={
-                        "Authorization": f"Bearer {OPENAI_API_KEY}",
-                        "Content-Type": "application/json"
-                    },
-                    json={
-                        "input": text[:8000],  # Truncate if too long
-                        "model": "text-embedding-3-small"
-                    },
-                    timeout=30.0
-                )
-
-                if response.status_code == 200:
-                    data = response.json()
-                    return data["data"][0]["embedding"]
-
+            return await self.embeddings.generate_embedding(text[:8000])  # Truncate if too long
         except Exception as e:
             logger.debug(f"Embedding generation failed: {e}")
 
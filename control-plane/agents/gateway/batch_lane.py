@@ -0,0 +1,748 @@
+#!/usr/bin/env python3
+"""
+Batch Lane - Offline lane for low-priority LLM work
+
+Nightly and bulk work (daily briefings, summarisation, bulk embedding
+ingest) is submitted here instead of the real-time path:
+- Jobs are persisted in SQLite and grouped by provider, endpoint and model
+- A group is flushed when it reaches GATEWAY_BATCH_MAX_ITEMS jobs or its
+  oldest job has waited GATEWAY_BATCH_MAX_WAIT seconds
+- provider: OpenAI and Anthropic chat groups go to the provider batch APIs
+  (discounted, results within 24h) and never touch the real-time TPM bucket
+- pack: OpenAI embedding groups are packed into multi-input calls
+- deferred: anything else runs one request at a time
+- pack and deferred calls are only sent while the real-time TPM bucket is
+  above GATEWAY_BATCH_TPM_RESERVE, so interactive traffic keeps its headroom
+- Results are polled by job id or POSTed to the job's callback_url
+
+GATEWAY_BATCH_PROVIDER=stub completes every job locally with canned
+responses, so the lane can be exercised without provider keys.
+"""
+
+import os
+import json
+import time
+import uuid
+import sqlite3
+import asyncio
+import hashlib
+import threading
+from collections import defaultdict
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import httpx
+
+from token_estimator import approximate_tokens, estimate_prompt_tokens, estimate_output_tokens
+
+
+# =============================================================================
+# Configuration
+# =============================================================================
+
+BATCH_ENABLED = os.getenv("GATEWAY_BATCH_ENABLED", "true").lower() == "true"
+BATCH_PATH = os.getenv("GATEWAY_BATCH_PATH", str(Path(__file__).parent / "batch_jobs.db"))
+BATCH_PROVIDER = os.getenv("GATEWAY_BATCH_PROVIDER", "live")  # live or stub
+BATCH_MAX_ITEMS = int(os.getenv("GATEWAY_BATCH_MAX_ITEMS", "500"))  # jobs per flush
+BATCH_MAX_WAIT = float(os.getenv("GATEWAY_BATCH_MAX_WAIT", "300"))  # seconds before a partial group is flushed
+BATCH_POLL_INTERVAL = float(os.getenv("GATEWAY_BATCH_POLL_INTERVAL", "60"))  # seconds between provider polls
+BATCH_TPM_RESERVE = float(os.getenv("GATEWAY_BATCH_TPM_RESERVE", "0.5"))  # Fraction of TPM kept for real-time
+BATCH_EMBEDDINGS = os.getenv("GATEWAY_BATCH_EMBEDDINGS", "pack")  # pack or provider
+BATCH_EMBED_MAX_INPUTS = int(os.getenv("GATEWAY_BATCH_EMBED_MAX_INPUTS", "2048"))  # per packed call
+BATCH_DISCOUNT = float(os.getenv("GATEWAY_BATCH_DISCOUNT", "0.5"))  # Provider batch price vs real-time
+BATCH_RESULT_TTL_DAYS = int(os.getenv("GATEWAY_BATCH_RESULT_TTL_DAYS", "7"))
+
+BATCH_TICK = min(5.0, BATCH_MAX_WAIT)  # seconds between flush/poll passes
+CLAIM_TIMEOUT = 600  # Running pack/deferred jobs older than this belonged to a dead worker
+CALLBACK_ATTEMPTS = 3
+
+# The lane runs without a caller to borrow headers from, so it uses its own keys
+PROVIDER_KEYS = {
+    "openai": os.getenv("OPENAI_API_KEY", ""),
+    "anthropic": os.getenv("ANTHROPIC_API_KEY", ""),
+    "google": os.getenv("GOOGLE_API_KEY", ""),
+}
+KEY_VARS = {"openai": "OPENAI_API_KEY", "anthropic": "ANTHROPIC_API_KEY", "google": "GOOGLE_API_KEY"}
+
+# Endpoints with a provider batch API
+PROVIDER_BATCH_ENDPOINTS = {
+    ("openai", "/v1/chat/completions"),
+    ("openai", "/v1/embeddings"),
+    ("anthropic", "/v1/messages"),
+}
+
+
+def auth_headers(service: str) -> Dict[str, str]:
+    key = PROVIDER_KEYS.get(service, "")
+    if service == "openai":
+        return {"Authorization": f"Bearer {key}"}
+    if service == "anthropic":
+        return {"x-api-key": key, "anthropic-version": "2023-06-01"}
+    if service == "google":
+        return {"x-goog-api-key": key}
+    return {}
+
+
+def batch_mode(service: str, endpoint: str) -> str:
+    """provider, pack or deferred"""
+    path = endpoint.split("?")[0]
+    if service == "openai" and path == "/v1/embeddings" and BATCH_EMBEDDINGS == "pack":
+        return "pack"
+    if (service, path) in PROVIDER_BATCH_ENDPOINTS:
+        return "provider"
+    return "deferred"
+
+
+def group_key(service: str, endpoint: str, mode: str, model: str, body: Dict[str, Any]) -> str:
+    """Jobs with the same key can share one batch or packed call"""
+    parts = [service, endpoint, mode, model]
+    if mode == "pack":
+        # Packed calls share every setting except the input
+        parts.append(json.dumps({k: v for k, v in body.items() if k != "input"}, sort_keys=True))
+    return hashlib.sha256("|".join(parts).encode()).hexdigest()[:16]
+
+
+# =============================================================================
+# Job Store
+# =============================================================================
+
+class BatchStore:
+    """SQLite job table shared by every worker; claims are BEGIN IMMEDIATE transactions"""
+
+    def __init__(self, path: str = BATCH_PATH):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                job_id TEXT PRIMARY KEY,
+                agent_id TEXT NOT NULL,
+                service TEXT NOT NULL,
+                endpoint TEXT NOT NULL,
+                model TEXT NOT NULL,
+                mode TEXT NOT NULL,
+                group_key TEXT NOT NULL,
+                body TEXT NOT NULL,
+                callback_url TEXT,
+                status TEXT NOT NULL,
+                batch_id TEXT,
+                result TEXT,
+                error TEXT,
+                input_tokens INTEGER NOT NULL DEFAULT 0,
+                output_tokens INTEGER NOT NULL DEFAULT 0,
+                cost REAL NOT NULL DEFAULT 0,
+                created_at REAL NOT NULL,
+                claimed_at REAL,
+                completed_at REAL
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status, group_key, created_at)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_agent ON jobs(agent_id, created_at)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_batch ON jobs(batch_id)")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS batches (
+                batch_id TEXT PRIMARY KEY,
+                service TEXT NOT NULL,
+                endpoint TEXT NOT NULL,
+                jobs INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                polled_at REAL NOT NULL
+            )
+        """)
+        self.lock = threading.Lock()
+
+    def _transaction(self, fn: Callable[[], Any]) -> Any:
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = fn()
+                self.conn.execute("COMMIT")
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+            return result
+
+    def add(self, jobs: List[Dict[str, Any]]):
+        def insert():
+            self.conn.executemany("""
+                INSERT INTO jobs (job_id, agent_id, service, endpoint, model, mode, group_key, body,
+                                  callback_url, status, created_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, 'queued', ?)
+            """, [
+                (job["job_id"], job["agent_id"], job["service"], job["endpoint"], job["model"], job["mode"],
+                 job["group_key"], json.dumps(job["body"]), job["callback_url"], job["created_at"])
+                for job in jobs
+            ])
+        self._transaction(insert)
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self.lock:
+            row = self.conn.execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return dict(row) if row else None
+
+    def list(self, agent_id: Optional[str] = None, status: Optional[str] = None,
+             limit: int = 100) -> List[Dict[str, Any]]:
+        query, args = "SELECT * FROM jobs WHERE 1 = 1", []
+        if agent_id:
+            query += " AND agent_id = ?"
+            args.append(agent_id)
+        if status:
+            query += " AND status = ?"
+            args.append(status)
+        query += " ORDER BY created_at DESC LIMIT ?"
+        args.append(limit)
+        with self.lock:
+            return [dict(row) for row in self.conn.execute(query, args)]
+
+    def cancel(self, job_id: str) -> bool:
+        """Only jobs that have not been sent can be cancelled"""
+        with self.lock:
+            cursor = self.conn.execute(
+                "UPDATE jobs SET status = 'cancelled', completed_at = ? WHERE job_id = ? AND status = 'queued'",
+                (time.time(), job_id)
+            )
+        return cursor.rowcount > 0
+
+    def claim_due(self, max_items: int, max_wait: float) -> List[List[Dict[str, Any]]]:
+        """Claim up to max_items jobs from every group that is full or has waited long enough"""
+        def claim():
+            now = time.time()
+            groups = self.conn.execute("""
+                SELECT group_key, mode, COUNT(*) AS queued, MIN(created_at) AS oldest FROM jobs
+                WHERE status = 'queued'
+                  AND group_key NOT IN (
+                      SELECT group_key FROM jobs WHERE status = 'running' AND batch_id IS NULL
+                  )
+                GROUP BY group_key
+            """).fetchall()
+            claimed = []
+            for group in groups:
+                # Deferred jobs gain nothing from waiting; headroom gating happens when they run
+                if group["mode"] != "deferred" and group["queued"] < max_items and group["oldest"] > now - max_wait:
+                    continue
+                rows = [dict(row) for row in self.conn.execute(
+                    "SELECT * FROM jobs WHERE group_key = ? AND status = 'queued' ORDER BY created_at LIMIT ?",
+                    (group["group_key"], max_items)
+                )]
+                self.conn.executemany(
+                    "UPDATE jobs SET status = 'running', claimed_at = ? WHERE job_id = ?",
+                    [(now, row["job_id"]) for row in rows]
+                )
+                claimed.append(rows)
+            return claimed
+        return self._transaction(claim)
+
+    def requeue_stale(self) -> int:
+        """Pack/deferred jobs claimed by a worker that died mid-run go back to the queue"""
+        with self.lock:
+            cursor = self.conn.execute(
+                "UPDATE jobs SET status = 'queued', claimed_at = NULL "
+                "WHERE status = 'running' AND batch_id IS NULL AND claimed_at < ?",
+                (time.time() - CLAIM_TIMEOUT,)
+            )
+        return cursor.rowcount
+
+    def mark_submitted(self, job_ids: List[str], batch_id: str, service: str, endpoint: str):
+        def submit():
+            now = time.time()
+            self.conn.executemany(
+                "UPDATE jobs SET batch_id = ? WHERE job_id = ?", [(batch_id, job_id) for job_id in job_ids]
+            )
+            self.conn.execute(
+                "INSERT INTO batches (batch_id, service, endpoint, jobs, created_at, polled_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (batch_id, service, endpoint, len(job_ids), now, now)
+            )
+        self._transaction(submit)
+
+    def claim_polls(self, interval: float) -> List[Dict[str, Any]]:
+        """Provider batches due a status poll; claiming bumps polled_at so one worker polls each"""
+        def claim():
+            now = time.time()
+            rows = [dict(row) for row in self.conn.execute(
+                "SELECT * FROM batches WHERE polled_at <= ?", (now - interval,)
+            )]
+            self.conn.executemany(
+                "UPDATE batches SET polled_at = ? WHERE batch_id = ?", [(now, row["batch_id"]) for row in rows]
+            )
+            return rows
+        return self._transaction(claim)
+
+    def batch_jobs(self, batch_id: str) -> List[Dict[str, Any]]:
+        with self.lock:
+            return [dict(row) for row in self.conn.execute(
+                "SELECT * FROM jobs WHERE batch_id = ? AND status = 'running'", (batch_id,)
+            )]
+
+    def close_batch(self, batch_id: str):
+        with self.lock:
+            self.conn.execute("DELETE FROM batches WHERE batch_id = ?", (batch_id,))
+
+    def complete(self, job_id: str, result: Dict[str, Any], input_tokens: int, output_tokens: int, cost: float):
+        with self.lock:
+            self.conn.execute("""
+                UPDATE jobs SET status = 'completed', result = ?, input_tokens = ?, output_tokens = ?,
+                                cost = ?, completed_at = ?
+                WHERE job_id = ?
+            """, (json.dumps(result), input_tokens, output_tokens, cost, time.time(), job_id))
+
+    def fail(self, job_ids: List[str], error: str):
+        with self.lock:
+            self.conn.executemany(
+                "UPDATE jobs SET status = 'failed', error = ?, completed_at = ? WHERE job_id = ?",
+                [(error, time.time(), job_id) for job_id in job_ids]
+            )
+
+    def purge(self) -> int:
+        with self.lock:
+            cursor = self.conn.execute(
+                "DELETE FROM jobs WHERE status IN ('completed', 'failed', 'cancelled') AND completed_at < ?",
+                (time.time() - BATCH_RESULT_TTL_DAYS * 86400,)
+            )
+        return cursor.rowcount
+
+    def counts(self) -> Dict[str, int]:
+        with self.lock:
+            rows = self.conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+            batches = self.conn.execute("SELECT COUNT(*) FROM batches").fetchone()[0]
+        return {**{status: count for status, count in rows}, "open_provider_batches": batches}
+
+
+def job_view(job: Dict[str, Any]) -> Dict[str, Any]:
+    """Public shape of a job row"""
+    def iso(ts: Optional[float]) -> Optional[str]:
+        return datetime.utcfromtimestamp(ts).isoformat() if ts else None
+
+    return {
+        "job_id": job["job_id"],
+        "agent_id": job["agent_id"],
+        "service": job["service"],
+        "endpoint": job["endpoint"],
+        "model": job["model"],
+        "mode": job["mode"],
+        "status": job["status"],
+        "batch_id": job["batch_id"],
+        "data": json.loads(job["result"]) if job["result"] else None,
+        "error": job["error"],
+        "tokens_used": job["input_tokens"] + job["output_tokens"],
+        "cost": job["cost"],
+        "created_at": iso(job["created_at"]),
+        "completed_at": iso(job["completed_at"]),
+    }
+
+
+# =============================================================================
+# Provider Batch APIs
+# =============================================================================
+
+# poll() returns None while the batch is running, else {job_id: (response_body, error)};
+# "*" is the outcome for jobs missing from the output
+PollResult = Optional[Dict[str, Tuple[Optional[Dict[str, Any]], Optional[str]]]]
+
+
+class OpenAIBatchAPI:
+    """JSONL file upload + /v1/batches"""
+
+    def __init__(self, client: httpx.AsyncClient, base_url: str):
+        self.client = client
+        self.base_url = base_url
+        self.headers = auth_headers("openai")
+
+    async def submit(self, jobs: List[Dict[str, Any]]) -> str:
+        lines = "\n".join(
+            json.dumps({"custom_id": job["job_id"], "method": "POST", "url": job["endpoint"],
+                        "body": json.loads(job["body"])})
+            for job in jobs
+        )
+        response = await self.client.post(
+            f"{self.base_url}/v1/files", headers=self.headers,
+            files={"file": ("batch.jsonl", lines.encode(), "application/jsonl")}, data={"purpose": "batch"}
+        )
+        response.raise_for_status()
+        response = await self.client.post(
+            f"{self.base_url}/v1/batches", headers=self.headers,
+            json={"input_file_id": response.json()["id"], "endpoint": jobs[0]["endpoint"], "completion_window": "24h"}
+        )
+        response.raise_for_status()
+        return response.json()["id"]
+
+    async def poll(self, batch_id: str) -> PollResult:
+        response = await self.client.get(f"{self.base_url}/v1/batches/{batch_id}", headers=self.headers)
+        response.raise_for_status()
+        batch = response.json()
+        if batch["status"] in ("validating", "in_progress", "finalizing", "cancelling"):
+            return None
+
+        results: Dict[str, Tuple[Optional[Dict[str, Any]], Optional[str]]] = {}
+        for file_field in ("output_file_id", "error_file_id"):
+            if not batch.get(file_field):
+                continue
+            content = await self.client.get(
+                f"{self.base_url}/v1/files/{batch[file_field]}/content", headers=self.headers
+            )
+            content.raise_for_status()
+            for line in content.text.splitlines():
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                reply = record.get("response") or {}
+                if reply.get("status_code") == 200:
+                    results[record["custom_id"]] = (reply.get("body"), None)
+                else:
+                    error = record.get("error") or (reply.get("body") or {}).get("error") or "failed"
+                    results[record["custom_id"]] = (None, json.dumps(error) if not isinstance(error, str) else error)
+        if batch["status"] != "completed":
+            # expired, failed or cancelled: whatever did not finish fails with the batch status
+            results["*"] = (None, f"Batch {batch['status']}")
+        return results
+
+
+class AnthropicBatchAPI:
+    """/v1/messages/batches"""
+
+    def __init__(self, client: httpx.AsyncClient, base_url: str):
+        self.client = client
+        self.base_url = base_url
+        self.headers = auth_headers("anthropic")
+
+    async def submit(self, jobs: List[Dict[str, Any]]) -> str:
+        response = await self.client.post(
+            f"{self.base_url}/v1/messages/batches", headers=self.headers,
+            json={"requests": [{"custom_id": job["job_id"], "params": json.loads(job["body"])} for job in jobs]}
+        )
+        response.raise_for_status()
+        return response.json()["id"]
+
+    async def poll(self, batch_id: str) -> PollResult:
+        response = await self.client.get(f"{self.base_url}/v1/messages/batches/{batch_id}", headers=self.headers)
+        response.raise_for_status()
+        batch = response.json()
+        if batch["processing_status"] != "ended":
+            return None
+
+        results: Dict[str, Tuple[Optional[Dict[str, Any]], Optional[str]]] = {}
+        content = await self.client.get(batch["results_url"], headers=self.headers)
+        content.raise_for_status()
+        for line in content.text.splitlines():
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            outcome = record.get("result") or {}
+            if outcome.get("type") == "succeeded":
+                results[record["custom_id"]] = (outcome.get("message"), None)
+            else:
+                error = outcome.get("error") or outcome.get("type") or "failed"
+                results[record["custom_id"]] = (None, json.dumps(error) if not isinstance(error, str) else error)
+        return results
+
+
+def stub_response(service: str, endpoint: str, body: Dict[str, Any], model: str) -> Dict[str, Any]:
+    """Deterministic provider-shaped response with plausible usage"""
+    if "embed" in endpoint:
+        inputs = body.get("input")
+        inputs = inputs if isinstance(inputs, list) else [inputs]
+        data = []
+        for index, text in enumerate(inputs):
+            digest = hashlib.sha256(str(text).encode()).digest()
+            data.append({"object": "embedding", "index": index, "embedding": [b / 255 for b in digest[:8]]})
+        tokens = sum(approximate_tokens(str(text)) for text in inputs)
+        return {"object": "list", "data": data, "model": model,
+                "usage": {"prompt_tokens": tokens, "total_tokens": tokens}}
+
+    input_tokens = estimate_prompt_tokens(service, model, body)
+    text = f"[stub] {model} response"
+    output_tokens = approximate_tokens(text)
+    if service == "anthropic":
+        return {"type": "message", "role": "assistant", "model": model,
+                "content": [{"type": "text", "text": text}],
+                "usage": {"input_tokens": input_tokens, "output_tokens": output_tokens}}
+    if service == "google":
+        return {"candidates": [{"content": {"role": "model", "parts": [{"text": text}]}}],
+                "usageMetadata": {"promptTokenCount": input_tokens, "candidatesTokenCount": output_tokens}}
+    return {"object": "chat.completion", "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": input_tokens, "completion_tokens": output_tokens,
+                      "total_tokens": input_tokens + output_tokens}}
+
+
+class StubBatchAPI:
+    """Local stand-in for provider batch APIs; batches finish by the first poll"""
+
+    def __init__(self):
+        self.batches: Dict[str, List[Dict[str, Any]]] = {}
+
+    async def submit(self, jobs: List[Dict[str, Any]]) -> str:
+        batch_id = f"stub_{uuid.uuid4().hex[:12]}"
+        self.batches[batch_id] = jobs
+        return batch_id
+
+    async def poll(self, batch_id: str) -> PollResult:
+        jobs = self.batches.pop(batch_id, None)
+        if jobs is None:
+            # Submitted by a worker that has since restarted
+            return {}
+        return {
+            job["job_id"]: (stub_response(job["service"], job["endpoint"], json.loads(job["body"]), job["model"]), None)
+            for job in jobs
+        }
+
+
+# =============================================================================
+# Batch Lane
+# =============================================================================
+
+class BatchLane:
+    """Accumulates offline jobs and runs them off the real-time path"""
+
+    def __init__(self, store: BatchStore, client: httpx.AsyncClient, service_limits: Dict[str, Any],
+                 guards: Dict[str, Any], base_url: Callable[[str], str],
+                 extract_usage: Callable[[str, Dict[str, Any]], Tuple[int, int]],
+                 on_complete: Callable[[Dict[str, Any], int, int, float], Awaitable[float]],
+                 log_event: Callable[..., Awaitable[None]]):
+        """
+        await on_complete(job, input_tokens, output_tokens, discount) records usage
+        and returns the job's cost; log_event is the event bus logger.
+        """
+        self.store = store
+        self.client = client
+        self.service_limits = service_limits
+        self.guards = guards
+        self.base_url = base_url
+        self.extract_usage = extract_usage
+        self.on_complete = on_complete
+        self.log_event = log_event
+        self.stub = StubBatchAPI() if BATCH_PROVIDER == "stub" else None
+        self._tasks: set = set()
+        self._last_purge = 0.0
+        self.stats = defaultdict(int)
+
+    def unavailable_reason(self, service: str) -> Optional[str]:
+        """Why jobs for this service cannot be accepted, if they cannot"""
+        if self.stub or PROVIDER_KEYS.get(service):
+            return None
+        return f"Batch lane needs {KEY_VARS.get(service, 'an API key')} for {service}"
+
+    def submit(self, requests: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Queue jobs; each request has agent_id, service, endpoint, model, body, callback_url"""
+        now = time.time()
+        jobs = []
+        for request in requests:
+            mode = batch_mode(request["service"], request["endpoint"])
+            jobs.append({
+                **request,
+                "job_id": uuid.uuid4().hex,
+                "mode": mode,
+                "group_key": group_key(request["service"], request["endpoint"], mode, request["model"], request["body"]),
+                "created_at": now,
+            })
+        self.store.add(jobs)
+        self.stats["submitted"] += len(jobs)
+        return [{"job_id": job["job_id"], "mode": job["mode"], "status": "queued"} for job in jobs]
+
+    async def run(self):
+        """Flush due groups and poll provider batches until cancelled"""
+        requeued = self.store.requeue_stale()
+        if requeued:
+            print(f"Batch lane requeued {requeued} interrupted jobs")
+        while True:
+            try:
+                for jobs in self.store.claim_due(BATCH_MAX_ITEMS, BATCH_MAX_WAIT):
+                    self._spawn(self._dispatch(jobs))
+                for batch in self.store.claim_polls(BATCH_POLL_INTERVAL):
+                    self._spawn(self._poll(batch))
+                if time.time() - self._last_purge > 3600:
+                    self._last_purge = time.time()
+                    self.store.purge()
+                    self.store.requeue_stale()
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                print(f"Batch lane error: {e}")
+            await asyncio.sleep(BATCH_TICK)
+
+    def _spawn(self, coro: Awaitable[None]):
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _api(self, service: str):
+        if self.stub:
+            return self.stub
+        if service == "openai":
+            return OpenAIBatchAPI(self.client, self.base_url(service))
+        return AnthropicBatchAPI(self.client, self.base_url(service))
+
+    async def _dispatch(self, jobs: List[Dict[str, Any]]):
+        mode = jobs[0]["mode"]
+        try:
+            if mode == "provider":
+                batch_id = await self._api(jobs[0]["service"]).submit(jobs)
+                self.store.mark_submitted([job["job_id"] for job in jobs], batch_id, jobs[0]["service"], jobs[0]["endpoint"])
+                self.stats["provider_batches"] += 1
+            elif mode == "pack":
+                await self._run_packed(jobs)
+            else:
+                for job in jobs:
+                    await self._run_deferred(job)
+        except Exception as e:
+            print(f"Batch submission failed for {jobs[0]['service']}{jobs[0]['endpoint']}: {e}")
+            self.store.fail([job["job_id"] for job in jobs], f"Batch submission failed: {e}")
+            self.stats["failed"] += len(jobs)
+
+    async def _poll(self, batch: Dict[str, Any]):
+        try:
+            results = await self._api(batch["service"]).poll(batch["batch_id"])
+        except Exception as e:
+            print(f"Batch poll failed for {batch['batch_id']}: {e}")
+            return
+        if results is None:
+            return
+        for job in self.store.batch_jobs(batch["batch_id"]):
+            response, error = results.get(job["job_id"]) or results.get("*") or (None, "Missing from batch output")
+            await self._finish(job, response, error, BATCH_DISCOUNT)
+        self.store.close_batch(batch["batch_id"])
+
+    async def _wait_for_headroom(self, service: str, tokens: int) -> int:
+        """Block until the real-time buckets can spare this call above the reserve; returns the tokens taken"""
+        limits = self.service_limits[service]
+        bucket = limits.tpm_bucket
+        reserve = int(bucket.capacity * BATCH_TPM_RESERVE)
+        needed = int(min(tokens, max(0, bucket.capacity - reserve)))  # Oversized calls wait for an otherwise idle bucket
+        while True:
+            # Taking the reserve along with the call is the atomic "level - needed >= reserve" check;
+            # the reserve goes straight back
+            if await bucket.consume(needed + reserve):
+                await bucket.adjust(-reserve)
+                if await limits.rpm_bucket.consume(1):
+                    return needed
+                await bucket.adjust(-needed)
+            self.stats["headroom_waits"] += 1
+            await asyncio.sleep(1.0)
+
+    async def _call(self, service: str, endpoint: str, body: Dict[str, Any], model: str, tokens: int) -> Dict[str, Any]:
+        taken = await self._wait_for_headroom(service, tokens)
+        used = 0
+        try:
+            if self.stub:
+                data = stub_response(service, endpoint, body, model)
+            else:
+                request = lambda: self.client.post(
+                    f"{self.base_url(service)}{endpoint}", headers=auth_headers(service), json=body
+                )
+                guard = self.guards.get(service)
+                response = await (guard.send(request, timeout=BATCH_MAX_WAIT) if guard else request())
+                response.raise_for_status()
+                data = response.json()
+            input_tokens, output_tokens = self.extract_usage(service, data)
+            used = input_tokens + output_tokens
+        finally:
+            # Bulk calls still spend the real-time bucket; settle the headroom taken against actual use
+            await self.service_limits[service].tpm_bucket.adjust(used - taken)
+        return data
+
+    async def _run_packed(self, jobs: List[Dict[str, Any]]):
+        """Send embedding jobs as multi-input calls and split the results back out"""
+        call: List[Tuple[Dict[str, Any], List[Any]]] = []
+        count = 0
+        for job in jobs:
+            inputs = json.loads(job["body"]).get("input")
+            inputs = inputs if isinstance(inputs, list) else [inputs]
+            if call and count + len(inputs) > BATCH_EMBED_MAX_INPUTS:
+                await self._send_packed(call)
+                call, count = [], 0
+            call.append((job, inputs))
+            count += len(inputs)
+        if call:
+            await self._send_packed(call)
+
+    async def _send_packed(self, call: List[Tuple[Dict[str, Any], List[Any]]]):
+        first = call[0][0]
+        body = {**json.loads(first["body"]), "input": [item for _, inputs in call for item in inputs]}
+        estimates = [sum(approximate_tokens(str(item)) for item in inputs) or 1 for _, inputs in call]
+        try:
+            data = await self._call(first["service"], first["endpoint"], body, first["model"], sum(estimates))
+        except Exception as e:
+            self.store.fail([job["job_id"] for job, _ in call], str(e))
+            self.stats["failed"] += len(call)
+            return
+        self.stats["packed_calls"] += 1
+
+        vectors = sorted(data.get("data") or [], key=lambda item: item.get("index", 0))
+        total_tokens = (data.get("usage") or {}).get("prompt_tokens", 0)
+        offset = 0
+        for (job, inputs), estimate in zip(call, estimates):
+            # Provider usage covers the whole call; split it by each job's share of the input
+            tokens = round(total_tokens * estimate / sum(estimates))
+            result = {
+                "object": "list",
+                "data": [{**item, "index": index} for index, item in enumerate(vectors[offset:offset + len(inputs)])],
+                "model": data.get("model", job["model"]),
+                "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+            }
+            offset += len(inputs)
+            await self._finish(job, result, None, 1.0)
+
+    async def _run_deferred(self, job: Dict[str, Any]):
+        body = json.loads(job["body"])
+        estimate = (estimate_prompt_tokens(job["service"], job["model"], body)
+                    + estimate_output_tokens(job["endpoint"], body))
+        try:
+            data = await self._call(job["service"], job["endpoint"], body, job["model"], estimate)
+        except Exception as e:
+            await self._finish(job, None, str(e), 1.0)
+            return
+        await self._finish(job, data, None, 1.0)
+
+    async def _finish(self, job: Dict[str, Any], response: Optional[Dict[str, Any]], error: Optional[str],
+                      discount: float):
+        if error or response is None:
+            self.store.fail([job["job_id"]], error or "No response")
+            self.stats["failed"] += 1
+        else:
+            input_tokens, output_tokens = self.extract_usage(job["service"], response)
+            cost = await self.on_complete(job, input_tokens, output_tokens, discount)
+            self.store.complete(job["job_id"], response, input_tokens, output_tokens, cost)
+            self.stats["completed"] += 1
+            # Not awaited: a slow event bus must not hold up a 500-job batch
+            self._spawn(self.log_event(
+                "api_request",
+                target=job["service"],
+                details={
+                    "agent_id": job["agent_id"],
+                    "endpoint": job["endpoint"],
+                    "model": job["model"],
+                    "tokens": input_tokens + output_tokens,
+                    "cost": cost,
+                    "batch": job["mode"]
+                }
+            ))
+        if job.get("callback_url"):
+            self._spawn(self._callback(job["job_id"], job["callback_url"]))
+
+    async def _callback(self, job_id: str, url: str):
+        payload = job_view(self.store.get(job_id))
+        for attempt in range(CALLBACK_ATTEMPTS):
+            try:
+                response = await self.client.post(url, json=payload, timeout=10.0)
+                if response.status_code < 500:
+                    self.stats["callbacks_sent"] += 1
+                    return
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(2 ** attempt)
+        self.stats["callbacks_failed"] += 1
+        print(f"Batch callback to {url} failed for job {job_id}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "provider": BATCH_PROVIDER,
+            "jobs": self.store.counts(),
+            "max_items": BATCH_MAX_ITEMS,
+            "max_wait_seconds": BATCH_MAX_WAIT,
+            "tpm_reserve": BATCH_TPM_RESERVE,
+            "discount": BATCH_DISCOUNT,
+            **self.stats,
+        }
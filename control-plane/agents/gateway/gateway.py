@@ -8,6 +8,16 @@ A rate limiter and API gateway for all external API calls with:
 - Per-agent quotas
 - Request queuing when near limits
 - Cost tracking integration
+- Response cache for deterministic requests
+- Single-flight coalescing of identical in-flight requests
+- Streaming pass-through with incremental token and cost accounting
+- Weighted fair queueing (deficit round robin) across agents
+- Pluggable limiter state (memory, SQLite, Redis) for multi-worker deployments
+- Gateway-side token estimates, reconciled with actual usage after each response
+- Per-provider adaptive concurrency, jittered retries and circuit breaking
+- Offline batch lane: provider batch APIs and packed embedding calls for bulk work
+- Automatic Anthropic prompt-cache breakpoints and cached-input pricing
+- Latency histograms (queue wait, upstream, TTFT, tokens) with a Prometheus /metrics endpoint
 """
 
 import os
@@ -17,14 +27,26 @@ import asyncio
 import time
 from datetime import datetime, timedelta
 from collections import defaultdict
-from typing import Optional, Dict, Any, List
+from typing import Optional, Dict, Any, List, Tuple
 from dataclasses import dataclass, field
 from contextlib import asynccontextmanager
 from enum import Enum
 
 from fastapi import FastAPI, HTTPException, BackgroundTasks, Request, Response
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel, Field
 
+from response_cache import ResponseCache, CACHE_ENABLED, canonical_key, is_deterministic
+from single_flight import SingleFlight
+from streaming import StreamMeter, stream_body, stream_endpoint
+from scheduler import FairQueue
+from limiter_backend import MemoryBackend, create_backend
+from token_estimator import estimate_prompt_tokens, estimate_output_tokens
+from resilience import ProviderGuard, CircuitOpenError
+from batch_lane import BatchLane, BatchStore, BATCH_ENABLED, job_view
+from prompt_cache import PromptCacheHints, PROMPT_CACHE_ENABLED
+from metrics import GatewayMetrics, render_samples, CONTENT_TYPE as METRICS_CONTENT_TYPE
+
 
 # =============================================================================
 # Configuration
@@ -57,8 +79,15 @@ AGENT_QUOTA_PERCENT = float(os.getenv("AGENT_QUOTA_PERCENT", "20"))  # Each agen
 
 # Queue settings
 MAX_QUEUE_SIZE = int(os.getenv("MAX_QUEUE_SIZE", "100"))
+MAX_AGENT_QUEUE_SIZE = int(os.getenv("MAX_AGENT_QUEUE_SIZE", str(max(1, MAX_QUEUE_SIZE // 4))))  # Per agent, per service
 QUEUE_TIMEOUT = int(os.getenv("QUEUE_TIMEOUT", "30"))  # seconds
 
+# Used when the request body has nothing the estimator can count
+DEFAULT_ESTIMATED_TOKENS = 1000
+
+# Share one upstream call between identical concurrent requests
+COALESCE_ENABLED = os.getenv("GATEWAY_COALESCE_ENABLED", "true").lower() == "true"
+
 # Pricing for cost tracking (per 1M tokens)
 PRICING = {
     "openai": {
@@ -81,6 +110,13 @@ PRICING = {
     }
 }
 
+# Prompt-cache reads and writes, as multiples of the model's input price
+CACHE_PRICING = {
+    "openai": {"read": 0.5, "write": 1.0},
+    "anthropic": {"read": 0.1, "write": 1.25},
+    "google": {"read": 0.25, "write": 1.0},
+}
+
 
 # =============================================================================
 # Data Classes & Models
@@ -94,79 +130,73 @@ class ServiceType(str, Enum):
 
 @dataclass
 class TokenBucket:
-    """Token bucket for rate limiting"""
+    """Token bucket for rate limiting; the level lives in the limiter backend"""
     capacity: int
-    tokens: float = field(default=0)
-    last_update: float = field(default_factory=time.time)
+    key: str = ""
+    backend: Any = field(default_factory=MemoryBackend, repr=False)
     refill_rate: float = field(default=0)  # tokens per second
 
     def __post_init__(self):
-        self.tokens = float(self.capacity)
         self.refill_rate = self.capacity / 60.0  # Refill over 1 minute
+        self.key = self.key or f"bucket-{id(self)}"
 
-    def consume(self, amount: int) -> bool:
+    async def consume(self, amount: int) -> bool:
         """Try to consume tokens, returns True if successful"""
-        self._refill()
-        if self.tokens >= amount:
-            self.tokens -= amount
-            return True
-        return False
+        taken, _ = await self.backend.take(self.key, self.capacity, self.refill_rate, amount)
+        return taken
 
-    def _refill(self):
-        """Refill tokens based on elapsed time"""
-        now = time.time()
-        elapsed = now - self.last_update
-        self.tokens = min(self.capacity, self.tokens + elapsed * self.refill_rate)
-        self.last_update = now
-
-    def available(self) -> float:
+    async def available(self) -> float:
         """Get available tokens"""
-        self._refill()
-        return self.tokens
+        return (await self.backend.take(self.key, self.capacity, self.refill_rate, 0))[1]
+
+    async def adjust(self, amount: int):
+        """Charge (positive) or refund (negative) tokens unconditionally; the level may go negative"""
+        await self.backend.take(self.key, self.capacity, self.refill_rate, amount, force=True)
 
-    def time_until_available(self, amount: int) -> float:
+    async def time_until_available(self, amount: int) -> float:
         """Calculate seconds until requested tokens are available"""
-        self._refill()
-        if self.tokens >= amount:
+        tokens = await self.available()
+        if tokens >= amount:
             return 0
-        needed = amount - self.tokens
+        needed = amount - tokens
         return needed / self.refill_rate
 
 
 @dataclass
 class ServiceLimits:
     """Rate limits for a service"""
+    service: str
     tpm_bucket: TokenBucket
     rpm_bucket: TokenBucket
-    daily_tokens_used: int = 0
     daily_limit: int = 0
-    last_daily_reset: datetime = field(default_factory=lambda: datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0))
-
-    def reset_daily_if_needed(self):
-        """Reset daily counters if it's a new day"""
-        today = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
-        if today > self.last_daily_reset:
-            self.daily_tokens_used = 0
-            self.last_daily_reset = today
+    backend: Any = field(default_factory=MemoryBackend, repr=False)
+
+    async def daily_tokens_used(self) -> int:
+        """Tokens used today across every worker sharing the backend"""
+        return int((await self.backend.get_usage()).get(f"service:{self.service}:tokens", 0))
+
+    async def status(self, queue_size: int) -> "LimitStatus":
+        tokens_used = await self.daily_tokens_used()
+        return LimitStatus(
+            service=self.service,
+            tpm_available=round(await self.tpm_bucket.available(), 2),
+            tpm_limit=self.tpm_bucket.capacity,
+            rpm_available=round(await self.rpm_bucket.available(), 2),
+            rpm_limit=self.rpm_bucket.capacity,
+            daily_tokens_used=tokens_used,
+            daily_limit=self.daily_limit,
+            daily_percent_used=round((tokens_used / self.daily_limit) * 100, 2) if self.daily_limit > 0 else 0,
+            queue_size=queue_size
+        )
 
 
 @dataclass
 class AgentQuota:
-    """Per-agent quota tracking"""
+    """Per-agent usage for the current UTC day (a snapshot of the backend counters)"""
     agent_id: str
     tokens_used_today: int = 0
     requests_today: int = 0
     cost_today: float = 0.0
-    last_reset: datetime = field(default_factory=lambda: datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0))
-
-    def reset_if_needed(self):
-        """Reset counters if it's a new day"""
-        today = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
-        if today > self.last_reset:
-            self.tokens_used_today = 0
-            self.requests_today = 0
-            self.cost_today = 0.0
-            self.last_reset = today
 
 
 @dataclass
@@ -179,6 +209,7 @@ class QueuedRequest:
     request_data: Dict[str, Any]
     created_at: datetime
     future: asyncio.Future
+    priority: int = 5
 
 
 class ProxyRequest(BaseModel):
@@ -189,8 +220,16 @@ class ProxyRequest(BaseModel):
     headers: Dict[str, str] = Field(default_factory=dict)
     body: Dict[str, Any] = Field(default_factory=dict)
     agent_id: str = Field(default="unknown", description="ID of requesting agent")
-    estimated_tokens: int = Field(default=1000, description="Estimated token usage")
+    estimated_tokens: Optional[int] = Field(
+        default=None,
+        description="Fallback token estimate; the gateway estimates from the body when it can"
+    )
     priority: int = Field(default=5, ge=1, le=10, description="Priority 1-10 (1=highest)")
+    cache_control: Optional[str] = Field(
+        default=None,
+        description="no-cache: skip cache lookup but store the response; "
+                    "no-store: bypass the cache and in-flight coalescing"
+    )
 
 
 class ProxyResponse(BaseModel):
@@ -203,6 +242,17 @@ class ProxyResponse(BaseModel):
     cost: float = 0.0
     queue_time_ms: int = 0
     request_time_ms: int = 0
+    cached: bool = False
+    coalesced: bool = False
+
+
+class BatchRequest(BaseModel):
+    """Low-priority request for the offline batch lane"""
+    service: ServiceType = Field(..., description="Target service (openai, anthropic, google)")
+    endpoint: str = Field(..., description="API endpoint path")
+    body: Dict[str, Any] = Field(default_factory=dict)
+    agent_id: str = Field(default="unknown", description="ID of requesting agent")
+    callback_url: Optional[str] = Field(default=None, description="POSTed the finished job")
 
 
 class LimitStatus(BaseModel):
@@ -226,24 +276,34 @@ class GatewayState:
     """Global gateway state"""
 
     def __init__(self):
+        # Rate limit and quota state, shared between workers unless the backend is "memory"
+        self.limiter = create_backend()
+
         # Service rate limits
         self.service_limits: Dict[str, ServiceLimits] = {}
         for service, config in RATE_LIMITS.items():
             self.service_limits[service] = ServiceLimits(
-                tpm_bucket=TokenBucket(capacity=config["tpm"]),
-                rpm_bucket=TokenBucket(capacity=config["rpm"]),
-                daily_limit=config["daily_tokens"]
+                service=service,
+                tpm_bucket=TokenBucket(capacity=config["tpm"], key=f"{service}:tpm", backend=self.limiter),
+                rpm_bucket=TokenBucket(capacity=config["rpm"], key=f"{service}:rpm", backend=self.limiter),
+                daily_limit=config["daily_tokens"],
+                backend=self.limiter
             )
 
-        # Per-agent quotas
-        self.agent_quotas: Dict[str, AgentQuota] = defaultdict(lambda: AgentQuota(agent_id="unknown"))
-
-        # Request queues (per service)
-        self.queues: Dict[str, asyncio.PriorityQueue] = {
-            service: asyncio.PriorityQueue(maxsize=MAX_QUEUE_SIZE)
+        # Request queues (per service, fair-shared between agents)
+        self.queues: Dict[str, FairQueue] = {
+            service: FairQueue(maxsize=MAX_QUEUE_SIZE, agent_maxsize=MAX_AGENT_QUEUE_SIZE)
             for service in RATE_LIMITS.keys()
         }
 
+        # Upstream concurrency, retries and circuit breaking (per process)
+        self.providers: Dict[str, ProviderGuard] = {
+            service: ProviderGuard(service) for service in RATE_LIMITS.keys()
+        }
+
+        # Latency and size histograms (p50/p95/p99 in /stats, Prometheus on /metrics)
+        self.metrics = GatewayMetrics()
+
         # Statistics
         self.stats = {
             "total_requests": 0,
@@ -258,18 +318,69 @@ class GatewayState:
             "tokens_by_agent": defaultdict(int),
             "cost_by_service": defaultdict(float),
             "cost_by_agent": defaultdict(float),
+            "cache_hits": 0,
+            "coalesced_requests": 0,
+            "streamed_requests": 0,
+            "stream_ttft_ms_total": 0,
+            "stream_ttft_samples": 0,
+            "estimated_tokens": 0,
+            "reconciled_tokens": 0,
+            "estimate_abs_error": 0,
+            "batch_requests": 0,
+            "batch_saved_cost": 0.0,
+            "prompt_cache_read_tokens": 0,
+            "prompt_cache_write_tokens": 0,
+            "prompt_cache_savings": 0.0,
             "start_time": datetime.utcnow().isoformat(),
         }
 
+        # Deterministic response cache
+        self.response_cache: Optional[ResponseCache] = ResponseCache() if CACHE_ENABLED else None
+
+        # In-flight request coalescing
+        self.single_flight: Optional[SingleFlight] = SingleFlight() if COALESCE_ENABLED else None
+
         # Active HTTP client
         self.http_client: Optional[httpx.AsyncClient] = None
 
+        # Cache breakpoints for repeated Anthropic prompt prefixes
+        self.prompt_cache: Optional[PromptCacheHints] = PromptCacheHints() if PROMPT_CACHE_ENABLED else None
+
+        # Offline lane for bulk work (started with the HTTP client)
+        self.batch_lane: Optional[BatchLane] = None
+
+    async def agent_quotas(self) -> Dict[str, AgentQuota]:
+        """Today's usage per agent, from the limiter backend"""
+        quotas: Dict[str, AgentQuota] = {}
+        for name, value in (await self.limiter.get_usage()).items():
+            kind, _, rest = name.partition(":")
+            agent_id, _, metric = rest.rpartition(":")
+            if kind != "agent":
+                continue
+            quota = quotas.setdefault(agent_id, AgentQuota(agent_id=agent_id))
+            if metric == "tokens":
+                quota.tokens_used_today = int(value)
+            elif metric == "requests":
+                quota.requests_today = int(value)
+            elif metric == "cost":
+                quota.cost_today = value
+        return quotas
+
+    async def agent_quota(self, agent_id: str) -> AgentQuota:
+        return (await self.agent_quotas()).get(agent_id) or AgentQuota(agent_id=agent_id)
+
     async def start(self):
         """Initialize async resources"""
         self.http_client = httpx.AsyncClient(timeout=60.0)
         # Start queue processors
         for service in RATE_LIMITS.keys():
             asyncio.create_task(self._process_queue(service))
+        if BATCH_ENABLED:
+            self.batch_lane = BatchLane(
+                BatchStore(), self.http_client, self.service_limits, self.providers,
+                get_base_url, extract_token_usage, record_batch_usage, log_to_event_bus
+            )
+            asyncio.create_task(self.batch_lane.run())
 
     async def stop(self):
         """Cleanup async resources"""
@@ -283,21 +394,41 @@ class GatewayState:
 
         while True:
             try:
-                # Get next request from queue
-                priority, created_at, request = await queue.get()
+                # Get next request, fair-shared between agents
+                request = await queue.get()
+
+                # Caller already gave up (timed out or disconnected)
+                if request.future.done():
+                    continue
 
                 # Check if request has timed out
-                elapsed = (datetime.utcnow() - created_at).total_seconds()
+                elapsed = (datetime.utcnow() - request.created_at).total_seconds()
                 if elapsed > QUEUE_TIMEOUT:
                     request.future.set_exception(
                         HTTPException(status_code=408, detail="Request timed out in queue")
                     )
                     continue
 
-                # Wait for rate limit availability
-                wait_time = limits.tpm_bucket.time_until_available(request.estimated_tokens)
-                if wait_time > 0:
-                    await asyncio.sleep(min(wait_time, 1.0))
+                # Take token capacity (a full bucket for requests larger than it) and a request slot
+                # before releasing the caller, so requests released together cannot share them
+                needed = min(request.estimated_tokens, limits.tpm_bucket.capacity)
+                taken = False
+                while not request.future.done():
+                    taken = await take_capacity(limits, needed)
+                    if taken:
+                        break
+                    wait_time = max(
+                        await limits.tpm_bucket.time_until_available(needed),
+                        await limits.rpm_bucket.time_until_available(1)
+                    )
+                    await asyncio.sleep(min(max(wait_time, 0.01), 1.0))
+
+                if request.future.done():
+                    if taken:
+                        # Caller gave up while we waited; hand the capacity back
+                        await limits.tpm_bucket.adjust(-needed)
+                        await limits.rpm_bucket.adjust(-1)
+                    continue
 
                 # Mark request as ready to proceed
                 request.future.set_result(True)
@@ -352,12 +483,20 @@ def get_base_url(service: str) -> str:
     return urls.get(service, "")
 
 
-def calculate_cost(service: str, model: str, input_tokens: int, output_tokens: int) -> float:
-    """Calculate cost for a request"""
+def calculate_cost(service: str, model: str, input_tokens: int, output_tokens: int,
+                   cache_read_tokens: int = 0, cache_write_tokens: int = 0) -> float:
+    """Calculate cost for a request; input_tokens include any cache reads and writes"""
     service_pricing = PRICING.get(service, {})
     model_pricing = service_pricing.get(model, {"input": 0, "output": 0})
-
-    input_cost = (input_tokens / 1_000_000) * model_pricing["input"]
+    cache_pricing = CACHE_PRICING.get(service, {"read": 1.0, "write": 1.0})
+
+    uncached_tokens = max(0, input_tokens - cache_read_tokens - cache_write_tokens)
+    billed_input = (
+        uncached_tokens
+        + cache_read_tokens * cache_pricing["read"]
+        + cache_write_tokens * cache_pricing["write"]
+    )
+    input_cost = (billed_input / 1_000_000) * model_pricing["input"]
     output_cost = (output_tokens / 1_000_000) * model_pricing["output"]
 
     return round(input_cost + output_cost, 6)
@@ -370,8 +509,14 @@ def extract_token_usage(service: str, response_data: Dict[str, Any]) -> tuple:
         return usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0)
 
     elif service == "anthropic":
+        # input_tokens excludes the cached prefix; count it like the other providers do
         usage = response_data.get("usage", {})
-        return usage.get("input_tokens", 0), usage.get("output_tokens", 0)
+        input_tokens = (
+            usage.get("input_tokens", 0)
+            + (usage.get("cache_read_input_tokens") or 0)
+            + (usage.get("cache_creation_input_tokens") or 0)
+        )
+        return input_tokens, usage.get("output_tokens", 0)
 
     elif service == "google":
         usage = response_data.get("usageMetadata", {})
@@ -380,6 +525,22 @@ def extract_token_usage(service: str, response_data: Dict[str, Any]) -> tuple:
     return 0, 0
 
 
+def extract_cache_usage(service: str, response_data: Dict[str, Any]) -> Tuple[int, int]:
+    """(cache_read, cache_write) input tokens from API response"""
+    if service == "openai":
+        details = response_data.get("usage", {}).get("prompt_tokens_details") or {}
+        return details.get("cached_tokens") or 0, 0
+
+    elif service == "anthropic":
+        usage = response_data.get("usage", {})
+        return usage.get("cache_read_input_tokens") or 0, usage.get("cache_creation_input_tokens") or 0
+
+    elif service == "google":
+        return response_data.get("usageMetadata", {}).get("cachedContentTokenCount") or 0, 0
+
+    return 0, 0
+
+
 def extract_model(service: str, request_body: Dict[str, Any]) -> str:
     """Extract model name from request"""
     if service == "openai":
@@ -391,6 +552,82 @@ def extract_model(service: str, request_body: Dict[str, Any]) -> str:
     return "unknown"
 
 
+def estimate_tokens(req: ProxyRequest, service: str, model: str) -> int:
+    """Gateway-side estimate; the caller's value is only used when the body has nothing to count"""
+    prompt_tokens = estimate_prompt_tokens(service, model, req.body)
+    if not prompt_tokens:
+        return req.estimated_tokens or DEFAULT_ESTIMATED_TOKENS
+    return prompt_tokens + estimate_output_tokens(req.endpoint, req.body)
+
+
+async def take_capacity(limits: ServiceLimits, tokens: int) -> bool:
+    """Atomically take TPM tokens and a request slot, or neither"""
+    if not await limits.tpm_bucket.consume(tokens):
+        return False
+    if not await limits.rpm_bucket.consume(1):
+        await limits.tpm_bucket.adjust(-tokens)
+        return False
+    return True
+
+
+async def reconcile_tokens(limits: ServiceLimits, estimated: int, actual: int):
+    """Settle the TPM bucket with real usage: refund over-estimates, charge under-estimates"""
+    await limits.tpm_bucket.adjust(actual - estimated)
+    state.stats["estimated_tokens"] += estimated
+    state.stats["reconciled_tokens"] += actual
+    state.stats["estimate_abs_error"] += abs(actual - estimated)
+
+
+async def record_usage(service: str, agent_id: str, tokens: int, cost: float, requests: int = 0):
+    """Add tokens and cost to the service, agent and daily counters"""
+    state.stats["total_tokens"] += tokens
+    state.stats["total_cost"] += cost
+    state.stats["tokens_by_service"][service] += tokens
+    state.stats["tokens_by_agent"][agent_id] += tokens
+    state.stats["cost_by_service"][service] += cost
+    state.stats["cost_by_agent"][agent_id] += cost
+    await state.limiter.add_usage({
+        f"service:{service}:tokens": tokens,
+        f"agent:{agent_id}:tokens": tokens,
+        f"agent:{agent_id}:cost": cost,
+        f"agent:{agent_id}:requests": requests,
+    })
+
+
+def record_prompt_cache(service: str, model: str, input_tokens: int, output_tokens: int,
+                        cache_read: int, cache_write: int):
+    """Track prompt-cache tokens and what they saved against uncached pricing"""
+    if not cache_read and not cache_write:
+        return
+    state.stats["prompt_cache_read_tokens"] += cache_read
+    state.stats["prompt_cache_write_tokens"] += cache_write
+    state.stats["prompt_cache_savings"] += (
+        calculate_cost(service, model, input_tokens, output_tokens)
+        - calculate_cost(service, model, input_tokens, output_tokens, cache_read, cache_write)
+    )
+
+
+def prompt_cache_body(req: ProxyRequest, service: str, model: str) -> Dict[str, Any]:
+    """Request body with cache breakpoints on repeated Anthropic prompt prefixes"""
+    if not state.prompt_cache or service != "anthropic" or not req.endpoint.startswith("/v1/messages"):
+        return req.body
+    return state.prompt_cache.annotate(req.agent_id, model, req.body) or req.body
+
+
+async def record_batch_usage(job: Dict[str, Any], input_tokens: int, output_tokens: int, discount: float) -> float:
+    """Account a finished batch job; returns its (discounted) cost"""
+    full_cost = calculate_cost(job["service"], job["model"], input_tokens, output_tokens)
+    cost = round(full_cost * discount, 6)
+    state.stats["total_requests"] += 1
+    state.stats["successful_requests"] += 1
+    state.stats["batch_requests"] += 1
+    state.stats["batch_saved_cost"] += full_cost - cost
+    state.stats["requests_by_service"][job["service"]] += 1
+    state.stats["requests_by_agent"][job["agent_id"]] += 1
+    await record_usage(job["service"], job["agent_id"], input_tokens + output_tokens, cost, requests=1)
+    return cost
+
+
 async def log_to_event_bus(action: str, target: str = "", details: dict = None):
     """Log event to event bus"""
     if not state or not state.http_client:
@@ -428,6 +665,7 @@ async def health():
         "port": 8070,
         "timestamp": datetime.utcnow().isoformat(),
         "queue_sizes": queue_sizes,
+        "circuits": {service: guard.breaker.state for service, guard in state.providers.items()} if state else {},
         "uptime_seconds": (datetime.utcnow() - datetime.fromisoformat(state.stats["start_time"])).total_seconds() if state else 0
     }
 
@@ -440,18 +678,7 @@ async def get_all_limits():
 
     limits = {}
     for service, service_limits in state.service_limits.items():
-        service_limits.reset_daily_if_needed()
-        limits[service] = LimitStatus(
-            service=service,
-            tpm_available=round(service_limits.tpm_bucket.available(), 2),
-            tpm_limit=service_limits.tpm_bucket.capacity,
-            rpm_available=round(service_limits.rpm_bucket.available(), 2),
-            rpm_limit=service_limits.rpm_bucket.capacity,
-            daily_tokens_used=service_limits.daily_tokens_used,
-            daily_limit=service_limits.daily_limit,
-            daily_percent_used=round((service_limits.daily_tokens_used / service_limits.daily_limit) * 100, 2) if service_limits.daily_limit > 0 else 0,
-            queue_size=state.queues[service].qsize()
-        )
+        limits[service] = await service_limits.status(state.queues[service].qsize())
 
     return {"limits": limits, "timestamp": datetime.utcnow().isoformat()}
 
@@ -467,12 +694,10 @@ async def get_service_limits(service: str):
         raise HTTPException(status_code=404, detail=f"Unknown service: {service}")
 
     service_limits = state.service_limits[service]
-    service_limits.reset_daily_if_needed()
 
     # Get per-agent breakdown
     agent_usage = {}
-    for agent_id, quota in state.agent_quotas.items():
-        quota.reset_if_needed()
+    for agent_id, quota in (await state.agent_quotas()).items():
         agent_usage[agent_id] = {
             "tokens_today": quota.tokens_used_today,
             "requests_today": quota.requests_today,
@@ -481,47 +706,20 @@ async def get_service_limits(service: str):
 
     return {
         "service": service,
-        "limits": LimitStatus(
-            service=service,
-            tpm_available=round(service_limits.tpm_bucket.available(), 2),
-            tpm_limit=service_limits.tpm_bucket.capacity,
-            rpm_available=round(service_limits.rpm_bucket.available(), 2),
-            rpm_limit=service_limits.rpm_bucket.capacity,
-            daily_tokens_used=service_limits.daily_tokens_used,
-            daily_limit=service_limits.daily_limit,
-            daily_percent_used=round((service_limits.daily_tokens_used / service_limits.daily_limit) * 100, 2) if service_limits.daily_limit > 0 else 0,
-            queue_size=state.queues[service].qsize()
-        ),
+        "limits": await service_limits.status(state.queues[service].qsize()),
         "agent_usage": agent_usage,
         "timestamp": datetime.utcnow().isoformat()
     }
 
 
-@app.post("/request", response_model=ProxyResponse)
-async def proxy_request(req: ProxyRequest):
-    """Proxy a request through the gateway with rate limiting"""
-    if not state:
-        raise HTTPException(status_code=503, detail="Gateway not initialized")
-
-    start_time = time.time()
+async def admit_request(req: ProxyRequest, limits: ServiceLimits, agent_quota: AgentQuota,
+                        start_time: float) -> Tuple[Optional[ProxyResponse], int]:
+    """Check quotas and wait for rate limit capacity; returns (rejection, queue_time_ms)"""
     queue_time = 0
     service = req.service.value
 
-    # Get service limits
-    limits = state.service_limits.get(service)
-    if not limits:
-        raise HTTPException(status_code=400, detail=f"Unknown service: {service}")
-
-    # Reset daily limits if needed
-    limits.reset_daily_if_needed()
-
-    # Get/create agent quota
-    agent_quota = state.agent_quotas[req.agent_id]
-    agent_quota.agent_id = req.agent_id
-    agent_quota.reset_if_needed()
-
     # Check daily limit
-    if limits.daily_tokens_used + req.estimated_tokens > limits.daily_limit:
+    if await limits.daily_tokens_used() + req.estimated_tokens > limits.daily_limit:
         state.stats["failed_requests"] += 1
         return ProxyResponse(
             success=False,
@@ -529,7 +727,7 @@ async def proxy_request(req: ProxyRequest):
             error=f"Daily token limit exceeded for {service}",
             queue_time_ms=0,
             request_time_ms=int((time.time() - start_time) * 1000)
-        )
+        ), 0
 
     # Check per-agent quota (as percentage of daily limit)
     max_agent_tokens = int(limits.daily_limit * (AGENT_QUOTA_PERCENT / 100))
@@ -541,20 +739,23 @@ async def proxy_request(req: ProxyRequest):
             error=f"Agent {req.agent_id} quota exceeded ({AGENT_QUOTA_PERCENT}% of daily limit)",
             queue_time_ms=0,
             request_time_ms=int((time.time() - start_time) * 1000)
-        )
+        ), 0
 
-    # Try to acquire rate limit tokens
-    if not limits.rpm_bucket.consume(1):
+    # Try to acquire rate limit tokens; each take is atomic so concurrent callers cannot share them
+    needed = min(req.estimated_tokens, limits.tpm_bucket.capacity)
+    if not await take_capacity(limits, needed):
         # Queue the request
-        if state.queues[service].full():
+        queue = state.queues[service]
+        if queue.full() or queue.agent_full(req.agent_id):
             state.stats["failed_requests"] += 1
             return ProxyResponse(
                 success=False,
                 status_code=503,
-                error="Request queue is full",
+                error="Request queue is full" if queue.full()
+                else f"Agent {req.agent_id} has {MAX_AGENT_QUEUE_SIZE} requests queued for {service}",
                 queue_time_ms=0,
                 request_time_ms=int((time.time() - start_time) * 1000)
-            )
+            ), 0
 
         # Add to queue
         queue_start = time.time()
@@ -566,70 +767,108 @@ async def proxy_request(req: ProxyRequest):
             estimated_tokens=req.estimated_tokens,
             request_data=req.body,
             created_at=datetime.utcnow(),
-            future=future
+            future=future,
+            priority=req.priority
         )
 
-        await state.queues[service].put((req.priority, queued_req.created_at, queued_req))
+        queue.put_nowait(queued_req)
         state.stats["queued_requests"] += 1
 
         try:
             await asyncio.wait_for(future, timeout=QUEUE_TIMEOUT)
         except asyncio.TimeoutError:
             state.stats["failed_requests"] += 1
+            state.metrics.queue_wait.observe((service, req.agent_id), (time.time() - queue_start) * 1000)
             return ProxyResponse(
                 success=False,
                 status_code=408,
                 error="Request timed out in queue",
                 queue_time_ms=int((time.time() - queue_start) * 1000),
                 request_time_ms=int((time.time() - start_time) * 1000)
-            )
+            ), 0
 
         queue_time = int((time.time() - queue_start) * 1000)
 
-    # Consume TPM tokens
-    limits.tpm_bucket.consume(req.estimated_tokens)
+    state.metrics.queue_wait.observe((service, req.agent_id), queue_time)
+
+    # `needed` is already taken; charge the rest of an estimate larger than the bucket.
+    # reconcile_tokens settles the whole estimate once actual usage is known.
+    if req.estimated_tokens > needed:
+        await limits.tpm_bucket.adjust(req.estimated_tokens - needed)
+
+    return None, queue_time
+
+
+def circuit_open_response(error: CircuitOpenError, start_time: float, queue_time: int = 0) -> ProxyResponse:
+    return ProxyResponse(
+        success=False,
+        status_code=503,
+        error=str(error),
+        queue_time_ms=queue_time,
+        request_time_ms=int((time.time() - start_time) * 1000)
+    )
+
+
+async def forward_request(req: ProxyRequest, limits: ServiceLimits, model: str,
+                          cache_key: Optional[str], start_time: float) -> ProxyResponse:
+    """Apply quotas and rate limits, then make the upstream call"""
+    service = req.service.value
+    req.estimated_tokens = estimate_tokens(req, service, model)
+    guard = state.providers[service]
+
+    # Fail fast while the provider's circuit is open instead of queueing behind it
+    try:
+        guard.check()
+    except CircuitOpenError as e:
+        return circuit_open_response(e, start_time)
+
+    rejection, queue_time = await admit_request(req, limits, await state.agent_quota(req.agent_id), start_time)
+    if rejection:
+        return rejection
 
     # Make the actual request
     request_start = time.time()
+    body = prompt_cache_body(req, service, model)
     try:
         base_url = get_base_url(service)
         url = f"{base_url}{req.endpoint}"
 
-        response = await state.http_client.request(
-            method=req.method,
-            url=url,
-            headers=req.headers,
-            json=req.body if req.method in ["POST", "PUT", "PATCH"] else None,
-            params=req.body if req.method == "GET" else None
+        response = await guard.send(
+            lambda: state.http_client.request(
+                method=req.method,
+                url=url,
+                headers=req.headers,
+                json=body if req.method in ["POST", "PUT", "PATCH"] else None,
+                params=body if req.method == "GET" else None
+            ),
+            timeout=QUEUE_TIMEOUT
         )
+        state.metrics.upstream_latency.observe((service, model), (time.time() - request_start) * 1000)
 
         response_data = response.json() if response.content else {}
 
         # Extract actual token usage
         input_tokens, output_tokens = extract_token_usage(service, response_data)
         total_tokens = input_tokens + output_tokens
+        await reconcile_tokens(limits, req.estimated_tokens, total_tokens)
+        state.metrics.tokens.observe((service, model), total_tokens)
+
+        # Calculate cost, with prompt-cache reads and writes at their own rates
+        cache_read, cache_write = extract_cache_usage(service, response_data)
+        cost = calculate_cost(service, model, input_tokens, output_tokens, cache_read, cache_write)
+        record_prompt_cache(service, model, input_tokens, output_tokens, cache_read, cache_write)
 
-        # Calculate cost
-        model = extract_model(service, req.body)
-        cost = calculate_cost(service, model, input_tokens, output_tokens)
+        if cache_key:
+            await state.response_cache.put(
+                cache_key, req.agent_id, response.status_code, response_data, total_tokens, cost
+            )
 
-        # Update stats
+        # Update stats and daily counters
         state.stats["total_requests"] += 1
         state.stats["successful_requests"] += 1
-        state.stats["total_tokens"] += total_tokens
-        state.stats["total_cost"] += cost
         state.stats["requests_by_service"][service] += 1
         state.stats["requests_by_agent"][req.agent_id] += 1
-        state.stats["tokens_by_service"][service] += total_tokens
-        state.stats["tokens_by_agent"][req.agent_id] += total_tokens
-        state.stats["cost_by_service"][service] += cost
-        state.stats["cost_by_agent"][req.agent_id] += cost
-
-        # Update daily counters
-        limits.daily_tokens_used += total_tokens
-        agent_quota.tokens_used_today += total_tokens
-        agent_quota.requests_today += 1
-        agent_quota.cost_today += cost
+        await record_usage(service, req.agent_id, total_tokens, cost, requests=1)
 
         # Log to event bus
         await log_to_event_bus(
@@ -654,9 +893,19 @@ async def proxy_request(req: ProxyRequest):
             request_time_ms=int((time.time() - request_start) * 1000)
         )
 
+    except CircuitOpenError as e:
+        # Opened while this request was queued or retrying
+        state.stats["total_requests"] += 1
+        state.stats["failed_requests"] += 1
+        await reconcile_tokens(limits, req.estimated_tokens, 0)
+        return circuit_open_response(e, start_time, queue_time)
+
     except httpx.HTTPError as e:
         state.stats["total_requests"] += 1
         state.stats["failed_requests"] += 1
+        await reconcile_tokens(limits, req.estimated_tokens, 0)
+        # Failed calls (timeouts especially) belong in the latency tail
+        state.metrics.upstream_latency.observe((service, model), (time.time() - request_start) * 1000)
 
         return ProxyResponse(
             success=False,
@@ -667,6 +916,281 @@ async def proxy_request(req: ProxyRequest):
         )
 
 
+@app.post("/request", response_model=ProxyResponse)
+async def proxy_request(req: ProxyRequest):
+    """Proxy a request through the gateway with rate limiting"""
+    if not state:
+        raise HTTPException(status_code=503, detail="Gateway not initialized")
+
+    start_time = time.time()
+    service = req.service.value
+
+    # Get service limits
+    limits = state.service_limits.get(service)
+    if not limits:
+        raise HTTPException(status_code=400, detail=f"Unknown service: {service}")
+
+    # Serve deterministic repeats from the cache: no queue, no tokens, no cost
+    model = extract_model(service, req.body)
+    cache_key = None
+    if state.response_cache:
+        cache_key = state.response_cache.key_for(
+            service, req.endpoint, req.method, model, req.body, req.headers,
+            req.agent_id, req.cache_control
+        )
+        if cache_key and req.cache_control != "no-cache":
+            cached = await state.response_cache.get(cache_key, req.agent_id)
+            if cached:
+                state.stats["total_requests"] += 1
+                state.stats["successful_requests"] += 1
+                state.stats["cache_hits"] += 1
+                state.stats["requests_by_service"][service] += 1
+                state.stats["requests_by_agent"][req.agent_id] += 1
+                return ProxyResponse(
+                    success=True,
+                    status_code=cached.status_code,
+                    data=cached.data,
+                    cached=True,
+                    request_time_ms=int((time.time() - start_time) * 1000)
+                )
+
+    # Identical concurrent requests share one upstream call, but only when a
+    # replay would be acceptable anyway (the response cache's temperature=0 rule)
+    if state.single_flight and req.cache_control != "no-store" and is_deterministic(req.endpoint, req.body):
+        flight_key = cache_key or canonical_key(
+            service, req.endpoint, req.method, model, req.body, req.headers
+        )
+        response, shared = await state.single_flight.do(
+            flight_key, req.agent_id,
+            lambda: forward_request(req, limits, model, cache_key, start_time),
+            shareable=lambda resp: resp.data is not None
+        )
+        if shared:
+            state.stats["total_requests"] += 1
+            state.stats["successful_requests" if response.success else "failed_requests"] += 1
+            state.stats["coalesced_requests"] += 1
+            state.stats["requests_by_service"][service] += 1
+            state.stats["requests_by_agent"][req.agent_id] += 1
+            return response.model_copy(update={
+                "coalesced": True,
+                "tokens_used": 0,
+                "cost": 0.0,
+                "queue_time_ms": 0,
+                "request_time_ms": int((time.time() - start_time) * 1000)
+            })
+        return response
+
+    return await forward_request(req, limits, model, cache_key, start_time)
+
+
+@app.post("/request/stream")
+async def proxy_stream(req: ProxyRequest):
+    """Proxy a streaming request, relaying provider SSE chunks as they arrive"""
+    if not state:
+        raise HTTPException(status_code=503, detail="Gateway not initialized")
+
+    start_time = time.time()
+    service = req.service.value
+
+    limits = state.service_limits.get(service)
+    if not limits:
+        raise HTTPException(status_code=400, detail=f"Unknown service: {service}")
+
+    model = extract_model(service, req.body)
+    req.estimated_tokens = estimate_tokens(req, service, model)
+    guard = state.providers[service]
+    try:
+        guard.check()
+    except CircuitOpenError as e:
+        return JSONResponse(status_code=503, content=circuit_open_response(e, start_time).model_dump())
+
+    rejection, queue_time = await admit_request(req, limits, await state.agent_quota(req.agent_id), start_time)
+    if rejection:
+        return JSONResponse(status_code=rejection.status_code, content=rejection.model_dump())
+
+    url = f"{get_base_url(service)}{stream_endpoint(service, req.endpoint)}"
+    body = prompt_cache_body(req, service, model)
+    request_start = time.time()
+    try:
+        # The concurrency slot is held until the stream finishes
+        upstream = await guard.send(
+            lambda: state.http_client.send(
+                state.http_client.build_request(
+                    method=req.method, url=url, headers=req.headers, json=stream_body(service, body)
+                ),
+                stream=True
+            ),
+            timeout=QUEUE_TIMEOUT,
+            keep_slot=True
+        )
+    except CircuitOpenError as e:
+        state.stats["total_requests"] += 1
+        state.stats["failed_requests"] += 1
+        await reconcile_tokens(limits, req.estimated_tokens, 0)
+        return JSONResponse(status_code=503, content=circuit_open_response(e, start_time, queue_time).model_dump())
+    except httpx.HTTPError as e:
+        state.stats["total_requests"] += 1
+        state.stats["failed_requests"] += 1
+        await reconcile_tokens(limits, req.estimated_tokens, 0)
+        return JSONResponse(status_code=500, content=ProxyResponse(
+            success=False,
+            status_code=500,
+            error=str(e),
+            queue_time_ms=queue_time,
+            request_time_ms=int((time.time() - start_time) * 1000)
+        ).model_dump())
+
+    state.metrics.upstream_latency.observe((service, model), (time.time() - request_start) * 1000)
+    state.stats["total_requests"] += 1
+    state.stats["requests_by_service"][service] += 1
+    state.stats["requests_by_agent"][req.agent_id] += 1
+    await record_usage(service, req.agent_id, 0, 0.0, requests=1)
+
+    if upstream.status_code >= 400:
+        try:
+            content = await upstream.aread()
+        finally:
+            await upstream.aclose()
+            await guard.release()
+        state.stats["failed_requests"] += 1
+        await reconcile_tokens(limits, req.estimated_tokens, 0)
+        return Response(
+            content=content,
+            status_code=upstream.status_code,
+            media_type=upstream.headers.get("content-type")
+        )
+
+    state.stats["successful_requests"] += 1
+    state.stats["streamed_requests"] += 1
+    meter = StreamMeter(service, model, req.body)
+    recorded_cost = 0.0
+
+    async def book(delta: Tuple[int, int]):
+        """Record a meter delta; the first one carries the prompt estimate, later ones correct it"""
+        nonlocal recorded_cost
+        if not any(delta):
+            return
+        cost = calculate_cost(
+            service, model, meter.input_tokens, meter.output_tokens,
+            meter.cache_read_tokens, meter.cache_write_tokens
+        )
+        await record_usage(service, req.agent_id, sum(delta), cost - recorded_cost)
+        recorded_cost = cost
+
+    async def relay():
+        try:
+            async for chunk in upstream.aiter_bytes():
+                yield chunk
+                # Count usage as it streams so quotas see long completions in progress
+                await book(meter.feed(chunk))
+        finally:
+            await upstream.aclose()
+            await guard.release()
+            await book(meter.unbooked())  # Streams that ended before any data still pay for the prompt
+            await reconcile_tokens(limits, req.estimated_tokens, meter.total_tokens)
+            record_prompt_cache(
+                service, model, meter.input_tokens, meter.output_tokens,
+                meter.cache_read_tokens, meter.cache_write_tokens
+            )
+            state.metrics.tokens.observe((service, model), meter.total_tokens)
+            if meter.ttft_ms is not None:
+                state.stats["stream_ttft_ms_total"] += meter.ttft_ms
+                state.stats["stream_ttft_samples"] += 1
+                state.metrics.ttft.observe((service, model), meter.ttft_ms)
+            await log_to_event_bus(
+                "api_request",
+                target=service,
+                details={
+                    "agent_id": req.agent_id,
+                    "endpoint": req.endpoint,
+                    "model": model,
+                    "tokens": meter.total_tokens,
+                    "cost": recorded_cost,
+                    "streamed": True,
+                    "ttft_ms": meter.ttft_ms
+                }
+            )
+
+    return StreamingResponse(
+        relay(),
+        status_code=upstream.status_code,
+        media_type=upstream.headers.get("content-type", "text/event-stream"),
+        headers={"Cache-Control": "no-cache", "X-Gateway-Queue-Time-Ms": str(queue_time)}
+    )
+
+
+def batch_lane_or_404() -> BatchLane:
+    if not state:
+        raise HTTPException(status_code=503, detail="Gateway not initialized")
+    if not state.batch_lane:
+        raise HTTPException(status_code=404, detail="Batch lane is disabled")
+    return state.batch_lane
+
+
+@app.post("/batch")
+async def submit_batch(req: BatchRequest):
+    """Queue one low-priority request for the batch lane; poll /batch/{job_id} or wait for the callback"""
+    return (await submit_batch_bulk([req]))[0]
+
+
+@app.post("/batch/bulk")
+async def submit_batch_bulk(reqs: List[BatchRequest]):
+    """Queue many low-priority requests at once"""
+    lane = batch_lane_or_404()
+    for req in reqs:
+        service = req.service.value
+        reason = lane.unavailable_reason(service)
+        if reason:
+            raise HTTPException(status_code=400, detail=reason)
+        # Batch work counts against the same daily quotas; reject only once they are spent
+        limits = state.service_limits[service]
+        if await limits.daily_tokens_used() >= limits.daily_limit:
+            raise HTTPException(status_code=429, detail=f"Daily token limit exceeded for {service}")
+        max_agent_tokens = int(limits.daily_limit * (AGENT_QUOTA_PERCENT / 100))
+        if (await state.agent_quota(req.agent_id)).tokens_used_today >= max_agent_tokens:
+            raise HTTPException(
+                status_code=429,
+                detail=f"Agent {req.agent_id} quota exceeded ({AGENT_QUOTA_PERCENT}% of daily limit)"
+            )
+
+    return lane.submit([
+        {
+            "agent_id": req.agent_id,
+            "service": req.service.value,
+            "endpoint": req.endpoint,
+            "model": extract_model(req.service.value, req.body),
+            "body": req.body,
+            "callback_url": req.callback_url,
+        }
+        for req in reqs
+    ])
+
+
+@app.get("/batch")
+async def list_batch_jobs(agent_id: Optional[str] = None, status: Optional[str] = None, limit: int = 100):
+    """Recent batch jobs, newest first"""
+    lane = batch_lane_or_404()
+    return {"jobs": [job_view(job) for job in lane.store.list(agent_id, status, min(limit, 1000))]}
+
+
+@app.get("/batch/{job_id}")
+async def get_batch_job(job_id: str):
+    """Status and, once completed, the provider response of a batch job"""
+    job = batch_lane_or_404().store.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail=f"Unknown batch job: {job_id}")
+    return job_view(job)
+
+
+@app.delete("/batch/{job_id}")
+async def cancel_batch_job(job_id: str):
+    """Cancel a batch job that has not been sent yet"""
+    lane = batch_lane_or_404()
+    if not lane.store.cancel(job_id):
+        raise HTTPException(status_code=409, detail=f"Batch job {job_id} is unknown or already sent")
+    return {"status": "ok", "job_id": job_id, "message": "Batch job cancelled"}
+
+
 @app.get("/stats")
 async def get_stats():
     """Get usage statistics"""
@@ -685,7 +1209,20 @@ async def get_stats():
                 if state.stats["total_requests"] > 0 else 0, 2
             ),
             "queued_requests": state.stats["queued_requests"],
+            "cache_hits": state.stats["cache_hits"],
+            "coalesced_requests": state.stats["coalesced_requests"],
+            "streamed_requests": state.stats["streamed_requests"],
+            "avg_stream_ttft_ms": int(
+                state.stats["stream_ttft_ms_total"] / state.stats["stream_ttft_samples"]
+            ) if state.stats["stream_ttft_samples"] else None,
             "total_tokens": state.stats["total_tokens"],
+            "estimate_error_pct": round(
+                state.stats["estimate_abs_error"] / state.stats["reconciled_tokens"] * 100, 2
+            ) if state.stats["reconciled_tokens"] else None,
+            "batch_requests": state.stats["batch_requests"],
+            "batch_saved_cost": round(state.stats["batch_saved_cost"], 4),
+            "prompt_cache_read_tokens": state.stats["prompt_cache_read_tokens"],
+            "prompt_cache_savings": round(state.stats["prompt_cache_savings"], 4),
             "total_cost": round(state.stats["total_cost"], 4),
             "uptime_seconds": int(uptime),
             "start_time": state.stats["start_time"]
@@ -702,7 +1239,8 @@ async def get_stats():
             agent_id: {
                 "requests": state.stats["requests_by_agent"].get(agent_id, 0),
                 "tokens": state.stats["tokens_by_agent"].get(agent_id, 0),
-                "cost": round(state.stats["cost_by_agent"].get(agent_id, 0), 4)
+                "cost": round(state.stats["cost_by_agent"].get(agent_id, 0), 4),
+                "coalesced": state.single_flight.coalesced_by_agent.get(agent_id, 0) if state.single_flight else 0
             }
             for agent_id in state.stats["requests_by_agent"].keys()
         },
@@ -712,19 +1250,82 @@ async def get_stats():
                 "requests_today": quota.requests_today,
                 "cost_today": round(quota.cost_today, 4)
             }
-            for agent_id, quota in state.agent_quotas.items()
+            for agent_id, quota in (await state.agent_quotas()).items()
+        },
+        "cache": state.response_cache.get_stats() if state.response_cache else {"enabled": False},
+        "coalescing": state.single_flight.get_stats() if state.single_flight else {"enabled": False},
+        "queue_wait": {service: queue.get_stats() for service, queue in state.queues.items()},
+        "limiter": state.limiter.get_stats(),
+        "providers": {service: guard.get_stats() for service, guard in state.providers.items()},
+        "batch": state.batch_lane.get_stats() if state.batch_lane else {"enabled": False},
+        "latency": state.metrics.get_stats(),
+        "prompt_cache": {
+            **(state.prompt_cache.get_stats() if state.prompt_cache else {"enabled": False}),
+            "read_tokens": state.stats["prompt_cache_read_tokens"],
+            "write_tokens": state.stats["prompt_cache_write_tokens"],
+            "savings": round(state.stats["prompt_cache_savings"], 4),
         },
         "timestamp": datetime.utcnow().isoformat()
     }
 
 
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Prometheus text exposition of gateway histograms, counters and gauges (this worker)"""
+    if not state:
+        raise HTTPException(status_code=503, detail="Gateway not initialized")
+
+    lines = state.metrics.render()
+    lines += render_samples(
+        "gateway_requests_total", "counter", "Requests handled, by service",
+        {(("service", service),): count for service, count in state.stats["requests_by_service"].items()}
+    )
+    lines += render_samples(
+        "gateway_agent_requests_total", "counter", "Requests handled, by agent",
+        {(("agent", agent_id),): count for agent_id, count in state.stats["requests_by_agent"].items()}
+    )
+    lines += render_samples(
+        "gateway_request_outcomes_total", "counter", "Requests by outcome",
+        {(("outcome", outcome),): state.stats[stat] for outcome, stat in (
+            ("success", "successful_requests"), ("failure", "failed_requests"), ("queued", "queued_requests"),
+            ("cache_hit", "cache_hits"), ("coalesced", "coalesced_requests"), ("streamed", "streamed_requests"),
+            ("batch", "batch_requests"),
+        )}
+    )
+    lines += render_samples(
+        "gateway_tokens_total", "counter", "Tokens used, by service",
+        {(("service", service),): tokens for service, tokens in state.stats["tokens_by_service"].items()}
+    )
+    lines += render_samples(
+        "gateway_cost_usd_total", "counter", "Estimated spend in USD, by service",
+        {(("service", service),): cost for service, cost in state.stats["cost_by_service"].items()}
+    )
+    lines += render_samples(
+        "gateway_queue_depth", "gauge", "Requests waiting for rate-limit capacity",
+        {(("service", service),): queue.qsize() for service, queue in state.queues.items()}
+    )
+    lines += render_samples(
+        "gateway_tpm_available", "gauge", "Tokens available in the TPM bucket",
+        {(("service", service),): await limits.tpm_bucket.available() for service, limits in state.service_limits.items()}
+    )
+    lines += render_samples(
+        "gateway_concurrency_limit", "gauge", "Adaptive upstream concurrency limit",
+        {(("service", service),): guard.limiter.limit for service, guard in state.providers.items()}
+    )
+    lines += render_samples(
+        "gateway_circuit_open", "gauge", "1 while the provider circuit is open",
+        {(("service", service),): int(guard.breaker.state == "open") for service, guard in state.providers.items()}
+    )
+    return Response(content="\n".join(lines) + "\n", media_type=METRICS_CONTENT_TYPE)
+
+
 @app.get("/stats/agent/{agent_id}")
 async def get_agent_stats(agent_id: str):
     """Get statistics for a specific agent"""
     if not state:
         raise HTTPException(status_code=503, detail="Gateway not initialized")
 
-    quota = state.agent_quotas.get(agent_id)
+    quota = (await state.agent_quotas()).get(agent_id)
     if not quota:
         return {
             "agent_id": agent_id,
@@ -732,8 +1333,6 @@ async def get_agent_stats(agent_id: str):
             "message": "No usage recorded for this agent"
         }
 
-    quota.reset_if_needed()
-
     return {
         "agent_id": agent_id,
         "found": True,
@@ -760,23 +1359,26 @@ async def reset_daily_counters():
     if not state:
         raise HTTPException(status_code=503, detail="Gateway not initialized")
 
-    # Reset service limits
-    for limits in state.service_limits.values():
-        limits.daily_tokens_used = 0
-        limits.last_daily_reset = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
-
-    # Reset agent quotas
-    for quota in state.agent_quotas.values():
-        quota.tokens_used_today = 0
-        quota.requests_today = 0
-        quota.cost_today = 0.0
-        quota.last_reset = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+    # Reset service and agent daily counters (for every worker sharing the backend)
+    await state.limiter.reset_usage()
 
     await log_to_event_bus("daily_reset", details={"manual": True})
 
     return {"status": "ok", "message": "Daily counters reset", "timestamp": datetime.utcnow().isoformat()}
 
 
+@app.delete("/cache")
+async def clear_cache():
+    """Drop every cached response (admin endpoint)"""
+    if not state:
+        raise HTTPException(status_code=503, detail="Gateway not initialized")
+    if not state.response_cache:
+        raise HTTPException(status_code=404, detail="Response cache is disabled")
+
+    state.response_cache.clear()
+    return {"status": "ok", "message": "Response cache cleared", "timestamp": datetime.utcnow().isoformat()}
+
+
 @app.get("/queue/{service}")
 async def get_queue_status(service: str):
     """Get queue status for a service"""
@@ -794,10 +1396,12 @@ async def get_queue_status(service: str):
         "service": service,
         "queue_size": queue.qsize(),
         "max_queue_size": MAX_QUEUE_SIZE,
+        "max_agent_queue_size": MAX_AGENT_QUEUE_SIZE,
         "queue_timeout_seconds": QUEUE_TIMEOUT,
-        "tpm_available": round(limits.tpm_bucket.available(), 2),
-        "rpm_available": round(limits.rpm_bucket.available(), 2),
-        "estimated_wait_seconds": round(limits.tpm_bucket.time_until_available(1000), 2),
+        "by_agent": queue.get_stats(),
+        "tpm_available": round(await limits.tpm_bucket.available(), 2),
+        "rpm_available": round(await limits.rpm_bucket.available(), 2),
+        "estimated_wait_seconds": round(await limits.tpm_bucket.time_until_available(1000), 2),
         "timestamp": datetime.utcnow().isoformat()
     }
 
@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+"""
+Limiter Backend - Where the gateway keeps rate-limit and quota state
+
+TokenBucket, ServiceLimits and AgentQuota read and write through one of:
+- memory: per-process dicts (default; correct for a single worker only)
+- sqlite: one SQLite file shared by every worker on the host, placed on
+  /dev/shm when available; each bucket update is a BEGIN IMMEDIATE
+  transaction, so refill-and-consume is atomic across processes
+- redis: any Redis-protocol server shared by several hosts; bucket
+  updates run as a Lua script using the server clock
+
+Daily usage counters live in one hash/table per UTC day, so they roll
+over at midnight without a reset step.
+
+Backend methods are coroutines: SQLite transactions run in a worker
+thread and Redis goes through redis.asyncio, so a held lock or a stalled
+server delays only the requests that need it, never the event loop.
+"""
+
+import os
+import time
+import asyncio
+import sqlite3
+import threading
+from collections import defaultdict
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+try:
+    import redis.asyncio as redis
+    REDIS_AVAILABLE = True
+except ImportError:
+    REDIS_AVAILABLE = False
+
+
+# =============================================================================
+# Configuration
+# =============================================================================
+
+LIMITER_BACKEND = os.getenv("GATEWAY_LIMITER_BACKEND", "memory")  # memory, sqlite or redis
+LIMITER_PATH = os.getenv(
+    "GATEWAY_LIMITER_PATH",
+    "/dev/shm/leveredge-gateway-limits.db" if Path("/dev/shm").is_dir() else "/tmp/leveredge-gateway-limits.db"
+)
+REDIS_URL = os.getenv("GATEWAY_REDIS_URL", "redis://localhost:6379/0")
+REDIS_NAMESPACE = os.getenv("GATEWAY_REDIS_NAMESPACE", "leveredge:gateway")
+USAGE_RETENTION_DAYS = 3
+
+
+def usage_day() -> str:
+    return datetime.utcnow().strftime("%Y-%m-%d")
+
+
+def refill(tokens: float, last_update: float, now: float, capacity: float, refill_rate: float) -> float:
+    return min(capacity, tokens + max(0.0, now - last_update) * refill_rate)
+
+
+# =============================================================================
+# Memory
+# =============================================================================
+
+class MemoryBackend:
+    """Process-local state"""
+
+    name = "memory"
+
+    def __init__(self):
+        self.buckets: Dict[str, Tuple[float, float]] = {}
+        self.usage: Dict[str, Dict[str, float]] = defaultdict(lambda: defaultdict(float))
+
+    async def take(self, key: str, capacity: float, refill_rate: float, amount: float,
+                   force: bool = False) -> Tuple[bool, float]:
+        """
+        Refill then try to take amount; returns (taken, tokens left).
+
+        force always applies amount (negative refunds), letting the level
+        go below zero so later requests wait off the debt.
+        """
+        now = time.time()
+        tokens, last_update = self.buckets.get(key, (capacity, now))
+        tokens = refill(tokens, last_update, now, capacity, refill_rate)
+        taken = force or tokens >= amount
+        if taken:
+            tokens = min(capacity, tokens - amount)
+        self.buckets[key] = (tokens, now)
+        return taken, tokens
+
+    async def add_usage(self, counters: Dict[str, float]):
+        day = self.usage[usage_day()]
+        for field_name, amount in counters.items():
+            day[field_name] += amount
+
+    async def get_usage(self) -> Dict[str, float]:
+        return dict(self.usage.get(usage_day(), {}))
+
+    async def reset_usage(self):
+        self.usage.pop(usage_day(), None)
+
+    def get_stats(self) -> Dict[str, object]:
+        return {"backend": self.name, "shared": False}
+
+
+# =============================================================================
+# SQLite
+# =============================================================================
+
+class SQLiteBackend:
+    """State shared by every worker on the host through one SQLite file"""
+
+    name = "sqlite"
+
+    def __init__(self, path: str = LIMITER_PATH):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=OFF")  # Limiter state is disposable; /dev/shm is not durable anyway
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS buckets (
+                key TEXT PRIMARY KEY,
+                tokens REAL NOT NULL,
+                last_update REAL NOT NULL
+            )
+        """)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS usage (
+                day TEXT NOT NULL,
+                field TEXT NOT NULL,
+                value REAL NOT NULL DEFAULT 0,
+                PRIMARY KEY (day, field)
+            )
+        """)
+        self.conn.execute(
+            "DELETE FROM usage WHERE day < date('now', ?)", (f"-{USAGE_RETENTION_DAYS} days",)
+        )
+        self.lock = threading.Lock()
+
+    async def take(self, key: str, capacity: float, refill_rate: float, amount: float,
+                   force: bool = False) -> Tuple[bool, float]:
+        return await asyncio.to_thread(self._take, key, capacity, refill_rate, amount, force)
+
+    async def add_usage(self, counters: Dict[str, float]):
+        await asyncio.to_thread(self._add_usage, counters)
+
+    async def get_usage(self) -> Dict[str, float]:
+        return await asyncio.to_thread(self._get_usage)
+
+    async def reset_usage(self):
+        await asyncio.to_thread(self._reset_usage)
+
+    # Blocking halves, run in worker threads (busy_timeout can wait up to 5s on another worker)
+
+    def _take(self, key: str, capacity: float, refill_rate: float, amount: float,
+              force: bool) -> Tuple[bool, float]:
+        with self.lock:
+            # IMMEDIATE takes the write lock up front so no other worker reads a stale level
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                now = time.time()
+                row = self.conn.execute(
+                    "SELECT tokens, last_update FROM buckets WHERE key = ?", (key,)
+                ).fetchone()
+                tokens = refill(row[0], row[1], now, capacity, refill_rate) if row else float(capacity)
+                taken = force or tokens >= amount
+                if taken:
+                    tokens = min(capacity, tokens - amount)
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO buckets (key, tokens, last_update) VALUES (?, ?, ?)",
+                    (key, tokens, now)
+                )
+                self.conn.execute("COMMIT")
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+            return taken, tokens
+
+    def _add_usage(self, counters: Dict[str, float]):
+        day = usage_day()
+        with self.lock:
+            self.conn.executemany("""
+                INSERT INTO usage (day, field, value) VALUES (?, ?, ?)
+                ON CONFLICT (day, field) DO UPDATE SET value = value + excluded.value
+            """, [(day, field_name, amount) for field_name, amount in counters.items()])
+
+    def _get_usage(self) -> Dict[str, float]:
+        with self.lock:
+            rows = self.conn.execute("SELECT field, value FROM usage WHERE day = ?", (usage_day(),))
+            return {field_name: value for field_name, value in rows}
+
+    def _reset_usage(self):
+        with self.lock:
+            self.conn.execute("DELETE FROM usage WHERE day = ?", (usage_day(),))
+
+    def get_stats(self) -> Dict[str, object]:
+        return {"backend": self.name, "shared": True, "path": str(self.path)}
+
+
+# =============================================================================
+# Redis
+# =============================================================================
+
+# KEYS[1] bucket; ARGV capacity, refill_rate, amount, ttl, force. Uses the server clock
+# so hosts with skewed clocks still refill at the same rate.
+TAKE_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local amount = tonumber(ARGV[3])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or capacity
+local ts = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+local taken = 0
+if ARGV[5] == '1' or tokens >= amount then
+    tokens = math.min(capacity, tokens - amount)
+    taken = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('EXPIRE', KEYS[1], tonumber(ARGV[4]))
+return {taken, tostring(tokens)}
+"""
+
+
+class RedisBackend:
+    """State shared across hosts through a Redis-protocol server"""
+
+    name = "redis"
+
+    def __init__(self, url: str = REDIS_URL, namespace: str = REDIS_NAMESPACE, client=None):
+        # client: any redis.asyncio-compatible client (a local stand-in such as fakeredis in tests)
+        if client is None:
+            if not REDIS_AVAILABLE:
+                raise RuntimeError("GATEWAY_LIMITER_BACKEND=redis requires the redis package")
+            client = redis.Redis.from_url(url, socket_timeout=1.0, socket_connect_timeout=1.0)
+        self.client = client
+        self.url = url
+        self.namespace = namespace
+        self._take = self.client.register_script(TAKE_SCRIPT)
+
+    def _usage_key(self) -> str:
+        return f"{self.namespace}:usage:{usage_day()}"
+
+    async def take(self, key: str, capacity: float, refill_rate: float, amount: float,
+                   force: bool = False) -> Tuple[bool, float]:
+        # Idle buckets are full again after capacity / refill_rate seconds; no need to keep them longer
+        ttl = max(60, int(capacity / refill_rate) + 60) if refill_rate else 86400
+        taken, tokens = await self._take(
+            keys=[f"{self.namespace}:bucket:{key}"],
+            args=[capacity, refill_rate, amount, ttl, "1" if force else "0"]
+        )
+        return bool(taken), float(tokens)
+
+    async def add_usage(self, counters: Dict[str, float]):
+        key = self._usage_key()
+        pipe = self.client.pipeline()
+        for field_name, amount in counters.items():
+            pipe.hincrbyfloat(key, field_name, amount)
+        pipe.expire(key, USAGE_RETENTION_DAYS * 86400)
+        await pipe.execute()
+
+    async def get_usage(self) -> Dict[str, float]:
+        return {
+            field_name.decode() if isinstance(field_name, bytes) else field_name: float(value)
+            for field_name, value in (await self.client.hgetall(self._usage_key())).items()
+        }
+
+    async def reset_usage(self):
+        await self.client.delete(self._usage_key())
+
+    def get_stats(self) -> Dict[str, object]:
+        return {"backend": self.name, "shared": True, "namespace": self.namespace}
+
+
+def create_backend(kind: Optional[str] = None):
+    kind = (kind or LIMITER_BACKEND).lower()
+    if kind == "sqlite":
+        return SQLiteBackend()
+    if kind == "redis":
+        return RedisBackend()
+    return MemoryBackend()
@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+"""
+Metrics - Constant-memory latency histograms and Prometheus exposition
+
+Histograms use HDR-style log-linear buckets: each power-of-two range above
+the minimum is split into SUB_BUCKETS equal slices, so any recorded value
+is known to within 1/SUB_BUCKETS of itself and memory per series is a fixed
+array of counters, however many samples arrive.
+- Percentiles (p50/p95/p99) are read from the fine buckets for /stats
+- /metrics exposes the power-of-two boundaries as Prometheus `le` buckets,
+  which keeps series counts reasonable and still supports
+  histogram_quantile() in PromQL
+- Each family caps its label sets at GATEWAY_METRICS_MAX_SERIES; further
+  label sets are folded into "other"
+
+Values are recorded in milliseconds (or plain counts) and exported in base
+units: seconds for durations.
+"""
+
+import os
+import math
+from typing import Dict, Iterable, List, Tuple
+
+MAX_SERIES = int(os.getenv("GATEWAY_METRICS_MAX_SERIES", "500"))  # per family
+SUB_BUCKETS = 8  # ~12.5% worst-case relative error
+
+OTHER = "other"
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class Histogram:
+    """Log-linear bucketed histogram over [minimum, minimum * 2**octaves)"""
+
+    def __init__(self, minimum: float = 1.0, octaves: int = 18, sub_buckets: int = SUB_BUCKETS):
+        self.minimum = minimum
+        self.octaves = octaves
+        self.sub_buckets = sub_buckets
+        # [0] below minimum, then octaves * sub_buckets, then [-1] overflow
+        self.counts: List[int] = [0] * (octaves * sub_buckets + 2)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def _index(self, value: float) -> int:
+        if value < self.minimum:
+            return 0
+        octave = int(math.log2(value / self.minimum))
+        if octave >= self.octaves:
+            return len(self.counts) - 1
+        base = self.minimum * 2 ** octave
+        sub = min(self.sub_buckets - 1, int((value / base - 1) * self.sub_buckets))
+        return 1 + octave * self.sub_buckets + sub
+
+    def upper_bound(self, index: int) -> float:
+        if index == 0:
+            return self.minimum
+        if index == len(self.counts) - 1:
+            return math.inf
+        octave, sub = divmod(index - 1, self.sub_buckets)
+        return self.minimum * 2 ** octave * (1 + (sub + 1) / self.sub_buckets)
+
+    def observe(self, value: float):
+        value = max(0.0, value)
+        self.counts[self._index(value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def merge(self, other: "Histogram"):
+        for index, count in enumerate(other.counts):
+            self.counts[index] += count
+        self.count += other.count
+        self.sum += other.sum
+        self.max = max(self.max, other.max)
+
+    def percentile(self, pct: float) -> float:
+        """Upper bound of the bucket holding the nearest-rank percentile (capped at the max seen)"""
+        if not self.count:
+            return 0.0
+        rank = max(1, math.ceil(pct / 100 * self.count))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return min(self.upper_bound(index), self.max)
+        return self.max
+
+    def cumulative_octaves(self) -> Iterable[Tuple[float, int]]:
+        """(le, cumulative count) at each power-of-two boundary, then +Inf"""
+        seen = self.counts[0]
+        yield self.minimum, seen
+        for octave in range(self.octaves):
+            start = 1 + octave * self.sub_buckets
+            seen += sum(self.counts[start:start + self.sub_buckets])
+            yield self.minimum * 2 ** (octave + 1), seen
+        yield math.inf, self.count
+
+    def summary(self) -> Dict[str, float]:
+        return {
+            "count": self.count,
+            "p50": round(self.percentile(50), 1),
+            "p95": round(self.percentile(95), 1),
+            "p99": round(self.percentile(99), 1),
+            "max": round(self.max, 1),
+        }
+
+
+class HistogramFamily:
+    """One metric name with a histogram per label set"""
+
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...], minimum: float = 1.0,
+                 octaves: int = 18, scale: float = 1.0, max_series: int = MAX_SERIES):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.minimum = minimum
+        self.octaves = octaves
+        self.scale = scale  # Multiplier from recorded units to exported units (ms -> s is 0.001)
+        self.max_series = max_series
+        self.series: Dict[Tuple[str, ...], Histogram] = {}
+
+    def observe(self, label_values: Tuple[str, ...], value: float):
+        histogram = self.series.get(label_values)
+        if histogram is None:
+            if len(self.series) >= self.max_series:
+                label_values = (OTHER,) * len(self.labels)
+                histogram = self.series.get(label_values)
+            if histogram is None:
+                histogram = self.series[label_values] = Histogram(self.minimum, self.octaves)
+        histogram.observe(value)
+
+    def summary_by(self, label: str) -> Dict[str, Dict[str, float]]:
+        """Percentiles with every label except one merged away"""
+        position = self.labels.index(label)
+        merged: Dict[str, Histogram] = {}
+        for label_values, histogram in self.series.items():
+            key = label_values[position]
+            if key not in merged:
+                merged[key] = Histogram(self.minimum, self.octaves)
+            merged[key].merge(histogram)
+        return {key: histogram.summary() for key, histogram in sorted(merged.items())}
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for label_values, histogram in sorted(self.series.items()):
+            labels = format_labels(zip(self.labels, label_values))
+            for bound, cumulative in histogram.cumulative_octaves():
+                le = "+Inf" if bound == math.inf else format_value(bound * self.scale)
+                lines.append(f"{self.name}_bucket{{{labels},le=\"{le}\"}} {cumulative}")
+            lines.append(f"{self.name}_sum{{{labels}}} {format_value(histogram.sum * self.scale)}")
+            lines.append(f"{self.name}_count{{{labels}}} {histogram.count}")
+        return lines
+
+
+def escape_label(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def format_labels(pairs: Iterable[Tuple[str, str]]) -> str:
+    return ",".join(f"{name}=\"{escape_label(value)}\"" for name, value in pairs)
+
+
+def format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+def render_samples(name: str, metric_type: str, help_text: str,
+                   samples: Dict[Tuple[Tuple[str, str], ...], float]) -> List[str]:
+    """Counter or gauge lines; samples maps ((label, value), ...) to the sample value"""
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} {metric_type}"]
+    for label_pairs, value in sorted(samples.items()):
+        labels = format_labels(label_pairs)
+        lines.append(f"{name}{{{labels}}} {format_value(value)}" if labels else f"{name} {format_value(value)}")
+    return lines
+
+
+class GatewayMetrics:
+    """The gateway's latency and size histograms"""
+
+    def __init__(self):
+        self.queue_wait = HistogramFamily(
+            "gateway_queue_wait_seconds", "Time admitted requests waited for rate-limit capacity",
+            ("service", "agent"), scale=0.001
+        )
+        self.upstream_latency = HistogramFamily(
+            "gateway_upstream_latency_seconds",
+            "Upstream call time until response headers, including retries and concurrency waits",
+            ("service", "model"), scale=0.001
+        )
+        self.ttft = HistogramFamily(
+            "gateway_stream_ttft_seconds", "Time to first streamed token",
+            ("service", "model"), scale=0.001
+        )
+        self.tokens = HistogramFamily(
+            "gateway_tokens_per_request", "Input plus output tokens per upstream request",
+            ("service", "model"), octaves=20
+        )
+        self.families = [self.queue_wait, self.upstream_latency, self.ttft, self.tokens]
+
+    def render(self) -> List[str]:
+        lines: List[str] = []
+        for family in self.families:
+            lines.extend(family.render())
+        return lines
+
+    def get_stats(self) -> Dict[str, Dict[str, Dict[str, float]]]:
+        return {
+            "queue_wait_ms": {
+                "by_service": self.queue_wait.summary_by("service"),
+                "by_agent": self.queue_wait.summary_by("agent"),
+            },
+            "upstream_latency_ms": {
+                "by_service": self.upstream_latency.summary_by("service"),
+                "by_model": self.upstream_latency.summary_by("model"),
+            },
+            "stream_ttft_ms": {
+                "by_model": self.ttft.summary_by("model"),
+            },
+            "tokens_per_request": {
+                "by_service": self.tokens.summary_by("service"),
+                "by_model": self.tokens.summary_by("model"),
+            },
+        }
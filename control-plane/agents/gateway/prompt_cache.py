@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+Prompt Cache - Automatic prompt-prefix caching hints for Anthropic calls
+
+Agents resend the same multi-kilobyte system prompt (and, in conversations,
+the same history) on every call. Anthropic only caches a prefix that ends at
+a cache_control breakpoint, so the gateway adds them:
+- Every request is fingerprinted as cumulative hashes of its leading blocks:
+  tools + system, then each message in turn
+- Fingerprints are remembered per agent and model; a prefix seen
+  GATEWAY_PROMPT_CACHE_MIN_SEEN times within the provider cache lifetime is
+  considered stable
+- Breakpoints go at the end of a stable system prompt and at the end of the
+  longest stable message prefix, if each is at least the model's minimum
+  cacheable length
+- Requests that already carry cache_control are left to the caller
+
+Cache writes cost more than plain input (1.25x) and reads far less (0.1x),
+so only prefixes that have actually repeated are marked.
+"""
+
+import os
+import copy
+import json
+import time
+import hashlib
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from token_estimator import count_tokens
+
+
+# =============================================================================
+# Configuration
+# =============================================================================
+
+PROMPT_CACHE_ENABLED = os.getenv("GATEWAY_PROMPT_CACHE_ENABLED", "true").lower() == "true"
+PROMPT_CACHE_MIN_SEEN = int(os.getenv("GATEWAY_PROMPT_CACHE_MIN_SEEN", "2"))
+PROMPT_CACHE_WINDOW = float(os.getenv("GATEWAY_PROMPT_CACHE_WINDOW", "300"))  # Anthropic's ephemeral cache TTL
+PROMPT_CACHE_MAX_PREFIXES = int(os.getenv("GATEWAY_PROMPT_CACHE_MAX_PREFIXES", "4096"))
+
+EPHEMERAL = {"type": "ephemeral"}
+
+
+def min_cacheable_tokens(model: str) -> int:
+    """Shorter prefixes are not cached by the provider, so a breakpoint would be wasted"""
+    return 2048 if "haiku" in model else 1024
+
+
+def has_cache_control(value: Any) -> bool:
+    if isinstance(value, dict):
+        return "cache_control" in value or any(has_cache_control(v) for v in value.values())
+    if isinstance(value, list):
+        return any(has_cache_control(v) for v in value)
+    return False
+
+
+def _text(content: Any) -> str:
+    if isinstance(content, str):
+        return content
+    return json.dumps(content, sort_keys=True, separators=(",", ":"))
+
+
+def prefix_points(model: str, body: Dict[str, Any]) -> List[Tuple[Any, str, int]]:
+    """
+    Cumulative fingerprints of the prompt prefix.
+
+    Returns (location, hash, tokens) where location is "system" or a
+    message index and tokens is the prefix length up to and including it.
+    """
+    digest = hashlib.sha256(model.encode())
+    points = []
+    tokens = 0
+
+    head = _text(body.get("tools") or "") + _text(body.get("system") or "")
+    if head:
+        digest.update(head.encode())
+        tokens += count_tokens("anthropic", model, head)
+        points.append(("system", digest.copy().hexdigest(), tokens))
+
+    for index, message in enumerate(body.get("messages") or []):
+        text = _text(message.get("content"))
+        digest.update(b"\x00" + (message.get("role") or "").encode() + b"\x00" + text.encode())
+        tokens += count_tokens("anthropic", model, text)
+        points.append((index, digest.copy().hexdigest(), tokens))
+
+    return points
+
+
+def _mark_last_block(content: Any) -> Any:
+    """Content with cache_control on its last block (strings become a text block)"""
+    if isinstance(content, str):
+        return [{"type": "text", "text": content, "cache_control": EPHEMERAL}]
+    if isinstance(content, list) and content:
+        return content[:-1] + [{**content[-1], "cache_control": EPHEMERAL}]
+    return content
+
+
+class PromptCacheHints:
+    """Remembers prompt prefixes per agent and marks the repeated ones"""
+
+    def __init__(self, min_seen: int = PROMPT_CACHE_MIN_SEEN, window: float = PROMPT_CACHE_WINDOW,
+                 max_prefixes: int = PROMPT_CACHE_MAX_PREFIXES):
+        self.min_seen = min_seen
+        self.window = window
+        self.max_prefixes = max_prefixes
+        self.seen: "OrderedDict[str, Tuple[int, float]]" = OrderedDict()  # key -> (count, last_seen)
+        self.stats = {
+            "requests": 0,
+            "annotated": 0,
+            "system_breakpoints": 0,
+            "message_breakpoints": 0,
+            "caller_managed": 0,
+        }
+
+    def _observe(self, key: str, now: float) -> int:
+        """Count this sighting; returns how often the prefix was seen before, within the window"""
+        count, last_seen = self.seen.pop(key, (0, 0.0))
+        if now - last_seen > self.window:
+            count = 0
+        self.seen[key] = (count + 1, now)
+        while len(self.seen) > self.max_prefixes:
+            self.seen.popitem(last=False)
+        return count
+
+    def annotate(self, agent_id: str, model: str, body: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Copy of body with cache breakpoints added, or None to send it unchanged"""
+        self.stats["requests"] += 1
+        if has_cache_control(body.get("system")) or has_cache_control(body.get("messages")) \
+                or has_cache_control(body.get("tools")):
+            self.stats["caller_managed"] += 1
+            return None
+
+        now = time.time()
+        minimum = min_cacheable_tokens(model)
+        system_stable = False
+        stable_message: Optional[int] = None
+        for location, digest, tokens in prefix_points(model, body):
+            previous = self._observe(f"{agent_id}|{digest}", now)
+            if previous + 1 < self.min_seen or tokens < minimum:
+                continue
+            if location == "system":
+                system_stable = True
+            else:
+                stable_message = location  # Points are in order, so this ends as the longest
+
+        if not system_stable and stable_message is None:
+            return None
+
+        annotated = copy.deepcopy(body)
+        if system_stable:
+            if annotated.get("system"):
+                annotated["system"] = _mark_last_block(annotated["system"])
+            else:
+                annotated["tools"][-1]["cache_control"] = EPHEMERAL
+            self.stats["system_breakpoints"] += 1
+        if stable_message is not None:
+            message = annotated["messages"][stable_message]
+            message["content"] = _mark_last_block(message.get("content"))
+            self.stats["message_breakpoints"] += 1
+        self.stats["annotated"] += 1
+        return annotated
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {**self.stats, "tracked_prefixes": len(self.seen)}
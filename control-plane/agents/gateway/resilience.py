@@ -0,0 +1,337 @@
+#!/usr/bin/env python3
+"""
+Resilience - Per-provider adaptive concurrency, retries and circuit breaking
+
+Each provider gets a ProviderGuard in front of its upstream calls:
+- AdaptiveLimiter: AIMD concurrency limit. Grows by 1/limit per healthy
+  response, shrinks multiplicatively on 429/5xx/timeouts or when recent
+  latency drifts well above the long-run average (gradient signal).
+- CircuitBreaker: opens when the failure rate over the last N outcomes
+  crosses a threshold, fails fast while open, and lets a single probe
+  through when the cooldown ends. A 429 with Retry-After pauses sends to
+  the provider until it has passed.
+- Retries: retryable failures are retried with full-jitter exponential
+  backoff, honouring Retry-After, within a retry budget so retries cannot
+  amplify an outage.
+"""
+
+import os
+import time
+import random
+import asyncio
+from collections import deque
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional
+
+import httpx
+
+
+# =============================================================================
+# Configuration
+# =============================================================================
+
+CONCURRENCY_INITIAL = float(os.getenv("GATEWAY_CONCURRENCY_INITIAL", "16"))
+CONCURRENCY_MIN = float(os.getenv("GATEWAY_CONCURRENCY_MIN", "1"))
+CONCURRENCY_MAX = float(os.getenv("GATEWAY_CONCURRENCY_MAX", "64"))
+CONCURRENCY_BACKOFF = 0.7  # Multiplicative decrease factor
+LATENCY_TOLERANCE = float(os.getenv("GATEWAY_LATENCY_TOLERANCE", "2.5"))  # Recent vs long-run latency
+DECREASE_INTERVAL = 1.0  # seconds; one burst of failures counts as one congestion signal
+
+RETRY_ATTEMPTS = int(os.getenv("GATEWAY_RETRY_ATTEMPTS", "2"))
+RETRY_BASE_DELAY = float(os.getenv("GATEWAY_RETRY_BASE_DELAY", "0.5"))  # seconds
+RETRY_MAX_DELAY = float(os.getenv("GATEWAY_RETRY_MAX_DELAY", "8"))  # Longer Retry-After values are not waited out
+RETRY_BUDGET_RATIO = float(os.getenv("GATEWAY_RETRY_BUDGET", "0.2"))  # Retries per request, long-run
+
+BREAKER_WINDOW = int(os.getenv("GATEWAY_BREAKER_WINDOW", "20"))  # outcomes
+BREAKER_MIN_REQUESTS = int(os.getenv("GATEWAY_BREAKER_MIN_REQUESTS", "10"))
+BREAKER_FAILURE_RATE = float(os.getenv("GATEWAY_BREAKER_FAILURE_RATE", "0.5"))
+BREAKER_COOLDOWN = float(os.getenv("GATEWAY_BREAKER_COOLDOWN", "30"))  # seconds
+
+# 529 is Anthropic's "overloaded"
+RETRYABLE_STATUS = {429, 500, 502, 503, 504, 529}
+
+
+class CircuitOpenError(Exception):
+    """Provider circuit is open; the request was not sent"""
+
+    def __init__(self, service: str, retry_in: float):
+        self.service = service
+        self.retry_in = retry_in
+        super().__init__(f"Circuit open for {service}; retry in {retry_in:.1f}s")
+
+
+def parse_retry_after(headers: httpx.Headers) -> Optional[float]:
+    """Seconds from a Retry-After header (delta-seconds or HTTP date)"""
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt: int) -> float:
+    """Full-jitter exponential backoff"""
+    return random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt))
+
+
+# =============================================================================
+# Adaptive Concurrency
+# =============================================================================
+
+class AdaptiveLimiter:
+    """AIMD concurrency limit driven by failures and latency drift"""
+
+    def __init__(self, initial: float = CONCURRENCY_INITIAL, minimum: float = CONCURRENCY_MIN,
+                 maximum: float = CONCURRENCY_MAX):
+        self.limit = initial
+        self.minimum = minimum
+        self.maximum = maximum
+        self.inflight = 0
+        self.short_latency: Optional[float] = None
+        self.long_latency: Optional[float] = None
+        self._last_decrease = 0.0
+        self._changed = asyncio.Condition()
+        self.decreases = 0
+
+    async def acquire(self):
+        async with self._changed:
+            await self._changed.wait_for(lambda: self.inflight < int(self.limit))
+            self.inflight += 1
+
+    async def release(self):
+        async with self._changed:
+            self.inflight -= 1
+            self._changed.notify_all()
+
+    def observe(self, latency: float, overloaded: bool):
+        """Feed one outcome into the limit"""
+        self.short_latency = latency if self.short_latency is None else 0.3 * latency + 0.7 * self.short_latency
+        self.long_latency = latency if self.long_latency is None else 0.02 * latency + 0.98 * self.long_latency
+
+        congested = overloaded or self.short_latency > self.long_latency * LATENCY_TOLERANCE
+        now = time.monotonic()
+        if congested:
+            if now - self._last_decrease >= DECREASE_INTERVAL:
+                self.limit = max(self.minimum, self.limit * CONCURRENCY_BACKOFF)
+                self._last_decrease = now
+                self.decreases += 1
+        elif self.inflight >= self.limit / 2:
+            # Only grow while the limit is actually in use
+            self.limit = min(self.maximum, self.limit + 1 / self.limit)
+
+    async def notify(self):
+        # A grown limit may admit waiters without any release
+        async with self._changed:
+            self._changed.notify_all()
+
+
+# =============================================================================
+# Circuit Breaker
+# =============================================================================
+
+class CircuitBreaker:
+    """closed -> open on high failure rate -> half_open probe -> closed"""
+
+    def __init__(self, window: int = BREAKER_WINDOW, min_requests: int = BREAKER_MIN_REQUESTS,
+                 failure_rate: float = BREAKER_FAILURE_RATE, cooldown: float = BREAKER_COOLDOWN):
+        self.outcomes: Deque[bool] = deque(maxlen=window)
+        self.min_requests = min_requests
+        self.failure_rate_threshold = failure_rate
+        self.cooldown = cooldown
+        self.state = "closed"
+        self.open_until = 0.0
+        self.hold_until = 0.0
+        self.probe_inflight = False
+        self.opened_count = 0
+
+    @property
+    def failure_rate(self) -> float:
+        if not self.outcomes:
+            return 0.0
+        return sum(1 for ok in self.outcomes if not ok) / len(self.outcomes)
+
+    def held_for(self) -> float:
+        return max(0.0, self.hold_until - time.monotonic())
+
+    def retry_in(self) -> float:
+        until = max(self.hold_until, self.open_until if self.state == "open" else 0.0)
+        return max(0.0, until - time.monotonic())
+
+    def allow(self) -> bool:
+        if time.monotonic() < self.hold_until:
+            return False
+        if self.state == "closed":
+            return True
+        if self.state == "open" and time.monotonic() >= self.open_until:
+            self.state = "half_open"
+            self.probe_inflight = False
+        if self.state == "half_open" and not self.probe_inflight:
+            self.probe_inflight = True
+            return True
+        return False
+
+    def record(self, ok: bool):
+        if self.state == "half_open":
+            if ok:
+                self.state = "closed"
+                self.outcomes.clear()
+            else:
+                self._open(self.cooldown)
+            self.probe_inflight = False
+            return
+        self.outcomes.append(ok)
+        if (self.state == "closed" and len(self.outcomes) >= self.min_requests
+                and self.failure_rate >= self.failure_rate_threshold):
+            self._open(self.cooldown)
+
+    def abandon_probe(self):
+        """The half-open probe never reached the provider; let another one through"""
+        if self.state == "half_open":
+            self.probe_inflight = False
+
+    def hold(self, seconds: float):
+        """Stop sending until the provider's Retry-After has passed"""
+        self.hold_until = max(self.hold_until, time.monotonic() + seconds)
+
+    def _open(self, seconds: float):
+        if self.state != "open":
+            self.opened_count += 1
+        self.state = "open"
+        self.open_until = time.monotonic() + seconds
+
+
+# =============================================================================
+# Provider Guard
+# =============================================================================
+
+class ProviderGuard:
+    """Concurrency limit, breaker and retry policy for one provider"""
+
+    def __init__(self, service: str):
+        self.service = service
+        self.limiter = AdaptiveLimiter()
+        self.breaker = CircuitBreaker()
+        self.retry_tokens = 10.0  # Initial allowance so a cold gateway can still retry
+        self.stats = {
+            "requests": 0,
+            "attempts": 0,
+            "retries": 0,
+            "retries_denied": 0,
+            "failures": 0,
+            "rejected_open": 0,
+        }
+
+    def check(self):
+        """Fail fast before queueing when the circuit is open or the provider asked for a long pause"""
+        retry_in = self.breaker.retry_in()
+        if retry_in > 0 and (self.breaker.state == "open" or retry_in > RETRY_MAX_DELAY):
+            self.stats["rejected_open"] += 1
+            raise CircuitOpenError(self.service, self.breaker.retry_in())
+
+    def _may_retry(self, attempt: int) -> bool:
+        if attempt >= RETRY_ATTEMPTS:
+            return False
+        if self.retry_tokens < 1:
+            self.stats["retries_denied"] += 1
+            return False
+        self.retry_tokens -= 1
+        self.stats["retries"] += 1
+        return True
+
+    async def send(self, make_request: Callable[[], Awaitable[httpx.Response]],
+                   timeout: float, keep_slot: bool = False) -> httpx.Response:
+        """
+        Send through the guard, retrying retryable failures.
+
+        With keep_slot the concurrency slot stays held after a response is
+        returned (for streams); the caller must call release() when done.
+        """
+        self.stats["requests"] += 1
+        self.retry_tokens = min(10.0, self.retry_tokens + RETRY_BUDGET_RATIO)
+        attempt = 0
+        while True:
+            if not self.breaker.allow():
+                wait = self.breaker.held_for()
+                if self.breaker.state != "open" and 0 < wait <= RETRY_MAX_DELAY:
+                    # Short Retry-After pause: wait it out rather than fail
+                    await asyncio.sleep(wait)
+                    continue
+                self.stats["rejected_open"] += 1
+                raise CircuitOpenError(self.service, self.breaker.retry_in())
+            try:
+                await asyncio.wait_for(self.limiter.acquire(), timeout=timeout)
+            except asyncio.TimeoutError:
+                self.breaker.abandon_probe()
+                raise httpx.PoolTimeout(f"{self.service} concurrency limit ({int(self.limiter.limit)}) saturated")
+
+            self.stats["attempts"] += 1
+            started = time.monotonic()
+            try:
+                response = await make_request()
+            except httpx.TransportError:
+                self.stats["failures"] += 1
+                self.breaker.record(False)
+                self.limiter.observe(time.monotonic() - started, overloaded=True)
+                await self.release()
+                if self._may_retry(attempt):
+                    await asyncio.sleep(backoff_delay(attempt))
+                    attempt += 1
+                    continue
+                raise
+            except BaseException:
+                self.breaker.abandon_probe()
+                await self.release()
+                raise
+
+            overloaded = response.status_code in RETRYABLE_STATUS
+            retry_after = parse_retry_after(response.headers) if overloaded else None
+            if response.status_code == 429 and retry_after:
+                self.breaker.hold(retry_after)
+
+            if overloaded:
+                self.stats["failures"] += 1
+                self.breaker.record(False)
+                self.limiter.observe(time.monotonic() - started, overloaded=True)
+                wait = retry_after if retry_after is not None else backoff_delay(attempt)
+                wait = max(wait, self.breaker.held_for())
+                if wait <= RETRY_MAX_DELAY and self._may_retry(attempt):
+                    await response.aclose()
+                    await self.release()
+                    await asyncio.sleep(wait)
+                    attempt += 1
+                    continue
+                if not keep_slot:
+                    await self.release()
+                return response
+
+            # Other 4xx are the caller's problem, not the provider's health
+            self.breaker.record(True)
+            self.limiter.observe(time.monotonic() - started, overloaded=False)
+            await self.limiter.notify()
+            if not keep_slot:
+                await self.release()
+            return response
+
+    async def release(self):
+        await self.limiter.release()
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            **self.stats,
+            "concurrency_limit": round(self.limiter.limit, 2),
+            "inflight": self.limiter.inflight,
+            "limit_decreases": self.limiter.decreases,
+            "latency_ms": round(self.limiter.long_latency * 1000, 1) if self.limiter.long_latency else None,
+            "circuit": self.breaker.state,
+            "circuit_retry_in": round(self.breaker.retry_in(), 1),
+            "circuit_opened": self.breaker.opened_count,
+            "failure_rate": round(self.breaker.failure_rate, 3),
+            "retry_budget": round(self.retry_tokens, 2),
+        }
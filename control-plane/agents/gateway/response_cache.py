@@ -0,0 +1,306 @@
+#!/usr/bin/env python3
+"""
+Response Cache - Deterministic request cache for the API Gateway
+
+Serves repeated, deterministic upstream calls (temperature=0 completions,
+embeddings) without queueing or spending tokens:
+- Canonical key: sha256 over service, endpoint, method, model, body and
+  response-shaping headers (credentials excluded)
+- Two tiers: in-memory LRU in front of a size-bounded SQLite file
+- Per-agent TTLs (0 disables caching for that agent)
+- Per-request opt-out via cache_control: "no-cache" skips lookup but
+  still stores the fresh response, "no-store" bypasses the cache entirely
+"""
+
+import os
+import json
+import time
+import zlib
+import sqlite3
+import asyncio
+import hashlib
+import threading
+from collections import OrderedDict, defaultdict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional, Dict, Any
+
+
+# =============================================================================
+# Configuration
+# =============================================================================
+
+CACHE_ENABLED = os.getenv("GATEWAY_CACHE_ENABLED", "true").lower() == "true"
+CACHE_MEMORY_ENTRIES = int(os.getenv("GATEWAY_CACHE_MEMORY_ENTRIES", "1024"))
+CACHE_DISK_PATH = os.getenv("GATEWAY_CACHE_PATH", "/opt/leveredge/control-plane/agents/gateway/response_cache.db")
+CACHE_DISK_MAX_MB = float(os.getenv("GATEWAY_CACHE_DISK_MAX_MB", "256"))  # 0 disables the disk tier
+CACHE_DEFAULT_TTL = int(os.getenv("GATEWAY_CACHE_TTL", "3600"))  # seconds
+
+# Per-agent TTL overrides in seconds, e.g. {"scholar": 86400, "aria": 0}
+CACHE_AGENT_TTLS: Dict[str, int] = json.loads(os.getenv("GATEWAY_CACHE_AGENT_TTLS", "{}"))
+
+# Endpoints whose responses are deterministic regardless of temperature
+DETERMINISTIC_ENDPOINTS = ("/embeddings", ":embedContent", ":batchEmbedContents")
+
+# Headers that never change the response and must not end up in the key
+CREDENTIAL_HEADERS = {"authorization", "x-api-key", "x-goog-api-key", "api-key", "cookie"}
+
+
+# =============================================================================
+# Keys
+# =============================================================================
+
+def canonical_key(service: str, endpoint: str, method: str, model: str,
+                  body: Dict[str, Any], headers: Dict[str, str]) -> str:
+    """Stable hash of everything that determines the upstream response"""
+    shaping_headers = {
+        name.lower(): value for name, value in headers.items()
+        if name.lower() not in CREDENTIAL_HEADERS
+    }
+    payload = json.dumps(
+        [service, endpoint, method.upper(), model, body, shaping_headers],
+        sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def is_deterministic(endpoint: str, body: Dict[str, Any]) -> bool:
+    """Only temperature=0 generations and embeddings are safe to replay"""
+    if body.get("stream"):
+        return False
+    if any(marker in endpoint for marker in DETERMINISTIC_ENDPOINTS):
+        return True
+    temperature = body.get("temperature")
+    if temperature is None:
+        temperature = (body.get("generationConfig") or {}).get("temperature")
+    return temperature == 0
+
+
+@dataclass
+class CachedResponse:
+    """A stored upstream response"""
+    status_code: int
+    data: Dict[str, Any]
+    tokens: int
+    cost: float
+    expires_at: float
+
+
+# =============================================================================
+# Disk Tier
+# =============================================================================
+
+class DiskCache:
+    """Size-bounded SQLite tier; least recently used rows are evicted first"""
+
+    def __init__(self, path: str, max_bytes: int):
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                status_code INTEGER NOT NULL,
+                data BLOB NOT NULL,
+                tokens INTEGER NOT NULL,
+                cost REAL NOT NULL,
+                expires_at REAL NOT NULL,
+                last_access REAL NOT NULL,
+                size INTEGER NOT NULL
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_access ON responses(last_access)")
+        self.total_bytes = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        self.evictions = 0
+        self.lock = threading.Lock()  # Calls arrive from asyncio.to_thread workers
+
+    def get(self, key: str) -> Optional[CachedResponse]:
+        with self.lock:
+            return self._get(key)
+
+    def put(self, key: str, entry: CachedResponse):
+        with self.lock:
+            self._put(key, entry)
+
+    def _get(self, key: str) -> Optional[CachedResponse]:
+        row = self.conn.execute(
+            "SELECT status_code, data, tokens, cost, expires_at FROM responses WHERE key = ?", (key,)
+        ).fetchone()
+        if not row:
+            return None
+        if row[4] <= time.time():
+            self._delete(key)
+            return None
+        self.conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (time.time(), key))
+        return CachedResponse(
+            status_code=row[0],
+            data=json.loads(zlib.decompress(row[1])),
+            tokens=row[2],
+            cost=row[3],
+            expires_at=row[4]
+        )
+
+    def _put(self, key: str, entry: CachedResponse):
+        blob = zlib.compress(json.dumps(entry.data, separators=(",", ":")).encode())
+        if len(blob) > self.max_bytes:
+            return
+        self._delete(key)
+        self.conn.execute("""
+            INSERT INTO responses (key, status_code, data, tokens, cost, expires_at, last_access, size)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """, (key, entry.status_code, blob, entry.tokens, entry.cost, entry.expires_at, time.time(), len(blob)))
+        self.total_bytes += len(blob)
+        self._evict()
+
+    def _delete(self, key: str):
+        row = self.conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+        if row:
+            self.conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self.total_bytes -= row[0]
+
+    def _evict(self):
+        if self.total_bytes <= self.max_bytes:
+            return
+        # Expired rows first, then least recently used until back under 90% of the budget
+        self.conn.execute("DELETE FROM responses WHERE expires_at <= ?", (time.time(),))
+        self.total_bytes = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        target = self.max_bytes * 0.9
+        while self.total_bytes > target:
+            rows = self.conn.execute(
+                "SELECT key, size FROM responses ORDER BY last_access LIMIT 100"
+            ).fetchall()
+            if not rows:
+                break
+            self.conn.executemany("DELETE FROM responses WHERE key = ?", [(k,) for k, _ in rows])
+            self.total_bytes -= sum(size for _, size in rows)
+            self.evictions += len(rows)
+
+    def clear(self):
+        with self.lock:
+            self.conn.execute("DELETE FROM responses")
+            self.total_bytes = 0
+
+    def count(self) -> int:
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+
+# =============================================================================
+# Response Cache
+# =============================================================================
+
+class ResponseCache:
+    """Memory LRU in front of an optional disk tier"""
+
+    def __init__(
+        self,
+        memory_entries: int = CACHE_MEMORY_ENTRIES,
+        disk_path: Optional[str] = CACHE_DISK_PATH,
+        disk_max_mb: float = CACHE_DISK_MAX_MB,
+        default_ttl: int = CACHE_DEFAULT_TTL,
+        agent_ttls: Optional[Dict[str, int]] = None
+    ):
+        self.memory_entries = memory_entries
+        self.default_ttl = default_ttl
+        self.agent_ttls = {k.lower(): v for k, v in (agent_ttls if agent_ttls is not None else CACHE_AGENT_TTLS).items()}
+        self.memory: "OrderedDict[str, CachedResponse]" = OrderedDict()
+        self.disk: Optional[DiskCache] = None
+        if disk_path and disk_max_mb > 0:
+            try:
+                self.disk = DiskCache(disk_path, int(disk_max_mb * 1024 * 1024))
+            except (OSError, sqlite3.Error) as e:
+                print(f"Response cache disk tier disabled: {e}")
+
+        self.stats = {
+            "lookups": 0,
+            "hits": 0,
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "stores": 0,
+            "memory_evictions": 0,
+            "bypassed": 0,
+            "tokens_saved": 0,
+            "cost_saved": 0.0,
+        }
+        self.hits_by_agent: Dict[str, int] = defaultdict(int)
+        self.tokens_saved_by_agent: Dict[str, int] = defaultdict(int)
+
+    def ttl_for(self, agent_id: str) -> int:
+        return self.agent_ttls.get(agent_id.lower(), self.default_ttl)
+
+    def key_for(self, service: str, endpoint: str, method: str, model: str,
+                body: Dict[str, Any], headers: Dict[str, str], agent_id: str,
+                cache_control: Optional[str]) -> Optional[str]:
+        """Cache key for a request, or None when it must not be cached"""
+        if cache_control == "no-store" or self.ttl_for(agent_id) <= 0 or not is_deterministic(endpoint, body):
+            self.stats["bypassed"] += 1
+            return None
+        return canonical_key(service, endpoint, method, model, body, headers)
+
+    async def get(self, key: str, agent_id: str) -> Optional[CachedResponse]:
+        self.stats["lookups"] += 1
+        entry = self.memory.get(key)
+        if entry and entry.expires_at <= time.time():
+            del self.memory[key]
+            entry = None
+        if entry:
+            self.memory.move_to_end(key)
+            self.stats["memory_hits"] += 1
+        elif self.disk:
+            entry = await asyncio.to_thread(self.disk.get, key)
+            if entry:
+                self.stats["disk_hits"] += 1
+                self._remember(key, entry)
+
+        if entry:
+            self.stats["hits"] += 1
+            self.stats["tokens_saved"] += entry.tokens
+            self.stats["cost_saved"] += entry.cost
+            self.hits_by_agent[agent_id] += 1
+            self.tokens_saved_by_agent[agent_id] += entry.tokens
+        return entry
+
+    async def put(self, key: str, agent_id: str, status_code: int, data: Dict[str, Any],
+                  tokens: int, cost: float):
+        if not 200 <= status_code < 300:
+            return
+        entry = CachedResponse(
+            status_code=status_code,
+            data=data,
+            tokens=tokens,
+            cost=cost,
+            expires_at=time.time() + self.ttl_for(agent_id)
+        )
+        self._remember(key, entry)
+        if self.disk:
+            await asyncio.to_thread(self.disk.put, key, entry)
+        self.stats["stores"] += 1
+
+    def _remember(self, key: str, entry: CachedResponse):
+        self.memory[key] = entry
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.memory_entries:
+            self.memory.popitem(last=False)
+            self.stats["memory_evictions"] += 1
+
+    def clear(self):
+        self.memory.clear()
+        if self.disk:
+            self.disk.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        lookups = self.stats["lookups"]
+        return {
+            **self.stats,
+            "cost_saved": round(self.stats["cost_saved"], 6),
+            "hit_ratio": round(self.stats["hits"] / lookups, 4) if lookups else 0.0,
+            "memory_entries": len(self.memory),
+            "disk_entries": self.disk.count() if self.disk else 0,
+            "disk_bytes": self.disk.total_bytes if self.disk else 0,
+            "disk_evictions": self.disk.evictions if self.disk else 0,
+            "hits_by_agent": dict(self.hits_by_agent),
+            "tokens_saved_by_agent": dict(self.tokens_saved_by_agent),
+        }
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+Scheduler - Weighted fair queueing for the API Gateway
+
+Replaces the single per-service priority queue with deficit round robin
+(DRR) over per-agent sub-queues:
+- Each agent with queued work gets quantum * weight tokens of credit per
+  round and is served while its credit covers the estimated tokens of its
+  next request, so a chatty batch agent cannot starve interactive ones.
+- Within an agent, requests are ordered by (priority, arrival).
+- An agent may hold at most agent_maxsize slots of the service queue.
+- Queue-wait samples are kept per agent for p50/p95/p99 reporting.
+"""
+
+import os
+import json
+import math
+import heapq
+import asyncio
+import itertools
+from collections import defaultdict, deque
+from datetime import datetime
+from typing import Any, Deque, Dict, List, Optional
+
+
+# =============================================================================
+# Configuration
+# =============================================================================
+
+# Per-agent weights, e.g. {"aria": 4, "scholar": 1}; unlisted agents get DEFAULT_AGENT_WEIGHT
+AGENT_WEIGHTS: Dict[str, float] = json.loads(os.getenv("GATEWAY_AGENT_WEIGHTS", "{}"))
+DEFAULT_AGENT_WEIGHT = float(os.getenv("GATEWAY_DEFAULT_AGENT_WEIGHT", "1"))
+DRR_QUANTUM = int(os.getenv("GATEWAY_DRR_QUANTUM", "1000"))  # tokens of credit per round at weight 1
+WAIT_SAMPLES = int(os.getenv("GATEWAY_QUEUE_WAIT_SAMPLES", "1000"))  # per agent
+
+
+def percentile(samples: List[float], pct: float) -> float:
+    """Nearest-rank percentile of an unsorted list"""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    rank = max(0, min(len(ordered), math.ceil(pct / 100 * len(ordered))) - 1)
+    return ordered[rank]
+
+
+class FairQueue:
+    """Deficit round robin over per-agent priority sub-queues"""
+
+    def __init__(self, maxsize: int, agent_maxsize: int, weights: Optional[Dict[str, float]] = None,
+                 quantum: int = DRR_QUANTUM):
+        self.maxsize = maxsize
+        self.agent_maxsize = agent_maxsize
+        self.weights = {k.lower(): float(v) for k, v in (weights if weights is not None else AGENT_WEIGHTS).items()}
+        self.quantum = quantum
+
+        # An agent without positive credit per round would never be served and _next would spin forever
+        invalid = {agent: w for agent, w in self.weights.items() if not w > 0}
+        if invalid:
+            raise ValueError(f"GATEWAY_AGENT_WEIGHTS must all be > 0, got {invalid}")
+        if not DEFAULT_AGENT_WEIGHT > 0:
+            raise ValueError(f"GATEWAY_DEFAULT_AGENT_WEIGHT must be > 0, got {DEFAULT_AGENT_WEIGHT}")
+        if quantum < 1:
+            raise ValueError(f"GATEWAY_DRR_QUANTUM must be >= 1, got {quantum}")
+
+        self.subqueues: Dict[str, list] = {}
+        self.active: Deque[str] = deque()  # Agents with queued work, in round order
+        self.deficit: Dict[str, float] = defaultdict(float)
+        self._size = 0
+        self._seq = itertools.count()  # Tie-breaker so requests are never compared
+        self._not_empty = asyncio.Event()
+
+        self.waits: Dict[str, Deque[float]] = defaultdict(lambda: deque(maxlen=WAIT_SAMPLES))
+        self.dispatched: Dict[str, int] = defaultdict(int)
+
+    def weight(self, agent_id: str) -> float:
+        return self.weights.get(agent_id.lower(), DEFAULT_AGENT_WEIGHT)
+
+    def qsize(self) -> int:
+        return self._size
+
+    def full(self) -> bool:
+        return self._size >= self.maxsize
+
+    def agent_full(self, agent_id: str) -> bool:
+        return len(self.subqueues.get(agent_id, ())) >= self.agent_maxsize
+
+    def put_nowait(self, request: Any):
+        """Enqueue a QueuedRequest; callers check full() and agent_full() first"""
+        agent_id = request.agent_id
+        heap = self.subqueues.get(agent_id)
+        if heap is None:
+            heap = self.subqueues[agent_id] = []
+            self.active.append(agent_id)
+            self.deficit[agent_id] = 0.0
+        heapq.heappush(heap, (request.priority, next(self._seq), request))
+        self._size += 1
+        self._not_empty.set()
+
+    async def get(self) -> Any:
+        while not self._size:
+            self._not_empty.clear()
+            await self._not_empty.wait()
+        request = self._next()
+        wait_ms = (datetime.utcnow() - request.created_at).total_seconds() * 1000
+        self.waits[request.agent_id].append(wait_ms)
+        self.dispatched[request.agent_id] += 1
+        return request
+
+    def _next(self) -> Any:
+        while True:
+            agent_id = self.active[0]
+            heap = self.subqueues[agent_id]
+            cost = max(1, heap[0][2].estimated_tokens)
+            if self.deficit[agent_id] >= cost:
+                self.deficit[agent_id] -= cost
+                request = heapq.heappop(heap)[2]
+                self._size -= 1
+                if not heap:
+                    # Idle agents do not bank credit
+                    del self.subqueues[agent_id]
+                    self.active.popleft()
+                    self.deficit.pop(agent_id, None)
+                    if self.active:
+                        self.deficit[self.active[0]] += self.quantum * self.weight(self.active[0])
+                return request
+            # Out of credit: move to the next agent and grant it this round's quantum
+            self.active.rotate(-1)
+            self.deficit[self.active[0]] += self.quantum * self.weight(self.active[0])
+
+    def get_stats(self) -> Dict[str, Any]:
+        agents = set(self.subqueues) | set(self.waits)
+        return {
+            agent_id: {
+                "queued": len(self.subqueues.get(agent_id, ())),
+                "weight": self.weight(agent_id),
+                "dispatched": self.dispatched.get(agent_id, 0),
+                "wait_ms": {
+                    "p50": round(percentile(list(self.waits[agent_id]), 50), 1),
+                    "p95": round(percentile(list(self.waits[agent_id]), 95), 1),
+                    "p99": round(percentile(list(self.waits[agent_id]), 99), 1),
+                },
+            }
+            for agent_id in sorted(agents)
+        }
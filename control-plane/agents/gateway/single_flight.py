@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Single Flight - Coalesces identical in-flight requests
+
+When several agents send the same request at the same moment (BatchExecutor
+fan-outs, council turns), the first one becomes the leader and makes the
+upstream call; the others attach to the leader's future and share its
+response, so N duplicates cost one set of rate-limit tokens and one call.
+
+Requests are matched on the same canonical hash as the response cache,
+and only deterministic ones (temperature=0 generations, embeddings) are
+coalesced: two sampled completions are expected to differ.
+Only results that reached upstream are shared: if the leader was rejected
+by its own agent quota or queue, or was cancelled, its followers run on
+their own.
+"""
+
+import asyncio
+from collections import defaultdict
+from typing import Any, Awaitable, Callable, Dict, Tuple
+
+
+class SingleFlight:
+    """Per-key leader/follower coalescing for concurrent identical calls"""
+
+    def __init__(self):
+        self.inflight: Dict[str, asyncio.Future] = {}
+        self.stats = {
+            "leaders": 0,
+            "coalesced": 0,
+            "fallbacks": 0,
+        }
+        self.coalesced_by_agent: Dict[str, int] = defaultdict(int)
+
+    async def do(self, key: str, agent_id: str, fn: Callable[[], Awaitable[Any]],
+                 shareable: Callable[[Any], bool] = lambda result: True) -> Tuple[Any, bool]:
+        """
+        Run fn once per key among concurrent callers.
+
+        Returns (result, shared): shared is True when the result came from
+        another caller's upstream call.
+        """
+        leader = self.inflight.get(key)
+        if leader is not None:
+            # shield: a follower going away must not cancel the leader's call
+            result = await asyncio.shield(leader)
+            if result is not None and shareable(result):
+                self.stats["coalesced"] += 1
+                self.coalesced_by_agent[agent_id] += 1
+                return result, True
+            self.stats["fallbacks"] += 1
+            return await fn(), False
+
+        future = asyncio.get_running_loop().create_future()
+        self.inflight[key] = future
+        self.stats["leaders"] += 1
+        try:
+            result = await fn()
+        except asyncio.CancelledError:
+            future.set_result(None)
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # Mark retrieved when there are no followers
+            raise
+        else:
+            future.set_result(result)
+            return result, False
+        finally:
+            self.inflight.pop(key, None)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            **self.stats,
+            "in_flight": len(self.inflight),
+            "coalesced_by_agent": dict(self.coalesced_by_agent),
+        }
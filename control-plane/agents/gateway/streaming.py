@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+Streaming - SSE usage metering for pass-through streams
+
+The gateway relays provider SSE bytes to the caller untouched and feeds a
+copy through StreamMeter, which tracks input/output tokens as the deltas
+arrive:
+- OpenAI: choices[].delta.content, plus the final usage chunk
+  (stream_body always sets stream_options.include_usage)
+- Anthropic: message_start / message_delta usage, content_block_delta text
+- Google: candidates[].content.parts[].text and cumulative usageMetadata
+
+The prompt starts at the token_estimator estimate and text deltas are
+counted with the same estimator until the provider reports real usage,
+which then replaces the estimate. feed() returns what changed since the
+last call, so the first delta carries the prompt estimate and later ones
+correct it (possibly negative); their sum is always total_tokens. Input
+tokens include prompt-cache reads and writes, which are also tracked
+separately for pricing.
+"""
+
+import json
+import time
+from typing import Any, Dict, Optional, Tuple
+
+from token_estimator import count_tokens, estimate_prompt_tokens
+
+
+def stream_endpoint(service: str, endpoint: str) -> str:
+    """Google streams from a different method; the others use body.stream"""
+    if service != "google":
+        return endpoint
+    endpoint = endpoint.replace(":generateContent", ":streamGenerateContent")
+    if "alt=sse" not in endpoint:
+        endpoint += ("&" if "?" in endpoint else "?") + "alt=sse"
+    return endpoint
+
+
+def stream_body(service: str, body: Dict[str, Any]) -> Dict[str, Any]:
+    if service == "google":
+        return body
+    if service == "openai":
+        # Without the final usage chunk the prompt would only ever be estimated
+        options = {**(body.get("stream_options") or {}), "include_usage": True}
+        return {**body, "stream": True, "stream_options": options}
+    return {**body, "stream": True}
+
+
+class StreamMeter:
+    """Incremental token counter over a provider's SSE stream"""
+
+    def __init__(self, service: str, model: str, request_body: Dict[str, Any]):
+        self.service = service
+        self.model = model
+        self.started = time.time()
+        self.first_token_at: Optional[float] = None
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.cache_read_tokens = 0
+        self.cache_write_tokens = 0
+        self.events = 0
+        self._estimated_output = 0
+        self._reported_output = False
+        self._booked = (0, 0)
+        self._buffer = b""
+
+        # Until the provider reports it, the prompt is the admission estimate
+        self.input_tokens = estimate_prompt_tokens(service, model, request_body)
+
+    @property
+    def total_tokens(self) -> int:
+        return self.input_tokens + self.output_tokens
+
+    @property
+    def ttft_ms(self) -> Optional[int]:
+        if self.first_token_at is None:
+            return None
+        return int((self.first_token_at - self.started) * 1000)
+
+    def feed(self, chunk: bytes) -> Tuple[int, int]:
+        """Consume raw stream bytes; returns the (input, output) token deltas not yet returned"""
+        self._buffer += chunk
+        *lines, self._buffer = self._buffer.split(b"\n")
+        for line in lines:
+            line = line.strip()
+            if not line.startswith(b"data:"):
+                continue
+            data = line[5:].strip()
+            if not data or data == b"[DONE]":
+                continue
+            try:
+                event = json.loads(data)
+            except ValueError:
+                continue
+            self.events += 1
+            self._apply(event)
+        return self.unbooked()
+
+    def unbooked(self) -> Tuple[int, int]:
+        """(input, output) change since the last feed() or unbooked(), now marked as booked"""
+        booked, self._booked = self._booked, (self.input_tokens, self.output_tokens)
+        return self.input_tokens - booked[0], self.output_tokens - booked[1]
+
+    def _apply(self, event: Dict[str, Any]):
+        text = ""
+        if self.service == "openai":
+            for choice in event.get("choices") or []:
+                text += (choice.get("delta") or {}).get("content") or ""
+            usage = event.get("usage")
+            if usage:
+                cached = (usage.get("prompt_tokens_details") or {}).get("cached_tokens")
+                self._report(usage.get("prompt_tokens"), usage.get("completion_tokens"), cache_read=cached)
+
+        elif self.service == "anthropic":
+            kind = event.get("type")
+            if kind == "message_start":
+                self._report_anthropic((event.get("message") or {}).get("usage") or {})
+            elif kind == "content_block_delta":
+                text = (event.get("delta") or {}).get("text") or ""
+            elif kind == "message_delta":
+                self._report_anthropic(event.get("usage") or {})
+
+        elif self.service == "google":
+            for candidate in event.get("candidates") or []:
+                for part in (candidate.get("content") or {}).get("parts") or []:
+                    text += part.get("text") or ""
+            usage = event.get("usageMetadata")
+            if usage:
+                self._report(usage.get("promptTokenCount"), usage.get("candidatesTokenCount"),
+                             cache_read=usage.get("cachedContentTokenCount"))
+
+        if text:
+            if self.first_token_at is None:
+                self.first_token_at = time.time()
+            self._estimated_output += count_tokens(self.service, self.model, text)
+            if not self._reported_output:
+                self.output_tokens = self._estimated_output
+
+    def _report(self, input_tokens: Optional[int], output_tokens: Optional[int],
+                cache_read: Optional[int] = None, cache_write: Optional[int] = None):
+        if input_tokens:
+            self.input_tokens = input_tokens
+        if output_tokens is not None:
+            self.output_tokens = output_tokens
+            self._reported_output = True
+        if cache_read is not None:
+            self.cache_read_tokens = cache_read
+        if cache_write is not None:
+            self.cache_write_tokens = cache_write
+
+    def _report_anthropic(self, usage: Dict[str, Any]):
+        # Anthropic's input_tokens excludes the cached prefix
+        cache_read = usage.get("cache_read_input_tokens")
+        cache_write = usage.get("cache_creation_input_tokens")
+        input_tokens = usage.get("input_tokens")
+        if input_tokens is not None:
+            # message_delta may repeat input_tokens without the cache fields
+            input_tokens += self.cache_read_tokens if cache_read is None else cache_read
+            input_tokens += self.cache_write_tokens if cache_write is None else cache_write
+        self._report(input_tokens, usage.get("output_tokens"), cache_read, cache_write)
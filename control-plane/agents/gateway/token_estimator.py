@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+Token Estimator - Gateway-side token estimates for admission control
+
+Estimates what a request will cost before it is sent, so the TPM bucket
+is debited by something close to reality instead of the caller's guess:
+- Prompt tokens are counted with a local tokenizer when one is available
+  for the model (tiktoken for OpenAI models), loaded once per model
+- Otherwise a character-class approximation is used: words, digits,
+  punctuation and CJK/other scripts each tokenize at different rates
+- The output allowance is the request's max-tokens setting, capped at
+  GATEWAY_ESTIMATE_MAX_OUTPUT; embeddings have no output
+
+The gateway reconciles the bucket with the real usage afterwards, so an
+estimate only has to be good enough for queueing decisions.
+"""
+
+import os
+import re
+import json
+import math
+from functools import lru_cache
+from typing import Any, Callable, Dict, Optional
+
+try:
+    import tiktoken
+    TIKTOKEN_AVAILABLE = True
+except ImportError:
+    TIKTOKEN_AVAILABLE = False
+
+
+DEFAULT_OUTPUT_TOKENS = int(os.getenv("GATEWAY_ESTIMATE_DEFAULT_OUTPUT", "512"))
+MAX_OUTPUT_TOKENS = int(os.getenv("GATEWAY_ESTIMATE_MAX_OUTPUT", "4096"))
+MESSAGE_OVERHEAD_TOKENS = 4  # Role and separators per chat message
+
+# Copied to control-plane/shared/unified_threading/tokenizer.py (this service
+# does not import the shared package); change both together.
+TOKEN_CLASSES = re.compile(
+    r"(?P<word>[A-Za-z]+)"
+    r"|(?P<digits>[0-9]+)"
+    r"|(?P<space>\s+)"
+    r"|(?P<cjk>[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af])"
+    r"|(?P<other>[^\x00-\x7f])"
+    r"|(?P<punct>.)",
+    re.S
+)
+
+
+def approximate_tokens(text: str) -> int:
+    """Character-class approximation of BPE token counts"""
+    tokens = 0.0
+    for match in TOKEN_CLASSES.finditer(text):
+        kind = match.lastgroup
+        length = match.end() - match.start()
+        if kind == "word":
+            tokens += math.ceil(length / 6)  # Common words are one token, long ones split
+        elif kind == "digits":
+            tokens += math.ceil(length / 3)
+        elif kind == "space":
+            tokens += 0 if length == 1 else 1  # A single space merges into the next word
+        elif kind == "cjk":
+            tokens += length
+        elif kind == "other":
+            tokens += length * 0.5
+        else:
+            tokens += length
+    return math.ceil(tokens)
+
+
+@lru_cache(maxsize=64)
+def tokenizer_for(service: str, model: str) -> Optional[Callable[[str], int]]:
+    """Local token counter for a model, or None to use the approximation"""
+    if service != "openai" or not TIKTOKEN_AVAILABLE:
+        return None
+    try:
+        try:
+            encoding = tiktoken.encoding_for_model(model)
+        except KeyError:
+            encoding = tiktoken.get_encoding("o200k_base")
+    except Exception as e:
+        # Encodings are downloaded on first use; offline hosts fall back
+        print(f"Tokenizer unavailable for {model}, using approximation: {e}")
+        return None
+    return lambda text: len(encoding.encode(text, disallowed_special=()))
+
+
+def count_tokens(service: str, model: str, text: str) -> int:
+    if not text:
+        return 0
+    tokenizer = tokenizer_for(service, model)
+    return tokenizer(text) if tokenizer else approximate_tokens(text)
+
+
+def _content_text(content: Any) -> str:
+    """Text of a message content: string, content blocks or Google parts"""
+    if isinstance(content, str):
+        return content
+    if isinstance(content, list):
+        return "\n".join(_content_text(block) for block in content)
+    if isinstance(content, dict):
+        if "text" in content:
+            return str(content["text"])
+        if "parts" in content:
+            return _content_text(content["parts"])
+        if "content" in content:
+            return _content_text(content["content"])
+        return ""  # Images and other media; reconciliation settles them after the response
+    return "" if content is None else str(content)
+
+
+def estimate_prompt_tokens(service: str, model: str, body: Dict[str, Any]) -> int:
+    messages = body.get("messages") or body.get("contents") or []
+    tokens = sum(
+        MESSAGE_OVERHEAD_TOKENS + count_tokens(service, model, _content_text(message))
+        for message in messages
+    )
+    for key in ("system", "systemInstruction", "prompt", "input"):
+        if body.get(key):
+            tokens += count_tokens(service, model, _content_text(body[key]))
+    if body.get("tools"):
+        tokens += count_tokens(service, model, json.dumps(body["tools"]))
+    return tokens
+
+
+def estimate_output_tokens(endpoint: str, body: Dict[str, Any]) -> int:
+    if "embed" in endpoint.lower():
+        return 0
+    requested = (
+        body.get("max_tokens")
+        or body.get("max_completion_tokens")
+        or body.get("max_output_tokens")
+        or (body.get("generationConfig") or {}).get("maxOutputTokens")
+    )
+    return min(int(requested), MAX_OUTPUT_TOKENS) if requested else DEFAULT_OUTPUT_TOKENS
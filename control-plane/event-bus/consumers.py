@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""
+Consumer Offsets
+
+At-least-once consumption of each agent's deliveries (event_deliveries).
+
+- fetch_pending leases a batch of unacknowledged deliveries in event_seq
+  order. Leased events stay hidden from that agent for the visibility
+  timeout and are redelivered once it passes unless acked.
+- ack_deliveries acknowledges any number of events at once, drops their
+  leases and advances the agent's committed offset (the highest seq below
+  which everything is acked), so the next fetch starts past the processed
+  prefix instead of re-reading it.
+- A delivery that keeps timing out is moved to 'dead_letter' after
+  MAX_DELIVERIES attempts so it cannot wedge the consumer.
+
+Each agent is its own consumer group; several workers of the same agent
+can poll concurrently because leases keep their batches disjoint.
+
+All functions are store operations: fn(conn, ...) run on the writer or a
+reader connection.
+
+Location: /opt/leveredge/control-plane/event-bus/consumers.py
+"""
+
+import os
+import time
+from datetime import datetime
+from typing import Any, Dict, Iterable, List
+
+DEFAULT_VISIBILITY_TIMEOUT = int(os.environ.get("EVENT_BUS_VISIBILITY_TIMEOUT", "60"))  # seconds
+MAX_DELIVERIES = int(os.environ.get("EVENT_BUS_MAX_DELIVERIES", "10"))
+
+
+def committed_offset(conn, agent: str) -> int:
+    row = conn.execute(
+        "SELECT committed_seq FROM consumer_offsets WHERE agent = ?", (agent,)
+    ).fetchone()
+    return row[0] if row else 0
+
+
+def fetch_pending(conn, agent: str, limit: int, visibility_timeout: int) -> List[Dict[str, Any]]:
+    """Lease up to limit deliverable events for an agent, oldest first"""
+    now = time.time()
+    rows = conn.execute("""
+        SELECT e.*, e.rowid AS seq, COALESCE(l.delivery_count, 0) AS delivery_count
+        FROM event_deliveries d
+        JOIN events e ON e.id = d.event_id
+        LEFT JOIN delivery_leases l ON l.event_id = d.event_id AND l.agent = d.agent
+        WHERE d.agent = ? AND d.status = 'pending' AND d.event_seq > ?
+        AND (l.leased_until IS NULL OR l.leased_until <= ?)
+        ORDER BY d.event_seq
+        LIMIT ?
+    """, (agent, committed_offset(conn, agent), now, limit)).fetchall()
+
+    deliverable, dead = [], []
+    for row in rows:
+        (dead if row['delivery_count'] >= MAX_DELIVERIES else deliverable).append(row)
+
+    if dead:
+        conn.executemany("""
+            UPDATE event_deliveries SET status = 'dead_letter'
+            WHERE event_id = ? AND agent = ?
+        """, [(row['id'], agent) for row in dead])
+        conn.executemany(
+            "DELETE FROM delivery_leases WHERE event_id = ? AND agent = ?",
+            [(row['id'], agent) for row in dead]
+        )
+        advance_offset(conn, agent, 0)
+
+    if visibility_timeout > 0 and deliverable:
+        conn.executemany("""
+            INSERT INTO delivery_leases (event_id, agent, leased_until, delivery_count)
+            VALUES (?, ?, ?, 1)
+            ON CONFLICT(event_id, agent) DO UPDATE SET
+                leased_until = excluded.leased_until,
+                delivery_count = delivery_count + 1
+        """, [(row['id'], agent, now + visibility_timeout) for row in deliverable])
+
+    # delivery_count on the returned event is this attempt's number
+    return [dict(row, delivery_count=row['delivery_count'] + 1) for row in deliverable]
+
+
+def release_leases(conn, agent: str, event_ids: Iterable[str]):
+    """Make leased events immediately deliverable again without counting the attempt"""
+    conn.executemany("""
+        UPDATE delivery_leases
+        SET leased_until = 0, delivery_count = MAX(delivery_count - 1, 0)
+        WHERE event_id = ? AND agent = ?
+    """, [(event_id, agent) for event_id in event_ids])
+
+
+def ack_deliveries(conn, agent: str, event_ids: Iterable[str]) -> int:
+    """Acknowledge events for an agent; returns how many deliveries changed state"""
+    acked_at = datetime.now().isoformat()
+    ids = list(dict.fromkeys(event_ids))
+
+    cursor = conn.executemany("""
+        UPDATE event_deliveries
+        SET status = 'acknowledged', acked_at = ?
+        WHERE event_id = ? AND agent = ? AND status != 'acknowledged'
+    """, [(acked_at, event_id, agent) for event_id in ids])
+    acked = max(cursor.rowcount, 0)
+
+    conn.executemany(
+        "DELETE FROM delivery_leases WHERE event_id = ? AND agent = ?",
+        [(event_id, agent) for event_id in ids]
+    )
+    conn.executemany("""
+        UPDATE events
+        SET acknowledged_by = json_set(COALESCE(NULLIF(acknowledged_by, ''), '{}'), '$."' || ? || '"', ?),
+            updated_at = datetime('now')
+        WHERE id = ?
+    """, [(agent, acked_at, event_id) for event_id in ids])
+
+    advance_offset(conn, agent, acked)
+    return acked
+
+
+def advance_offset(conn, agent: str, acked: int):
+    """Move the committed offset up to just before the oldest pending delivery"""
+    oldest_pending = conn.execute("""
+        SELECT MIN(event_seq) FROM event_deliveries
+        WHERE agent = ? AND status = 'pending'
+    """, (agent,)).fetchone()[0]
+
+    if oldest_pending is not None:
+        committed = oldest_pending - 1
+    else:
+        committed = conn.execute(
+            "SELECT COALESCE(MAX(event_seq), 0) FROM event_deliveries WHERE agent = ?", (agent,)
+        ).fetchone()[0]
+
+    conn.execute("""
+        INSERT INTO consumer_offsets (agent, committed_seq, acked_total, updated_at)
+        VALUES (?, ?, ?, datetime('now'))
+        ON CONFLICT(agent) DO UPDATE SET
+            committed_seq = MAX(committed_seq, excluded.committed_seq),
+            acked_total = acked_total + excluded.acked_total,
+            updated_at = excluded.updated_at
+    """, (agent, committed, acked))
+
+
+def consumer_stats(conn, agent: str) -> Dict[str, Any]:
+    """Offset, backlog and in-flight counts for one agent"""
+    offset = conn.execute(
+        "SELECT committed_seq, acked_total, updated_at FROM consumer_offsets WHERE agent = ?", (agent,)
+    ).fetchone()
+    counts = {
+        row['status']: row['count'] for row in conn.execute("""
+            SELECT status, COUNT(*) AS count FROM event_deliveries
+            WHERE agent = ? GROUP BY status
+        """, (agent,))
+    }
+    in_flight = conn.execute(
+        "SELECT COUNT(*) FROM delivery_leases WHERE agent = ? AND leased_until > ?",
+        (agent, time.time())
+    ).fetchone()[0]
+    head = conn.execute(
+        "SELECT MAX(event_seq) FROM event_deliveries WHERE agent = ?", (agent,)
+    ).fetchone()[0]
+
+    return {
+        "agent": agent,
+        "committed_seq": offset['committed_seq'] if offset else 0,
+        "head_seq": head or 0,
+        "acked_total": offset['acked_total'] if offset else 0,
+        "pending": counts.get('pending', 0),
+        "in_flight": in_flight,
+        "dead_letter": counts.get('dead_letter', 0),
+        "updated_at": offset['updated_at'] if offset else None,
+    }
@@ -46,7 +46,53 @@ CREATE INDEX IF NOT EXISTS idx_events_source ON events(source_agent);
 CREATE INDEX IF NOT EXISTS idx_events_action ON events(action);
 CREATE INDEX IF NOT EXISTS idx_events_status ON events(status);
 CREATE INDEX IF NOT EXISTS idx_events_requires_human ON events(requires_human);
-CREATE INDEX IF NOT EXISTS idx_events_timestamp ON events(timestamp DESC);
+CREATE INDEX IF NOT EXISTS idx_events_timestamp ON events(timestamp);  -- Walked backwards for newest-first listings
+
+-- Per-agent delivery state (one row per subscribed agent per event)
+CREATE TABLE IF NOT EXISTS event_deliveries (
+  event_id TEXT NOT NULL,
+  agent TEXT NOT NULL,
+  event_seq INTEGER NOT NULL,  -- events.rowid, gives insertion order
+  status TEXT DEFAULT 'pending',  -- pending, acknowledged, dead_letter
+  acked_at TEXT,
+  PRIMARY KEY (event_id, agent)
+);
+
+CREATE INDEX IF NOT EXISTS idx_deliveries_agent_seq ON event_deliveries(agent, event_seq DESC);
+CREATE INDEX IF NOT EXISTS idx_deliveries_agent_status_seq ON event_deliveries(agent, status, event_seq DESC);
+
+-- In-flight deliveries and committed offsets for /events/pending/{agent} (see consumers.py)
+CREATE TABLE IF NOT EXISTS delivery_leases (
+  event_id TEXT NOT NULL,
+  agent TEXT NOT NULL,
+  leased_until REAL NOT NULL,  -- unix seconds; redelivered after this unless acked
+  delivery_count INTEGER NOT NULL DEFAULT 1,
+  PRIMARY KEY (event_id, agent)
+);
+
+CREATE TABLE IF NOT EXISTS consumer_offsets (
+  agent TEXT PRIMARY KEY,
+  committed_seq INTEGER NOT NULL DEFAULT 0,  -- every delivery at or below this seq is acked
+  acked_total INTEGER NOT NULL DEFAULT 0,
+  updated_at TEXT DEFAULT (datetime('now'))
+);
+
+-- Cold archive segment index (see retention.py)
+CREATE TABLE IF NOT EXISTS archive_segments (
+  day TEXT PRIMARY KEY,  -- YYYY-MM-DD of the archived events' timestamps
+  path TEXT NOT NULL,
+  event_count INTEGER NOT NULL DEFAULT 0,
+  bytes INTEGER NOT NULL DEFAULT 0,
+  min_seq INTEGER,
+  max_seq INTEGER,
+  first_timestamp TEXT,
+  last_timestamp TEXT,
+  actions TEXT DEFAULT '[]',  -- JSON array of actions in the segment
+  sources TEXT DEFAULT '[]',  -- JSON array of source agents in the segment
+  updated_at TEXT DEFAULT (datetime('now'))
+);
+
+CREATE INDEX IF NOT EXISTS idx_archive_segments_range ON archive_segments(first_timestamp, last_timestamp);
 
 -- Agent subscriptions table (what each agent listens for)
 CREATE TABLE IF NOT EXISTS agent_subscriptions (
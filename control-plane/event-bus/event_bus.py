@@ -11,27 +11,208 @@ Port: 8099
 
 import sqlite3
 import json
-from datetime import datetime
+import uuid
+import asyncio
+from datetime import datetime, timezone
 from pathlib import Path
-from typing import Optional, List
-from fastapi import FastAPI, HTTPException
+from typing import Optional, List, Dict, Any, Set
+from fastapi import FastAPI, HTTPException, Request, Query, Header
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from contextlib import contextmanager
+from contextlib import contextmanager, asynccontextmanager
 
-app = FastAPI(title="Event Bus", version="1.0.0")
+from subscriptions import SubscriptionMatcher
+from partitions import PartitionedStore, merge_sorted
+from retention import RetentionManager
+from consumers import (
+    DEFAULT_VISIBILITY_TIMEOUT, fetch_pending, release_leases, ack_deliveries, consumer_stats
+)
 
 import os
 DB_PATH = Path(os.environ.get("EVENT_BUS_DB_PATH", "/opt/leveredge/control-plane/event-bus/events.db"))
+MIGRATIONS_DIR = Path(__file__).parent / "migrations"
+SCHEMA_PATH = Path(__file__).parent / "event-bus-schema.sql"
+ARCHIVE_DIR = Path(os.environ.get("EVENT_BUS_ARCHIVE_DIR", str(DB_PATH.parent / "archive")))
+RETENTION_ENABLED = os.environ.get("EVENT_BUS_RETENTION_ENABLED", "true").lower() == "true"
+
+# Streaming settings
+STREAM_QUEUE_SIZE = int(os.environ.get("EVENT_BUS_STREAM_QUEUE_SIZE", "1000"))  # Per-subscriber backlog
+STREAM_HEARTBEAT_SECONDS = float(os.environ.get("EVENT_BUS_STREAM_HEARTBEAT", "15"))
+STREAM_REPLAY_PAGE = 500  # Rows per page when replaying after Last-Event-ID
+
+# Batch publish settings
+MAX_BATCH_SIZE = int(os.environ.get("EVENT_BUS_MAX_BATCH_SIZE", "1000"))
 
 @contextmanager
-def get_db():
-    conn = sqlite3.connect(DB_PATH)
+def get_db(db_path: Path = DB_PATH):
+    conn = sqlite3.connect(db_path)
     conn.row_factory = sqlite3.Row
     try:
         yield conn
     finally:
         conn.close()
 
+partitions = PartitionedStore(DB_PATH)
+store = partitions.primary  # Shared tables (agent_subscriptions) live in partition 0
+
+# One retention manager per partition; partition 0 keeps the top-level archive directory
+retention_managers = [
+    RetentionManager(partition, ARCHIVE_DIR if i == 0 else ARCHIVE_DIR / f"p{i}")
+    for i, partition in enumerate(partitions.stores)
+]
+
+def init_partition(db_path: Path):
+    """Create the events schema in a new partition file"""
+    with get_db(db_path) as conn:
+        exists = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'events'"
+        ).fetchone()
+        if not exists:
+            conn.executescript(SCHEMA_PATH.read_text())
+            conn.commit()
+            print(f"Initialized partition {db_path.name}")
+
+def apply_migrations(db_path: Path = DB_PATH):
+    """Apply any migrations/*.sql not yet recorded in schema_migrations"""
+    if not MIGRATIONS_DIR.exists():
+        return
+    with get_db(db_path) as conn:
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version TEXT PRIMARY KEY,
+                applied_at TEXT DEFAULT (datetime('now'))
+            )
+        """)
+        applied = {row['version'] for row in conn.execute("SELECT version FROM schema_migrations")}
+        for path in sorted(MIGRATIONS_DIR.glob("*.sql")):
+            if path.stem in applied:
+                continue
+            conn.executescript(path.read_text())
+            conn.execute("INSERT INTO schema_migrations (version) VALUES (?)", (path.stem,))
+            conn.commit()
+            print(f"Applied migration {path.name} to {db_path.name}")
+
+# Subscription routing
+
+matcher = SubscriptionMatcher()
+
+async def reload_subscriptions() -> SubscriptionMatcher:
+    """Rebuild the in-memory subscription matcher from agent_subscriptions"""
+    global matcher
+
+    def query(conn):
+        return conn.execute("""
+            SELECT agent_name, action_pattern, priority
+            FROM agent_subscriptions
+            WHERE enabled = 1
+        """).fetchall()
+
+    rows = await store.read(query)
+    matcher = SubscriptionMatcher.from_rows(rows, version=matcher.version + 1)
+    return matcher
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    for db_path in partitions.paths[1:]:
+        init_partition(db_path)
+    for db_path in partitions.paths:
+        apply_migrations(db_path)
+    await partitions.start()
+    await reload_subscriptions()
+    if RETENTION_ENABLED:
+        for manager in retention_managers:
+            manager.start()
+    yield
+    for manager in retention_managers:
+        await manager.stop()
+    await partitions.stop()
+
+app = FastAPI(title="Event Bus", version="1.0.0", lifespan=lifespan)
+
+EVENT_COLUMNS = (
+    'id', 'timestamp', 'source_agent', 'source_workflow_id', 'source_execution_id',
+    'action', 'target', 'details', 'requires_human', 'human_question', 'human_options',
+    'human_timeout_minutes', 'human_fallback', 'human_response', 'human_responded_at',
+    'human_notified', 'subscribed_agents', 'acknowledged_by', 'status', 'created_at', 'updated_at'
+)
+JSON_COLUMNS = ('details', 'subscribed_agents', 'human_options', 'acknowledged_by')
+
+def decode_event(row, decode_json: bool = True) -> Dict[str, Any]:
+    """Convert an events row to a dict with JSON columns parsed"""
+    event = dict(row)
+    if decode_json:
+        for column in JSON_COLUMNS:
+            if event.get(column):
+                event[column] = json.loads(event[column])
+    return event
+
+def normalize_timestamp(value: str) -> str:
+    """Convert an ISO timestamp to the 'YYYY-MM-DD HH:MM:SS' UTC form events are stored in"""
+    try:
+        parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid timestamp: {value}")
+    if parsed.tzinfo:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed.strftime("%Y-%m-%d %H:%M:%S")
+
+# Streaming fan-out
+
+class StreamSubscriber:
+    """A connected stream client and the filters it asked for"""
+
+    def __init__(self, agent: Optional[str], actions: Optional[List[str]], source_agent: Optional[str]):
+        self.agent = agent
+        patterns = [a for a in (actions or []) if a and a != '*']
+        self.actions = SubscriptionMatcher((('stream', p, 5) for p in patterns)) if patterns else None
+        self.source_agent = source_agent
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=STREAM_QUEUE_SIZE)
+        self.overflowed = False
+
+    def wants(self, event: Dict[str, Any]) -> bool:
+        if self.source_agent and event.get('source_agent') != self.source_agent:
+            return False
+        if self.agent and self.agent not in (event.get('subscribed_agents') or []):
+            return False
+        if self.actions and not self.actions.match(event.get('action', '')):
+            return False
+        return True
+
+
+class EventBroadcaster:
+    """
+    Pushes newly created events to every connected stream subscriber.
+
+    Each subscriber gets a bounded queue. A subscriber that falls too far
+    behind is dropped rather than allowed to grow memory; its client
+    reconnects with Last-Event-ID and catches up from the database.
+    """
+
+    def __init__(self):
+        self.subscribers: Set[StreamSubscriber] = set()
+
+    def subscribe(self, subscriber: StreamSubscriber):
+        self.subscribers.add(subscriber)
+
+    def unsubscribe(self, subscriber: StreamSubscriber):
+        self.subscribers.discard(subscriber)
+
+    def publish(self, event: Dict[str, Any]):
+        for subscriber in list(self.subscribers):
+            if subscriber.overflowed or not subscriber.wants(event):
+                continue
+            try:
+                subscriber.queue.put_nowait(event)
+            except asyncio.QueueFull:
+                subscriber.overflowed = True
+
+
+broadcaster = EventBroadcaster()
+
+def format_sse(event: Dict[str, Any]) -> str:
+    """Format an event as a server-sent event frame"""
+    return f"id: {event['seq']}\ndata: {json.dumps(event, default=str)}\n\n"
+
 # Models
 class EventCreate(BaseModel):
     source_agent: str
@@ -50,183 +231,458 @@ class HumanResponse(BaseModel):
     response: str
     responder: str = "human"
 
+class AckRequest(BaseModel):
+    subscriber: str
+
+class BulkAckRequest(BaseModel):
+    subscriber: str
+    event_ids: List[str]
+
+class SubscriptionCreate(BaseModel):
+    agent_name: str
+    action_pattern: str
+    priority: int = 5
+    enabled: bool = True
+
+class SubscriptionUpdate(BaseModel):
+    action_pattern: Optional[str] = None
+    priority: Optional[int] = None
+    enabled: Optional[bool] = None
+
+def insert_events(conn, events: List[EventCreate], first_seq: int) -> List[Dict[str, Any]]:
+    """
+    Insert events and their delivery rows. Runs on a partition writer,
+    inside its group-commit transaction.
+
+    Subscriptions are matched once per distinct action. Ids and timestamps
+    are assigned here and sequence numbers are reserved by the caller
+    (partitions.allocate_seqs), so nothing has to be re-read after the
+    insert. Returns the stored events, ready for fan-out.
+    """
+    routes = {action: matcher.match(action) for action in {e.action for e in events}}
+    timestamp = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
+
+    records = []
+    for offset, event in enumerate(events):
+        subscribed = routes[event.action]
+        records.append({
+            "seq": first_seq + offset,
+            "id": uuid.uuid4().hex,
+            "timestamp": timestamp,
+            "source_agent": event.source_agent,
+            "source_workflow_id": event.source_workflow_id,
+            "source_execution_id": event.source_execution_id,
+            "action": event.action,
+            "target": event.target,
+            "details": event.details,
+            "requires_human": 1 if event.requires_human else 0,
+            "human_question": event.human_question,
+            "human_options": event.human_options,
+            "human_timeout_minutes": event.human_timeout_minutes,
+            "human_fallback": event.human_fallback,
+            "subscribed_agents": subscribed,
+            "acknowledged_by": {},
+            "status": "pending",
+            "created_at": timestamp,
+            "updated_at": timestamp,
+        })
+
+    conn.executemany("""
+        INSERT INTO events (
+            rowid, id, timestamp,
+            source_agent, action, target, details,
+            source_workflow_id, source_execution_id,
+            requires_human, human_question, human_options,
+            human_timeout_minutes, human_fallback,
+            subscribed_agents, status, created_at, updated_at
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, [
+        (
+            r["seq"], r["id"], r["timestamp"],
+            r["source_agent"], r["action"], r["target"],
+            json.dumps(r["details"]) if r["details"] else None,
+            r["source_workflow_id"], r["source_execution_id"],
+            r["requires_human"], r["human_question"],
+            json.dumps(r["human_options"]) if r["human_options"] else None,
+            r["human_timeout_minutes"], r["human_fallback"],
+            json.dumps(r["subscribed_agents"]), r["status"],
+            r["created_at"], r["updated_at"]
+        )
+        for r in records
+    ])
+
+    # One delivery row per subscribed agent
+    conn.executemany("""
+        INSERT INTO event_deliveries (event_id, agent, event_seq)
+        VALUES (?, ?, ?)
+    """, [(r["id"], agent, r["seq"]) for r in records for agent in r["subscribed_agents"]])
+
+    return records
+
 # Endpoints
 @app.get("/health")
 async def health():
-    return {"status": "healthy", "service": "event-bus", "port": 8099}
+    return {
+        "status": "healthy",
+        "service": "event-bus",
+        "port": 8099,
+        "stream_subscribers": len(broadcaster.subscribers),
+        "subscriptions": matcher.stats(),
+        "store": partitions.get_stats(),
+        "retention": await retention_stats(cached=True)
+    }
 
 @app.post("/events")
 async def create_event(event: EventCreate):
     """Publish an event to the bus"""
 
-    # Determine subscribed agents
-    with get_db() as conn:
-        cursor = conn.cursor()
+    partition = partitions.stores[partitions.partition_for(event.source_agent, event.action)]
+    record = (await partition.write(insert_events, [event], partitions.allocate_seqs(1)))[0]
 
-        # Get matching subscriptions
-        cursor.execute("""
-            SELECT DISTINCT agent_name
-            FROM agent_subscriptions
-            WHERE enabled = 1
-            AND (
-                action_pattern = ?
-                OR action_pattern = '*'
-                OR (action_pattern LIKE '%*' AND ? LIKE REPLACE(action_pattern, '*', '%'))
-                OR (action_pattern LIKE '*%' AND ? LIKE REPLACE(action_pattern, '*', '%'))
-            )
-        """, (event.action, event.action, event.action))
-
-        subscribed = [row['agent_name'] for row in cursor.fetchall()]
-
-        # Insert event
-        cursor.execute("""
-            INSERT INTO events (
-                source_agent, action, target, details,
-                source_workflow_id, source_execution_id,
-                requires_human, human_question, human_options,
-                human_timeout_minutes, human_fallback,
-                subscribed_agents, status
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """, (
-            event.source_agent,
-            event.action,
-            event.target,
-            json.dumps(event.details) if event.details else None,
-            event.source_workflow_id,
-            event.source_execution_id,
-            1 if event.requires_human else 0,
-            event.human_question,
-            json.dumps(event.human_options) if event.human_options else None,
-            event.human_timeout_minutes,
-            event.human_fallback,
-            json.dumps(subscribed),
-            'pending'
-        ))
+    broadcaster.publish(record)
 
-        event_id = cursor.lastrowid
-        conn.commit()
+    return {
+        "id": record['id'],
+        "status": "created",
+        "subscribed_agents": record['subscribed_agents']
+    }
 
-        # Get the created event
-        cursor.execute("SELECT * FROM events WHERE rowid = ?", (event_id,))
-        row = cursor.fetchone()
+@app.post("/events/batch")
+async def create_events_batch(events: List[EventCreate]):
+    """Publish many events in one request and one transaction per partition"""
 
-        return {
-            "id": row['id'],
-            "status": "created",
-            "subscribed_agents": subscribed
-        }
+    if not events:
+        return {"ids": [], "count": 0, "status": "created"}
 
-@app.get("/events")
-async def list_events(
-    limit: int = 50,
-    source_agent: Optional[str] = None,
-    action: Optional[str] = None,
-    status: Optional[str] = None
-):
-    """List recent events"""
+    if len(events) > MAX_BATCH_SIZE:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Batch too large ({len(events)} events, max {MAX_BATCH_SIZE})"
+        )
 
-    with get_db() as conn:
-        cursor = conn.cursor()
+    groups: Dict[int, List[int]] = {}
+    for index, event in enumerate(events):
+        groups.setdefault(partitions.partition_for(event.source_agent, event.action), []).append(index)
 
-        query = "SELECT * FROM events WHERE 1=1"
-        params = []
+    written = await asyncio.gather(*(
+        partitions.stores[partition].write(
+            insert_events, [events[i] for i in indexes], partitions.allocate_seqs(len(indexes))
+        )
+        for partition, indexes in groups.items()
+    ))
 
-        if source_agent:
-            query += " AND source_agent = ?"
-            params.append(source_agent)
+    records: List[Dict[str, Any]] = [None] * len(events)
+    for indexes, group_records in zip(groups.values(), written):
+        for index, record in zip(indexes, group_records):
+            records[index] = record
 
-        if action:
-            query += " AND action = ?"
-            params.append(action)
+    for record in sorted(records, key=lambda r: r['seq']):
+        broadcaster.publish(record)
 
-        if status:
-            query += " AND status = ?"
-            params.append(status)
+    return {
+        "ids": [r['id'] for r in records],
+        "count": len(records),
+        "status": "created"
+    }
 
-        query += " ORDER BY timestamp DESC LIMIT ?"
-        params.append(limit)
+@app.get("/events")
+async def list_events(
+    limit: int = Query(50, ge=1, le=1000),
+    source_agent: Optional[str] = None,
+    action: Optional[str] = None,
+    status: Optional[str] = None,
+    since: Optional[str] = None,
+    before_id: Optional[str] = None,
+    after_timestamp: Optional[str] = None,
+    fields: Optional[str] = None,
+    decode_json: bool = True,
+    include_archived: bool = False
+):
+    """
+    List recent events, newest first.
+
+    Pagination is keyset-based: pass the returned next_cursor as before_id
+    to get the following (older) page. since (inclusive) and
+    after_timestamp (exclusive) bound the time window in SQL.
+
+    fields is a comma-separated projection (e.g. id,timestamp,action).
+    JSON columns are only decoded when selected; decode_json=false returns
+    them as raw strings.
+
+    include_archived=true merges in events retention has moved to the cold
+    archive (marked "archived": true). Cursors are then "<timestamp>|<seq>"
+    so they stay valid across hot and archived rows.
+    """
+
+    if fields:
+        columns = [f.strip() for f in fields.split(',') if f.strip()]
+        unknown = [c for c in columns if c not in EVENT_COLUMNS]
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+        # id and timestamp are needed for the cursor
+        selected = list(dict.fromkeys(['id', 'timestamp', *columns]))
+    else:
+        selected = list(EVENT_COLUMNS)
+
+    query = f"SELECT {', '.join(selected)}, rowid AS seq FROM events WHERE 1=1"
+    params = []
+
+    if source_agent:
+        query += " AND source_agent = ?"
+        params.append(source_agent)
+
+    if action:
+        query += " AND action = ?"
+        params.append(action)
+
+    if status:
+        query += " AND status = ?"
+        params.append(status)
+
+    if since:
+        query += " AND timestamp >= ?"
+        params.append(normalize_timestamp(since))
+
+    if after_timestamp:
+        query += " AND timestamp > ?"
+        params.append(normalize_timestamp(after_timestamp))
+
+    cursor = None
+    if before_id and '|' in before_id:
+        timestamp, _, seq = before_id.rpartition('|')
+        try:
+            cursor = (timestamp, int(seq))
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+    elif before_id:
+        def lookup(conn):
+            return conn.execute(
+                "SELECT timestamp, rowid FROM events WHERE id = ?", (before_id,)
+            ).fetchone()
+
+        found = [row for row in await partitions.read_all(lookup) if row]
+        if not found:
+            raise HTTPException(status_code=404, detail="Cursor event not found")
+        cursor = (found[0]['timestamp'], found[0]['rowid'])
+
+    if cursor:
+        # Row-value comparison lets SQLite seek idx_events_timestamp to the cursor
+        query += " AND (timestamp, rowid) < (?, ?)"
+        params.extend([cursor[0], cursor[1]])
+
+    query += " ORDER BY timestamp DESC, rowid DESC LIMIT ?"
+    params.append(limit)
+
+    def fetch(conn):
+        return [decode_event(row, decode_json) for row in conn.execute(query, params)]
+
+    events = merge_sorted(
+        await partitions.read_all(fetch),
+        key=lambda e: (e['timestamp'], e['seq']), reverse=True, limit=limit
+    )
+
+    if include_archived:
+        archived = await query_archive(
+            since=normalize_timestamp(since or after_timestamp) if (since or after_timestamp) else None,
+            before=cursor,
+            action=action,
+            source_agent=source_agent,
+            status=status,
+            limit=limit,
+            exclude_ids={e['id'] for e in events}
+        )
+        if after_timestamp:
+            bound = normalize_timestamp(after_timestamp)
+            archived = [e for e in archived if e['timestamp'] > bound]
+        for event in archived:
+            event = decode_event(event, decode_json)
+            event['archived'] = True
+            events.append({k: v for k, v in event.items() if k in selected or k in ('seq', 'archived')})
+        events.sort(key=lambda e: (e['timestamp'], e['seq']), reverse=True)
+        del events[limit:]
+        next_cursor = f"{events[-1]['timestamp']}|{events[-1]['seq']}" if len(events) == limit else None
+    else:
+        next_cursor = events[-1]['id'] if len(events) == limit else None
+
+    if fields:
+        requested = set(columns)
+        for event in events:
+            for column in ('id', 'timestamp', 'seq'):
+                if column not in requested:
+                    event.pop(column, None)
+
+    return {"events": events, "count": len(events), "next_cursor": next_cursor}
+
+def fetch_events_after(conn, seq: int, limit: int) -> List[Dict[str, Any]]:
+    return [
+        decode_event(row)
+        for row in conn.execute(
+            "SELECT rowid AS seq, * FROM events WHERE rowid > ? ORDER BY rowid LIMIT ?",
+            (seq, limit)
+        )
+    ]
+
+@app.get("/events/stream")
+async def stream_events(
+    request: Request,
+    agent: Optional[str] = None,
+    action: Optional[List[str]] = Query(None),
+    source_agent: Optional[str] = None,
+    last_event_id: Optional[str] = Header(None)
+):
+    """
+    Server-sent event stream of new events.
+
+    Filters:
+    - agent: only events routed to this subscriber
+    - action: one or more action patterns (wildcards allowed: deploy_*, *_failed)
+    - source_agent: only events published by this agent
 
-        cursor.execute(query, params)
+    Each frame carries the event sequence number as its id. Clients that
+    reconnect with a Last-Event-ID header receive everything they missed
+    before live events resume.
+    """
 
-        events = []
-        for row in cursor.fetchall():
-            event = dict(row)
-            # Parse JSON fields
-            if event.get('details'):
-                event['details'] = json.loads(event['details'])
-            if event.get('subscribed_agents'):
-                event['subscribed_agents'] = json.loads(event['subscribed_agents'])
-            if event.get('human_options'):
-                event['human_options'] = json.loads(event['human_options'])
-            if event.get('acknowledged_by'):
-                event['acknowledged_by'] = json.loads(event['acknowledged_by'])
-            events.append(event)
+    subscriber = StreamSubscriber(agent, action, source_agent)
+    # Subscribe before replaying so nothing published in between is lost
+    broadcaster.subscribe(subscriber)
 
-        return {"events": events, "count": len(events)}
+    try:
+        cursor_seq = int(last_event_id) if last_event_id else None
+    except ValueError:
+        cursor_seq = None
+
+    async def generate():
+        last_seq = cursor_seq
+        replayed = set()
+        try:
+            if last_seq is not None:
+                while True:
+                    page = merge_sorted(
+                        await partitions.read_all(fetch_events_after, last_seq, STREAM_REPLAY_PAGE),
+                        key=lambda e: e['seq'], limit=STREAM_REPLAY_PAGE
+                    )
+                    for event in page:
+                        last_seq = event['seq']
+                        if subscriber.wants(event):
+                            replayed.add(event['id'])
+                            yield format_sse(event)
+                    if len(page) < STREAM_REPLAY_PAGE:
+                        break
+
+            # Partitions can commit a few ms out of seq order, so a live event
+            # below last_seq may not have been replayed; dedupe by id instead
+            yield ": connected\n\n"
+
+            while not subscriber.overflowed:
+                if await request.is_disconnected():
+                    break
+                try:
+                    event = await asyncio.wait_for(subscriber.queue.get(), timeout=STREAM_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                # Already delivered during replay
+                if event['id'] in replayed:
+                    replayed.discard(event['id'])
+                    continue
+                yield format_sse(event)
+        finally:
+            broadcaster.unsubscribe(subscriber)
+
+    return StreamingResponse(
+        generate(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.get("/events/archive")
+async def list_archived_events(
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    action: Optional[str] = None,
+    source_agent: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=5000)
+):
+    """
+    Query the cold archive directly, newest first.
+
+    Only segments whose day range and action/source index can match are
+    opened. Page backwards by passing next_until as until.
+    """
+
+    events = await query_archive(
+        since=normalize_timestamp(since) if since else None,
+        until=normalize_timestamp(until) if until else None,
+        action=action,
+        source_agent=source_agent,
+        limit=limit
+    )
+    events = [decode_event(event) for event in events]
+    next_until = events[-1]['timestamp'] if len(events) == limit else None
+    return {"events": events, "count": len(events), "next_until": next_until}
 
 @app.get("/events/{event_id}")
 async def get_event(event_id: str):
     """Get a specific event"""
 
-    with get_db() as conn:
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM events WHERE id = ?", (event_id,))
-        row = cursor.fetchone()
+    def fetch(conn):
+        return conn.execute("SELECT * FROM events WHERE id = ?", (event_id,)).fetchone()
 
-        if not row:
-            raise HTTPException(status_code=404, detail="Event not found")
+    row = next((row for row in await partitions.read_all(fetch) if row), None)
 
-        event = dict(row)
-        if event.get('details'):
-            event['details'] = json.loads(event['details'])
-        if event.get('subscribed_agents'):
-            event['subscribed_agents'] = json.loads(event['subscribed_agents'])
+    if not row:
+        raise HTTPException(status_code=404, detail="Event not found")
 
-        return event
+    event = dict(row)
+    if event.get('details'):
+        event['details'] = json.loads(event['details'])
+    if event.get('subscribed_agents'):
+        event['subscribed_agents'] = json.loads(event['subscribed_agents'])
+
+    return event
 
 @app.post("/events/{event_id}/acknowledge")
 async def acknowledge_event(event_id: str, agent: str):
     """Mark event as acknowledged by an agent"""
 
-    with get_db() as conn:
-        cursor = conn.cursor()
+    def acknowledge(conn):
+        if not conn.execute("SELECT 1 FROM events WHERE id = ?", (event_id,)).fetchone():
+            return False
+        ack_deliveries(conn, agent, [event_id])
+        return True
 
-        cursor.execute("SELECT acknowledged_by FROM events WHERE id = ?", (event_id,))
-        row = cursor.fetchone()
+    if not any(await partitions.write_all(acknowledge)):
+        raise HTTPException(status_code=404, detail="Event not found")
 
-        if not row:
-            raise HTTPException(status_code=404, detail="Event not found")
+    return {"status": "acknowledged", "agent": agent}
 
-        acknowledged = json.loads(row['acknowledged_by'] or '{}')
-        acknowledged[agent] = datetime.now().isoformat()
+@app.post("/events/{event_id}/ack")
+async def ack_event(event_id: str, ack: AckRequest):
+    """Acknowledge a delivery fetched from /events/pending/{agent}"""
+    acked = sum(await partitions.write_all(ack_deliveries, ack.subscriber, [event_id]))
+    return {"status": "acknowledged", "subscriber": ack.subscriber, "acked": acked}
 
-        cursor.execute("""
-            UPDATE events
-            SET acknowledged_by = ?, updated_at = datetime('now')
-            WHERE id = ?
-        """, (json.dumps(acknowledged), event_id))
-
-        conn.commit()
-
-        return {"status": "acknowledged", "agent": agent}
+@app.post("/events/ack")
+async def ack_events(ack: BulkAckRequest):
+    """Acknowledge many deliveries in one transaction"""
+    acked = sum(await partitions.write_all(ack_deliveries, ack.subscriber, ack.event_ids))
+    return {"status": "acknowledged", "subscriber": ack.subscriber, "acked": acked}
 
 @app.post("/events/{event_id}/respond")
 async def respond_to_event(event_id: str, response: HumanResponse):
     """Respond to an event that requires human input"""
 
-    with get_db() as conn:
-        cursor = conn.cursor()
-
-        cursor.execute("SELECT * FROM events WHERE id = ?", (event_id,))
-        row = cursor.fetchone()
+    def respond(conn):
+        row = conn.execute("SELECT * FROM events WHERE id = ?", (event_id,)).fetchone()
 
         if not row:
-            raise HTTPException(status_code=404, detail="Event not found")
+            return False
 
         if not row['requires_human']:
             raise HTTPException(status_code=400, detail="Event does not require human response")
 
-        cursor.execute("""
+        conn.execute("""
             UPDATE events
             SET human_response = ?,
                 human_responded_at = datetime('now'),
@@ -234,56 +690,246 @@ async def respond_to_event(event_id: str, response: HumanResponse):
                 updated_at = datetime('now')
             WHERE id = ?
         """, (response.response, event_id))
+        return True
 
-        conn.commit()
+    if not any(await partitions.write_all(respond)):
+        raise HTTPException(status_code=404, detail="Event not found")
 
-        return {"status": "responded", "response": response.response}
+    return {"status": "responded", "response": response.response}
 
 @app.get("/events/pending/human")
 async def get_pending_human_events():
     """Get events waiting for human response"""
 
-    with get_db() as conn:
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM pending_human_requests")
+    def fetch(conn):
+        return conn.execute("SELECT * FROM pending_human_requests").fetchall()
 
-        events = []
-        for row in cursor.fetchall():
-            event = dict(row)
-            if event.get('human_options'):
-                event['human_options'] = json.loads(event['human_options'])
-            events.append(event)
+    events = []
+    for row in [row for rows in await partitions.read_all(fetch) for row in rows]:
+        event = dict(row)
+        if event.get('human_options'):
+            event['human_options'] = json.loads(event['human_options'])
+        events.append(event)
+
+    return {"pending": events, "count": len(events)}
 
-        return {"pending": events, "count": len(events)}
+@app.get("/events/pending/{agent}")
+async def get_pending_events(
+    agent: str,
+    limit: int = Query(100, ge=1, le=5000),
+    visibility_timeout: int = Query(DEFAULT_VISIBILITY_TIMEOUT, ge=0, le=3600)
+):
+    """
+    Lease the agent's oldest unacknowledged events (at-least-once).
+
+    Returned events are hidden from this agent for visibility_timeout
+    seconds and redelivered afterwards unless acked via
+    POST /events/{id}/ack or POST /events/ack. visibility_timeout=0 peeks
+    without leasing. Returns a plain list, oldest first.
+    """
+    leased = await partitions.write_all(fetch_pending, agent, limit, visibility_timeout)
+    rows = merge_sorted(leased, key=lambda e: e['seq'])
+
+    # Each partition leased up to limit; hand back the ones that did not make the cut
+    if len(rows) > limit and visibility_timeout > 0:
+        returned = {row['id'] for row in rows[:limit]}
+        await asyncio.gather(*(
+            partition.write(release_leases, agent, [r['id'] for r in part if r['id'] not in returned])
+            for partition, part in zip(partitions.stores, leased)
+            if any(r['id'] not in returned for r in part)
+        ))
+
+    return [decode_event(row) for row in rows[:limit]]
 
 @app.get("/agents/{agent}/events")
 async def get_agent_events(agent: str, limit: int = 20, unacknowledged_only: bool = False):
     """Get events for a specific agent"""
 
-    with get_db() as conn:
-        cursor = conn.cursor()
-
-        if unacknowledged_only:
-            cursor.execute("""
-                SELECT * FROM events
-                WHERE subscribed_agents LIKE ?
-                AND NOT (acknowledged_by LIKE ?)
-                ORDER BY timestamp DESC
-                LIMIT ?
-            """, (f'%"{agent}"%', f'%"{agent}"%', limit))
-        else:
-            cursor.execute("""
-                SELECT * FROM events
-                WHERE subscribed_agents LIKE ?
-                ORDER BY timestamp DESC
-                LIMIT ?
-            """, (f'%"{agent}"%', limit))
-
-        events = []
-        for row in cursor.fetchall():
-            event = dict(row)
-            if event.get('details'):
-                event['details'] = json.loads(event['details'])
-            events.append(event)
-
-        return {"agent": agent, "events": events, "count": len(events)}
+    # Index seek on event_deliveries(agent, status, event_seq)
+    query = """
+        SELECT e.*, d.event_seq AS seq FROM event_deliveries d
+        JOIN events e ON e.id = d.event_id
+        WHERE d.agent = ?
+    """
+    params = [agent]
+
+    if unacknowledged_only:
+        query += " AND d.status = 'pending'"
+
+    query += " ORDER BY d.event_seq DESC LIMIT ?"
+    params.append(limit)
+
+    def fetch(conn):
+        return [dict(row) for row in conn.execute(query, params)]
+
+    events = []
+    rows = merge_sorted(await partitions.read_all(fetch), key=lambda e: e['seq'], reverse=True, limit=limit)
+    for event in rows:
+        if event.get('details'):
+            event['details'] = json.loads(event['details'])
+        events.append(event)
+
+    return {"agent": agent, "events": events, "count": len(events)}
+
+@app.get("/consumers/{agent}")
+async def get_consumer(agent: str):
+    """Committed offset, backlog, in-flight and dead-letter counts for an agent"""
+    per_partition = await partitions.read_all(consumer_stats, agent)
+    if len(per_partition) == 1:
+        return per_partition[0]
+
+    head = max(p['head_seq'] for p in per_partition)
+    behind = [p['committed_seq'] for p in per_partition if p['pending']]
+    return {
+        "agent": agent,
+        # Everything at or below this seq is acked in every partition
+        "committed_seq": min(behind) if behind else head,
+        "head_seq": head,
+        **{
+            key: sum(p[key] for p in per_partition)
+            for key in ('acked_total', 'pending', 'in_flight', 'dead_letter')
+        },
+        "updated_at": max((p['updated_at'] for p in per_partition if p['updated_at']), default=None),
+        "partitions": per_partition,
+    }
+
+@app.get("/subscriptions")
+async def list_subscriptions(agent: Optional[str] = None, include_disabled: bool = False):
+    """List agent subscriptions"""
+
+    query = "SELECT * FROM agent_subscriptions WHERE 1=1"
+    params = []
+
+    if agent:
+        query += " AND agent_name = ?"
+        params.append(agent)
+
+    if not include_disabled:
+        query += " AND enabled = 1"
+
+    query += " ORDER BY agent_name, priority"
+
+    def fetch(conn):
+        return [dict(row) for row in conn.execute(query, params)]
+
+    subscriptions = await store.read(fetch)
+
+    return {
+        "subscriptions": subscriptions,
+        "count": len(subscriptions),
+        "matcher": matcher.stats()
+    }
+
+@app.get("/subscriptions/match")
+async def match_subscriptions(action: str):
+    """Show which agents an action would be routed to"""
+    return {"action": action, "subscribed_agents": matcher.match(action)}
+
+@app.post("/subscriptions")
+async def create_subscription(subscription: SubscriptionCreate):
+    """Register an action pattern for an agent"""
+
+    def insert(conn):
+        cursor = conn.execute("""
+            INSERT INTO agent_subscriptions (agent_name, action_pattern, priority, enabled)
+            VALUES (?, ?, ?, ?)
+        """, (
+            subscription.agent_name,
+            subscription.action_pattern,
+            subscription.priority,
+            1 if subscription.enabled else 0
+        ))
+        return conn.execute(
+            "SELECT id FROM agent_subscriptions WHERE rowid = ?", (cursor.lastrowid,)
+        ).fetchone()['id']
+
+    subscription_id = await store.write(insert)
+
+    await reload_subscriptions()
+    return {"id": subscription_id, "status": "created", "matcher_version": matcher.version}
+
+@app.patch("/subscriptions/{subscription_id}")
+async def update_subscription(subscription_id: str, update: SubscriptionUpdate):
+    """Change pattern, priority or enabled flag of a subscription"""
+
+    changes = update.model_dump(exclude_none=True)
+    if not changes:
+        raise HTTPException(status_code=400, detail="No changes provided")
+    if 'enabled' in changes:
+        changes['enabled'] = 1 if changes['enabled'] else 0
+
+    def apply(conn):
+        assignments = ", ".join(f"{column} = ?" for column in changes)
+        cursor = conn.execute(
+            f"UPDATE agent_subscriptions SET {assignments} WHERE id = ?",
+            (*changes.values(), subscription_id)
+        )
+        if cursor.rowcount == 0:
+            raise HTTPException(status_code=404, detail="Subscription not found")
+
+    await store.write(apply)
+
+    await reload_subscriptions()
+    return {"id": subscription_id, "status": "updated", "matcher_version": matcher.version}
+
+@app.delete("/subscriptions/{subscription_id}")
+async def delete_subscription(subscription_id: str):
+    """Remove a subscription"""
+
+    def delete(conn):
+        cursor = conn.execute("DELETE FROM agent_subscriptions WHERE id = ?", (subscription_id,))
+        if cursor.rowcount == 0:
+            raise HTTPException(status_code=404, detail="Subscription not found")
+
+    await store.write(delete)
+
+    await reload_subscriptions()
+    return {"id": subscription_id, "status": "deleted", "matcher_version": matcher.version}
+
+@app.post("/subscriptions/reload")
+async def reload_subscriptions_endpoint():
+    """Rebuild the matcher after agent_subscriptions was edited outside the API"""
+    await reload_subscriptions()
+    return {"status": "reloaded", "matcher": matcher.stats()}
+
+# Retention
+
+async def retention_stats(cached: bool = False) -> Dict[str, Any]:
+    """Hot/cold sizes summed over partitions; cached=True reuses the counts from the last retention pass"""
+    if cached:
+        per_partition = [m.cached_stats() for m in retention_managers]
+    else:
+        per_partition = await asyncio.gather(*(m.get_stats() for m in retention_managers))
+    if len(per_partition) == 1:
+        return per_partition[0]
+
+    totals = {
+        key: sum(p.get(key, 0) for p in per_partition)
+        for key in ('hot_events', 'hot_bytes', 'cold_segments', 'cold_events', 'cold_bytes')
+    }
+    oldest = [p['oldest_archived'] for p in per_partition if p.get('oldest_archived')]
+    return {**totals, "oldest_archived": min(oldest) if oldest else None, "partitions": per_partition}
+
+async def query_archive(limit: int, **filters) -> List[Dict[str, Any]]:
+    """Archived events from every partition, newest first"""
+    results = await asyncio.gather(*(m.query(limit=limit, **filters) for m in retention_managers))
+    return merge_sorted(
+        results, key=lambda e: (e.get('timestamp') or '', e['seq']), reverse=True, limit=limit
+    )
+
+@app.get("/retention")
+async def get_retention():
+    """TTL policies and hot/cold storage sizes"""
+    return {"policies": retention_managers[0].policies, **await retention_stats()}
+
+@app.post("/retention/run")
+async def run_retention():
+    """Archive expired events now instead of waiting for the next scheduled run"""
+    runs = await asyncio.gather(*(m.run() for m in retention_managers))
+    if len(runs) == 1:
+        return runs[0]
+    return {
+        "archived": sum(r['archived'] for r in runs),
+        "segments_touched": sorted({day for r in runs for day in r['segments_touched']}),
+        "partitions": runs,
+    }
@@ -0,0 +1,39 @@
+-- /opt/leveredge/control-plane/event-bus/migrations/001_event_deliveries.sql
+--
+-- Normalized per-agent delivery state.
+-- Replaces LIKE scans over events.subscribed_agents / acknowledged_by
+-- with index seeks on (agent, status, event_seq).
+--
+-- Applied automatically by the event bus on startup, or manually:
+--   sqlite3 events.db < migrations/001_event_deliveries.sql
+
+CREATE TABLE IF NOT EXISTS event_deliveries (
+  event_id TEXT NOT NULL,
+  agent TEXT NOT NULL,
+  event_seq INTEGER NOT NULL,  -- events.rowid, gives insertion order
+  status TEXT DEFAULT 'pending',  -- pending, acknowledged
+  acked_at TEXT,
+  PRIMARY KEY (event_id, agent)
+);
+
+CREATE INDEX IF NOT EXISTS idx_deliveries_agent_seq ON event_deliveries(agent, event_seq DESC);
+CREATE INDEX IF NOT EXISTS idx_deliveries_agent_status_seq ON event_deliveries(agent, status, event_seq DESC);
+
+-- Backfill from the JSON columns of existing events
+INSERT OR IGNORE INTO event_deliveries (event_id, agent, event_seq, status, acked_at)
+SELECT
+  e.id,
+  s.value,
+  e.rowid,
+  CASE
+    WHEN json_valid(e.acknowledged_by)
+     AND json_type(e.acknowledged_by, '$."' || s.value || '"') IS NOT NULL
+    THEN 'acknowledged'
+    ELSE 'pending'
+  END,
+  CASE
+    WHEN json_valid(e.acknowledged_by)
+    THEN json_extract(e.acknowledged_by, '$."' || s.value || '"')
+  END
+FROM events e, json_each(e.subscribed_agents) s
+WHERE json_valid(e.subscribed_agents);
@@ -0,0 +1,24 @@
+-- /opt/leveredge/control-plane/event-bus/migrations/002_archive_segments.sql
+--
+-- Index of cold archive segments written by retention.py.
+-- One row per day file (archive/events-YYYY-MM-DD.jsonl.gz); archive
+-- queries read this table to decide which segments to open.
+--
+-- Applied automatically by the event bus on startup, or manually:
+--   sqlite3 events.db < migrations/002_archive_segments.sql
+
+CREATE TABLE IF NOT EXISTS archive_segments (
+  day TEXT PRIMARY KEY,  -- YYYY-MM-DD of the archived events' timestamps
+  path TEXT NOT NULL,
+  event_count INTEGER NOT NULL DEFAULT 0,
+  bytes INTEGER NOT NULL DEFAULT 0,
+  min_seq INTEGER,
+  max_seq INTEGER,
+  first_timestamp TEXT,
+  last_timestamp TEXT,
+  actions TEXT DEFAULT '[]',  -- JSON array of actions in the segment
+  sources TEXT DEFAULT '[]',  -- JSON array of source agents in the segment
+  updated_at TEXT DEFAULT (datetime('now'))
+);
+
+CREATE INDEX IF NOT EXISTS idx_archive_segments_range ON archive_segments(first_timestamp, last_timestamp);
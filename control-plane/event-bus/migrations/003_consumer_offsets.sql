@@ -0,0 +1,29 @@
+-- /opt/leveredge/control-plane/event-bus/migrations/003_consumer_offsets.sql
+--
+-- At-least-once consumption for GET /events/pending/{agent}.
+--
+-- delivery_leases holds in-flight deliveries: a fetched event is hidden
+-- from its consumer until leased_until (unix seconds) passes, then it is
+-- redelivered unless acked. Rows are removed on ack, so the table only
+-- ever holds what consumers are currently working on.
+--
+-- consumer_offsets records each agent's committed offset: the highest
+-- event_seq below which every delivery has been acknowledged.
+--
+-- Applied automatically by the event bus on startup, or manually:
+--   sqlite3 events.db < migrations/003_consumer_offsets.sql
+
+CREATE TABLE IF NOT EXISTS delivery_leases (
+  event_id TEXT NOT NULL,
+  agent TEXT NOT NULL,
+  leased_until REAL NOT NULL,
+  delivery_count INTEGER NOT NULL DEFAULT 1,
+  PRIMARY KEY (event_id, agent)
+);
+
+CREATE TABLE IF NOT EXISTS consumer_offsets (
+  agent TEXT PRIMARY KEY,
+  committed_seq INTEGER NOT NULL DEFAULT 0,
+  acked_total INTEGER NOT NULL DEFAULT 0,
+  updated_at TEXT DEFAULT (datetime('now'))
+);
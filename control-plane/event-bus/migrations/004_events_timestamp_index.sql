@@ -0,0 +1,13 @@
+-- /opt/leveredge/control-plane/event-bus/migrations/004_events_timestamp_index.sql
+--
+-- GET /events orders by (timestamp DESC, rowid DESC). A DESC index on
+-- timestamp stores equal timestamps in ascending rowid order, so SQLite
+-- had to sort every row sharing a timestamp; an ascending index walked
+-- backwards yields exactly the listing order and lets the keyset cursor
+-- seek instead of scan.
+--
+-- Applied automatically by the event bus on startup, or manually:
+--   sqlite3 events.db < migrations/004_events_timestamp_index.sql
+
+DROP INDEX IF EXISTS idx_events_timestamp;
+CREATE INDEX IF NOT EXISTS idx_events_timestamp ON events(timestamp);
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Partitioned Event Store
+
+Spreads events across N SQLite files so publish throughput is not capped
+by a single write lock. Each partition is a full EventStore (its own
+writer task, group commit and reader pool); events are routed by a stable
+hash of source_agent or of the action family (the action up to its first
+'_', so 'deploy_started' and 'deploy_failed' share a partition).
+
+- Partition 0 is the configured database file and also holds the shared
+  tables (agent_subscriptions). Partitions 1..N-1 live next to it as
+  events-p1.db, events-p2.db, ...
+- An event's delivery, lease and offset rows live in the same file as the
+  event, so publishing and acknowledging stay single-transaction.
+- Sequence numbers come from one in-process allocator, seeded at startup
+  from the highest seq any partition has recorded, and are unique
+  across partitions. Within a partition they commit in order; across
+  partitions two flushes can land a few milliseconds out of order.
+- Cross-partition reads fan out to every partition and are combined with
+  a k-way merge (heapq.merge) on the listing's sort key.
+
+With EVENT_BUS_PARTITIONS=1 (the default) this is a thin wrapper around a
+single EventStore.
+
+Location: /opt/leveredge/control-plane/event-bus/partitions.py
+"""
+
+import os
+import heapq
+import asyncio
+import zlib
+from itertools import islice
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from store import EventStore
+
+PARTITION_COUNT = max(1, int(os.environ.get("EVENT_BUS_PARTITIONS", "1")))
+PARTITION_KEY = os.environ.get("EVENT_BUS_PARTITION_KEY", "source_agent")  # source_agent or action_family
+
+
+def partition_paths(db_path: Path, count: int) -> List[Path]:
+    return [db_path] + [
+        db_path.with_name(f"{db_path.stem}-p{i}{db_path.suffix}") for i in range(1, count)
+    ]
+
+
+def merge_sorted(results: Iterable[List[Dict[str, Any]]], key: Callable, reverse: bool = False,
+                 limit: Optional[int] = None) -> List[Dict[str, Any]]:
+    """k-way merge of per-partition lists that are already sorted by key"""
+    merged = heapq.merge(*results, key=key, reverse=reverse)
+    return list(islice(merged, limit) if limit is not None else merged)
+
+
+class PartitionedStore:
+    """N EventStores behind one routing and fan-out interface"""
+
+    def __init__(self, db_path: Path, count: int = PARTITION_COUNT, key: str = PARTITION_KEY):
+        self.paths = partition_paths(db_path, count)
+        self.stores = [EventStore(path) for path in self.paths]
+        self.key = key
+        self._next_seq = 1
+
+    @property
+    def primary(self) -> EventStore:
+        return self.stores[0]
+
+    def __len__(self) -> int:
+        return len(self.stores)
+
+    async def start(self):
+        for store in self.stores:
+            await store.start()
+
+        def max_seq(conn):
+            # Retention can archive the newest rows, so the hot table alone
+            # may sit below seqs that were already handed out
+            return conn.execute("""
+                SELECT MAX(
+                    (SELECT COALESCE(MAX(rowid), 0) FROM events),
+                    (SELECT COALESCE(MAX(max_seq), 0) FROM archive_segments),
+                    (SELECT COALESCE(MAX(committed_seq), 0) FROM consumer_offsets),
+                    (SELECT COALESCE(MAX(event_seq), 0) FROM event_deliveries)
+                )
+            """).fetchone()[0]
+
+        self._next_seq = max(await self.read_all(max_seq)) + 1
+
+    async def stop(self):
+        for store in self.stores:
+            await store.stop()
+
+    # Routing
+
+    def partition_for(self, source_agent: str, action: str) -> int:
+        if len(self.stores) == 1:
+            return 0
+        value = action.split('_', 1)[0] if self.key == "action_family" else source_agent
+        return zlib.crc32(value.encode()) % len(self.stores)
+
+    def allocate_seqs(self, count: int) -> int:
+        """Reserve count consecutive sequence numbers; returns the first"""
+        first = self._next_seq
+        self._next_seq += count
+        return first
+
+    # Fan-out
+
+    async def read_all(self, fn: Callable, *args) -> List[Any]:
+        """Run a read operation on every partition; results in partition order"""
+        return await asyncio.gather(*(store.read(fn, *args) for store in self.stores))
+
+    async def write_all(self, fn: Callable, *args) -> List[Any]:
+        """Run a write operation on every partition; results in partition order"""
+        return await asyncio.gather(*(store.write(fn, *args) for store in self.stores))
+
+    def get_stats(self) -> Dict[str, Any]:
+        if len(self.stores) == 1:
+            return self.primary.get_stats()
+        return {
+            "partitions": len(self.stores),
+            "partition_key": self.key,
+            "queue_depth": sum(store.queue_depth for store in self.stores),
+            "by_partition": [store.get_stats() for store in self.stores],
+        }
@@ -0,0 +1,324 @@
+#!/usr/bin/env python3
+"""
+Event Retention
+
+Keeps the hot events table bounded by moving expired events into cold
+archive segments.
+
+- Policies give a TTL in days per action pattern (exact names beat
+  wildcards, longer patterns beat shorter ones, '*' sets the default).
+- Expired events are appended to daily gzip segments
+  (archive/events-YYYY-MM-DD.jsonl.gz, one gzip member per run, never
+  rewritten) and then deleted from the hot table with their deliveries.
+- archive_segments indexes each day file by time range, sequence range,
+  count and the actions/sources it contains, so archive queries only open
+  the segments that can match.
+
+Events still waiting on a human response are never archived.
+
+Location: /opt/leveredge/control-plane/event-bus/retention.py
+"""
+
+import os
+import gzip
+import json
+import asyncio
+from datetime import datetime, timedelta
+from fnmatch import fnmatchcase
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+DEFAULT_RETENTION_DAYS = float(os.environ.get("EVENT_BUS_RETENTION_DAYS", "30"))
+RETENTION_INTERVAL_SECONDS = int(os.environ.get("EVENT_BUS_RETENTION_INTERVAL", "3600"))
+ARCHIVE_BATCH_SIZE = int(os.environ.get("EVENT_BUS_ARCHIVE_BATCH", "5000"))
+
+# Per-action TTLs in days, e.g. {"api_request": 7, "*_check_complete": 2, "credential_*": 365}
+DEFAULT_POLICIES = {
+    "*_check_complete": 3,
+    "api_request": 7,
+    "human_input_required": 365,
+}
+
+
+def load_policies() -> Dict[str, float]:
+    policies = dict(DEFAULT_POLICIES)
+    raw = os.environ.get("EVENT_BUS_RETENTION_POLICIES")
+    if raw:
+        policies.update({pattern: float(days) for pattern, days in json.loads(raw).items()})
+    policies.setdefault("*", DEFAULT_RETENTION_DAYS)
+    return policies
+
+
+class RetentionManager:
+    """Applies TTL policies and serves queries over the cold archive"""
+
+    def __init__(self, store, archive_dir: Path, policies: Optional[Dict[str, float]] = None):
+        self.store = store
+        self.archive_dir = archive_dir
+        self.policies = policies or load_policies()
+        self._by_specificity = sorted(
+            self.policies.items(),
+            key=lambda item: (item[0] == "*", -len(item[0]))
+        )
+        self._task: Optional[asyncio.Task] = None
+        self._lock = asyncio.Lock()
+        self.last_run: Optional[Dict[str, Any]] = None
+        self.sizes: Optional[Dict[str, Any]] = None  # From the last retention pass or get_stats()
+
+    def ttl_days(self, action: str) -> float:
+        """TTL for an action: exact policy first, then the longest matching pattern"""
+        if action in self.policies:
+            return self.policies[action]
+        for pattern, days in self._by_specificity:
+            if fnmatchcase(action, pattern):
+                return days
+        return DEFAULT_RETENTION_DAYS
+
+    # Background loop
+
+    def start(self):
+        self._task = asyncio.create_task(self._run_periodically())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def _run_periodically(self):
+        while True:
+            try:
+                await self.run()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Retention run failed: {e}")
+            await asyncio.sleep(RETENTION_INTERVAL_SECONDS)
+
+    # Compaction
+
+    async def run(self) -> Dict[str, Any]:
+        """Archive and delete every event past its TTL"""
+        async with self._lock:
+            started = datetime.utcnow()
+            archived = 0
+            segments = set()
+
+            def actions(conn):
+                return [row[0] for row in conn.execute("SELECT DISTINCT action FROM events")]
+
+            cutoffs: Dict[str, List[str]] = {}
+            for action in await self.store.read(actions):
+                cutoff = (started - timedelta(days=self.ttl_days(action))).strftime("%Y-%m-%d %H:%M:%S")
+                cutoffs.setdefault(cutoff, []).append(action)
+
+            for cutoff, group in cutoffs.items():
+                while True:
+                    rows = await self.store.read(self._fetch_expired, group, cutoff)
+                    if not rows:
+                        break
+                    days = await asyncio.get_running_loop().run_in_executor(None, self._append_segments, rows)
+                    await self.store.write(self._delete_archived, rows, days)
+                    archived += len(rows)
+                    segments.update(days)
+                    if len(rows) < ARCHIVE_BATCH_SIZE:
+                        break
+
+            self.last_run = {
+                "started_at": started.isoformat(),
+                "duration_ms": int((datetime.utcnow() - started).total_seconds() * 1000),
+                "archived": archived,
+                "segments_touched": sorted(segments),
+            }
+            await self._measure()
+            return self.last_run
+
+    @staticmethod
+    def _fetch_expired(conn, actions: List[str], cutoff: str) -> List[Dict[str, Any]]:
+        placeholders = ", ".join("?" for _ in actions)
+        rows = conn.execute(f"""
+            SELECT rowid AS seq, * FROM events
+            WHERE action IN ({placeholders})
+            AND timestamp < ?
+            AND NOT (requires_human = 1 AND human_response IS NULL AND status = 'pending')
+            ORDER BY rowid
+            LIMIT ?
+        """, (*actions, cutoff, ARCHIVE_BATCH_SIZE)).fetchall()
+        return [dict(row) for row in rows]
+
+    def segment_path(self, day: str) -> Path:
+        return self.archive_dir / f"events-{day}.jsonl.gz"
+
+    def _append_segments(self, rows: List[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+        """Append rows to their daily segments; returns per-day index updates"""
+        self.archive_dir.mkdir(parents=True, exist_ok=True)
+
+        by_day: Dict[str, List[Dict[str, Any]]] = {}
+        for row in rows:
+            by_day.setdefault((row["timestamp"] or "")[:10] or "unknown", []).append(row)
+
+        updates = {}
+        for day, day_rows in by_day.items():
+            path = self.segment_path(day)
+            # Each append is a complete gzip member; readers see one continuous stream
+            with gzip.open(path, "ab") as f:
+                for row in day_rows:
+                    f.write(json.dumps(row, default=str).encode() + b"\n")
+            updates[day] = {
+                "path": str(path),
+                "count": len(day_rows),
+                "bytes": path.stat().st_size,
+                "min_seq": min(r["seq"] for r in day_rows),
+                "max_seq": max(r["seq"] for r in day_rows),
+                "first_timestamp": min(r["timestamp"] for r in day_rows),
+                "last_timestamp": max(r["timestamp"] for r in day_rows),
+                "actions": sorted({r["action"] for r in day_rows}),
+                "sources": sorted({r["source_agent"] for r in day_rows}),
+            }
+        return updates
+
+    @staticmethod
+    def _delete_archived(conn, rows: List[Dict[str, Any]], days: Dict[str, Dict[str, Any]]):
+        ids = [(row["id"],) for row in rows]
+        conn.executemany("DELETE FROM event_deliveries WHERE event_id = ?", ids)
+        conn.executemany("DELETE FROM delivery_leases WHERE event_id = ?", ids)
+        conn.executemany("DELETE FROM events WHERE id = ?", ids)
+
+        for day, update in days.items():
+            existing = conn.execute(
+                "SELECT * FROM archive_segments WHERE day = ?", (day,)
+            ).fetchone()
+            if existing:
+                update = {
+                    **update,
+                    "count": existing["event_count"] + update["count"],
+                    "min_seq": min(existing["min_seq"], update["min_seq"]),
+                    "max_seq": max(existing["max_seq"], update["max_seq"]),
+                    "first_timestamp": min(existing["first_timestamp"], update["first_timestamp"]),
+                    "last_timestamp": max(existing["last_timestamp"], update["last_timestamp"]),
+                    "actions": sorted(set(json.loads(existing["actions"])) | set(update["actions"])),
+                    "sources": sorted(set(json.loads(existing["sources"])) | set(update["sources"])),
+                }
+            conn.execute("""
+                INSERT OR REPLACE INTO archive_segments (
+                    day, path, event_count, bytes, min_seq, max_seq,
+                    first_timestamp, last_timestamp, actions, sources, updated_at
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, datetime('now'))
+            """, (
+                day, update["path"], update["count"], update["bytes"],
+                update["min_seq"], update["max_seq"],
+                update["first_timestamp"], update["last_timestamp"],
+                json.dumps(update["actions"]), json.dumps(update["sources"])
+            ))
+
+    # Archive queries
+
+    async def query(
+        self,
+        since: Optional[str] = None,
+        until: Optional[str] = None,
+        before: Optional[Tuple[str, int]] = None,
+        action: Optional[str] = None,
+        source_agent: Optional[str] = None,
+        status: Optional[str] = None,
+        limit: int = 100,
+        exclude_ids: Optional[set] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Archived events in [since, until), newest first.
+
+        before is a (timestamp, seq) keyset bound so archive pages can be
+        merged with hot pages from GET /events.
+        """
+
+        def segments(conn):
+            query = "SELECT * FROM archive_segments WHERE 1=1"
+            params = []
+            if since:
+                query += " AND last_timestamp >= ?"
+                params.append(since)
+            if until:
+                query += " AND first_timestamp < ?"
+                params.append(until)
+            if before:
+                query += " AND first_timestamp <= ?"
+                params.append(before[0])
+            query += " ORDER BY day DESC"
+            return [dict(row) for row in conn.execute(query, params)]
+
+        candidates = [
+            seg for seg in await self.store.read(segments)
+            if (not action or action in json.loads(seg["actions"]))
+            and (not source_agent or source_agent in json.loads(seg["sources"]))
+        ]
+
+        def scan() -> List[Dict[str, Any]]:
+            results: List[Dict[str, Any]] = []
+            seen = set(exclude_ids or ())
+            for seg in candidates:
+                path = Path(seg["path"])
+                if not path.exists():
+                    continue
+                day_rows = []
+                with gzip.open(path, "rt") as f:
+                    for line in f:
+                        event = json.loads(line)
+                        ts = event.get("timestamp") or ""
+                        if since and ts < since:
+                            continue
+                        if until and ts >= until:
+                            continue
+                        if before and (ts, event["seq"]) >= tuple(before):
+                            continue
+                        if action and event.get("action") != action:
+                            continue
+                        if source_agent and event.get("source_agent") != source_agent:
+                            continue
+                        if status and event.get("status") != status:
+                            continue
+                        # Segments are at-least-once; a crash between append and delete can repeat rows
+                        if event["id"] in seen:
+                            continue
+                        seen.add(event["id"])
+                        day_rows.append(event)
+                day_rows.sort(key=lambda e: (e.get("timestamp") or "", e["seq"]), reverse=True)
+                results.extend(day_rows)
+                if len(results) >= limit:
+                    break
+            return results[:limit]
+
+        return await asyncio.get_running_loop().run_in_executor(None, scan)
+
+    async def get_stats(self) -> Dict[str, Any]:
+        """Hot/cold sizes counted now"""
+        await self._measure()
+        return self.cached_stats()
+
+    def cached_stats(self) -> Dict[str, Any]:
+        """Sizes as of the last count, without touching the database (for /health)"""
+        return {**(self.sizes or {}), "last_run": self.last_run}
+
+    async def _measure(self):
+        def sizes(conn):
+            hot = conn.execute("SELECT COUNT(*) FROM events").fetchone()[0]
+            page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+            page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+            cold = conn.execute("""
+                SELECT COUNT(*) AS segments,
+                       COALESCE(SUM(event_count), 0) AS events,
+                       COALESCE(SUM(bytes), 0) AS bytes,
+                       MIN(first_timestamp) AS oldest
+                FROM archive_segments
+            """).fetchone()
+            return {
+                "hot_events": hot,
+                "hot_bytes": page_count * page_size,
+                "cold_segments": cold["segments"],
+                "cold_events": cold["events"],
+                "cold_bytes": cold["bytes"],
+                "oldest_archived": cold["oldest"],
+            }
+
+        self.sizes = {**await self.store.read(sizes), "measured_at": datetime.utcnow().isoformat()}
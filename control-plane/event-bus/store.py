@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+"""
+Event Store
+
+Long-lived SQLite connections for the event bus.
+
+- One writer connection owned by a single writer task. Write operations are
+  queued and group-committed: everything queued within a few milliseconds
+  runs in one transaction (each operation in its own savepoint, so one
+  failure does not roll back its neighbours).
+- A small pool of reader connections on a thread executor, so queries never
+  block the event loop and, in WAL mode, never wait on the writer.
+
+Operations are plain functions taking a sqlite3.Connection as their first
+argument; they must not commit or roll back themselves.
+
+Location: /opt/leveredge/control-plane/event-bus/store.py
+"""
+
+import os
+import sqlite3
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+READER_POOL_SIZE = int(os.environ.get("EVENT_BUS_READERS", "4"))
+WRITE_FLUSH_MS = float(os.environ.get("EVENT_BUS_WRITE_FLUSH_MS", "2"))  # Group commit window
+WRITE_MAX_BATCH = int(os.environ.get("EVENT_BUS_WRITE_MAX_BATCH", "500"))  # Operations per transaction
+CACHE_SIZE_KB = int(os.environ.get("EVENT_BUS_CACHE_SIZE_KB", "16384"))
+SYNCHRONOUS = os.environ.get("EVENT_BUS_SYNCHRONOUS", "NORMAL")  # NORMAL is durable across app crashes in WAL mode
+
+
+def connect(db_path: Path, readonly: bool = False) -> sqlite3.Connection:
+    """Open a connection with the event bus pragmas applied"""
+    conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(f"PRAGMA synchronous={SYNCHRONOUS}")
+    conn.execute(f"PRAGMA cache_size=-{CACHE_SIZE_KB}")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA busy_timeout=5000")
+    if readonly:
+        conn.execute("PRAGMA query_only=1")
+    return conn
+
+
+class EventStore:
+    """SQLite access for the event bus: one group-committing writer, pooled readers"""
+
+    def __init__(self, db_path: Path, readers: int = READER_POOL_SIZE):
+        self.db_path = db_path
+        self.readers = readers
+        self._local = threading.local()
+        self._reader_conns: List[sqlite3.Connection] = []
+        self._reader_lock = threading.Lock()
+        self._read_executor: Optional[ThreadPoolExecutor] = None
+        self._write_executor: Optional[ThreadPoolExecutor] = None
+        self._writer: Optional[sqlite3.Connection] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._writer_task: Optional[asyncio.Task] = None
+
+        self.stats: Dict[str, Any] = {
+            "transactions": 0,
+            "writes": 0,
+            "failed_writes": 0,
+            "largest_batch": 0,
+            "last_commit_ms": 0.0,
+        }
+
+    async def start(self):
+        self._read_executor = ThreadPoolExecutor(max_workers=self.readers, thread_name_prefix="event-bus-read")
+        self._write_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="event-bus-write")
+        loop = asyncio.get_running_loop()
+        self._writer = await loop.run_in_executor(self._write_executor, connect, self.db_path)
+        self._queue = asyncio.Queue()
+        self._writer_task = asyncio.create_task(self._writer_loop())
+
+    async def stop(self):
+        if self._writer_task:
+            # Let queued writes finish before closing
+            await self._queue.join()
+            self._writer_task.cancel()
+            try:
+                await self._writer_task
+            except asyncio.CancelledError:
+                pass
+        if self._writer:
+            self._writer.close()
+        for conn in self._reader_conns:
+            conn.close()
+        self._reader_conns.clear()
+        if self._read_executor:
+            self._read_executor.shutdown(wait=False)
+        if self._write_executor:
+            self._write_executor.shutdown(wait=False)
+
+    # Reads
+
+    def _reader(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = connect(self.db_path, readonly=True)
+            self._local.conn = conn
+            with self._reader_lock:
+                self._reader_conns.append(conn)
+        return conn
+
+    def _run_read(self, fn: Callable, args: Tuple) -> Any:
+        conn = self._reader()
+        try:
+            return fn(conn, *args)
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+
+    async def read(self, fn: Callable, *args) -> Any:
+        """Run fn(conn, *args) on a pooled reader connection"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._read_executor, self._run_read, fn, args)
+
+    # Writes
+
+    async def write(self, fn: Callable, *args) -> Any:
+        """Queue fn(conn, *args) for the writer and wait for its transaction to commit"""
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((fn, args, future))
+        return await future
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize() if self._queue else 0
+
+    async def _writer_loop(self):
+        loop = asyncio.get_running_loop()
+
+        while True:
+            batch = [await self._queue.get()]
+            if WRITE_FLUSH_MS > 0:
+                await asyncio.sleep(WRITE_FLUSH_MS / 1000)
+            while len(batch) < WRITE_MAX_BATCH and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+
+            try:
+                results = await loop.run_in_executor(self._write_executor, self._run_batch, batch)
+            except Exception as e:
+                results = [(False, e)] * len(batch)
+
+            for (_, _, future), (ok, value) in zip(batch, results):
+                if future.done():
+                    continue
+                if ok:
+                    future.set_result(value)
+                else:
+                    future.set_exception(value)
+            for _ in batch:
+                self._queue.task_done()
+
+    def _run_batch(self, batch: List[Tuple[Callable, Tuple, asyncio.Future]]) -> List[Tuple[bool, Any]]:
+        conn = self._writer
+        started = time.perf_counter()
+        results: List[Tuple[bool, Any]] = []
+
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for fn, args, _ in batch:
+                conn.execute("SAVEPOINT op")
+                try:
+                    results.append((True, fn(conn, *args)))
+                    conn.execute("RELEASE op")
+                except Exception as e:
+                    conn.execute("ROLLBACK TO op")
+                    conn.execute("RELEASE op")
+                    results.append((False, e))
+            conn.execute("COMMIT")
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+
+        failed = sum(1 for ok, _ in results if not ok)
+        self.stats["transactions"] += 1
+        self.stats["writes"] += len(batch) - failed
+        self.stats["failed_writes"] += failed
+        self.stats["largest_batch"] = max(self.stats["largest_batch"], len(batch))
+        self.stats["last_commit_ms"] = round((time.perf_counter() - started) * 1000, 3)
+        return results
+
+    def get_stats(self) -> Dict[str, Any]:
+        transactions = self.stats["transactions"]
+        return {
+            **self.stats,
+            "avg_batch": round(self.stats["writes"] / transactions, 2) if transactions else 0,
+            "queue_depth": self.queue_depth,
+            "readers": self.readers,
+        }
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""
+Subscription Matcher
+
+In-memory index over agent_subscriptions used to route published events
+without querying SQLite on every publish.
+
+Matching keeps the semantics of the SQL routing query it replaced:
+- a pattern without '*' must equal the action exactly (case-sensitive '=')
+- '*' subscribes to everything
+- any other pattern is a LIKE pattern with '*' as '%': case-insensitive for
+  ASCII, '_' matches any single character and '%' is a wildcard too, while
+  '?' and '[' are literal
+
+Patterns are split by shape:
+- exact actions ('config_changed') go into a hash map
+- trailing wildcards ('credential_*') go into a prefix trie
+- leading wildcards ('*_failed') go into a suffix trie (reversed keys)
+- anything else ('deadline_*_due', '*build*') falls back to a compiled regex
+
+Trie keys are ASCII-lowercased and '_' is stored as a wildcard edge, which
+each walk follows alongside the literal character. The SQL query only
+matched patterns that started or ended with '*'; patterns with '*' only in
+the middle now match as LIKE patterns instead of never matching.
+
+Matching an action costs one dict lookup, two trie walks bounded by the
+action length and a scan of the (usually empty) regex fallback list, so it
+does not grow with the number of registered patterns.
+
+Location: /opt/leveredge/control-plane/event-bus/subscriptions.py
+"""
+
+import re
+import string
+from typing import Dict, List, Tuple, Iterable, Pattern
+
+MULTI_WILDCARDS = set("*%")
+ANY_CHAR = "_"
+MATCH_CACHE_SIZE = 4096  # Distinct actions remembered between rebuilds
+
+# LIKE folds ASCII letters only
+_ASCII_FOLD = str.maketrans(string.ascii_uppercase, string.ascii_lowercase)
+
+
+def _like_regex(pattern: str) -> Pattern:
+    """Compile a subscription pattern with SQL LIKE semantics ('*' and '%' any run, '_' any char)"""
+    parts = []
+    for ch in pattern:
+        if ch in MULTI_WILDCARDS:
+            parts.append(".*")
+        elif ch == ANY_CHAR:
+            parts.append(".")
+        else:
+            parts.append(re.escape(ch))
+    return re.compile("".join(parts), re.IGNORECASE | re.ASCII | re.DOTALL)
+
+
+class _TrieNode:
+    __slots__ = ("children", "agents")
+
+    def __init__(self):
+        self.children: Dict[str, "_TrieNode"] = {}
+        self.agents: Dict[str, int] = {}  # agent -> priority
+
+
+def _merge(target: Dict[str, int], agents: Dict[str, int]):
+    for agent, priority in agents.items():
+        current = target.get(agent)
+        if current is None or priority < current:
+            target[agent] = priority
+
+
+class SubscriptionMatcher:
+    """
+    Compiled set of (agent, action_pattern, priority) subscriptions.
+
+    Instances are immutable once built; the event bus swaps in a new
+    matcher whenever subscriptions change.
+    """
+
+    def __init__(self, subscriptions: Iterable[Tuple[str, str, int]] = (), version: int = 0):
+        self.version = version
+        self.pattern_count = 0
+        self._exact: Dict[str, Dict[str, int]] = {}
+        self._catch_all: Dict[str, int] = {}
+        self._prefix = _TrieNode()
+        self._suffix = _TrieNode()
+        self._likes: List[Tuple[Pattern, str, int]] = []
+        self._cache: Dict[str, List[str]] = {}
+
+        for agent, pattern, priority in subscriptions:
+            self._add(agent, pattern, priority if priority is not None else 5)
+
+    @classmethod
+    def from_rows(cls, rows, version: int = 0) -> "SubscriptionMatcher":
+        """Build from agent_subscriptions rows (agent_name, action_pattern, priority)"""
+        return cls(
+            ((row["agent_name"], row["action_pattern"], row["priority"]) for row in rows),
+            version=version
+        )
+
+    def _add(self, agent: str, pattern: str, priority: int):
+        self.pattern_count += 1
+
+        if pattern == "*":
+            _merge(self._catch_all, {agent: priority})
+            return
+        if "*" not in pattern:
+            _merge(self._exact.setdefault(pattern, {}), {agent: priority})
+            return
+
+        wildcards = [i for i, ch in enumerate(pattern) if ch in MULTI_WILDCARDS]
+
+        if wildcards == [len(pattern) - 1]:
+            self._insert(self._prefix, pattern[:-1], agent, priority)
+        elif wildcards == [0]:
+            self._insert(self._suffix, pattern[1:][::-1], agent, priority)
+        else:
+            self._likes.append((_like_regex(pattern), agent, priority))
+
+    @staticmethod
+    def _insert(root: _TrieNode, key: str, agent: str, priority: int):
+        node = root
+        for ch in key.translate(_ASCII_FOLD):
+            node = node.children.setdefault(ch, _TrieNode())
+        _merge(node.agents, {agent: priority})
+
+    @staticmethod
+    def _walk(root: _TrieNode, key: str, found: Dict[str, int]):
+        nodes = [root]
+        for ch in key.translate(_ASCII_FOLD):
+            # Follow the literal edge and the '_' edge, which matches any character
+            nodes = [
+                child
+                for node in nodes
+                for child in (node.children.get(ch), None if ch == ANY_CHAR else node.children.get(ANY_CHAR))
+                if child is not None
+            ]
+            if not nodes:
+                return
+            for node in nodes:
+                if node.agents:
+                    _merge(found, node.agents)
+
+    def match(self, action: str) -> List[str]:
+        """Return agents subscribed to an action, highest priority first"""
+        cached = self._cache.get(action)
+        if cached is not None:
+            return cached
+
+        found: Dict[str, int] = dict(self._catch_all)
+        exact = self._exact.get(action)
+        if exact:
+            _merge(found, exact)
+        self._walk(self._prefix, action, found)
+        self._walk(self._suffix, action[::-1], found)
+        for regex, agent, priority in self._likes:
+            if regex.fullmatch(action):
+                _merge(found, {agent: priority})
+
+        agents = [agent for agent, _ in sorted(found.items(), key=lambda item: (item[1], item[0]))]
+
+        if len(self._cache) >= MATCH_CACHE_SIZE:
+            self._cache.clear()
+        self._cache[action] = agents
+        return agents
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "version": self.version,
+            "patterns": self.pattern_count,
+            "exact_actions": len(self._exact),
+            "catch_all_agents": len(self._catch_all),
+            "like_patterns": len(self._likes),
+            "cached_actions": len(self._cache),
+        }
+
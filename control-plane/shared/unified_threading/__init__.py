@@ -27,6 +27,7 @@ from .conversation import UnifiedConversation
 from .chunking import ChunkingEngine, Chunk
 from .retrieval import ContextAssembler, RetrievalResult
 from .embeddings import EmbeddingService
+from .embedding_cache import EmbeddingCache
 
 __all__ = [
     "UnifiedConversation",
@@ -35,6 +36,7 @@ __all__ = [
     "ContextAssembler",
     "RetrievalResult",
     "EmbeddingService",
+    "EmbeddingCache",
 ]
 
 __version__ = "1.0.0"
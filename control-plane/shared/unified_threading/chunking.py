@@ -6,6 +6,7 @@ token limits, and topic shifts.
 """
 
 import os
+import logging
 from dataclasses import dataclass, field
 from datetime import datetime, timedelta
 from typing import Optional, List, Dict, Any
@@ -13,6 +14,11 @@ from uuid import UUID
 import httpx
 
 from .conversation import Message, UnifiedConversation
+from .embeddings import EmbeddingService, MAX_INPUT_CHARS
+from .vector_index import get_vector_index
+from .tokenizer import count_tokens
+
+logger = logging.getLogger(__name__)
 
 # Configuration
 SUPABASE_URL = os.getenv("SUPABASE_URL", "")
@@ -53,6 +59,7 @@ class Chunk:
     similarity: Optional[float] = None
     recency_score: Optional[float] = None
     combined_score: Optional[float] = None
+    use_summary: Optional[bool] = None  # Set by context packing; None renders the summary when present
 
 
 class ChunkingEngine:
@@ -67,9 +74,11 @@ class ChunkingEngine:
         self,
         conversation: UnifiedConversation,
         config: Optional[ChunkConfig] = None,
+        embedding_service: Optional[EmbeddingService] = None,
     ):
         self.conversation = conversation
         self.config = config or ChunkConfig()
+        self.embedding_service = embedding_service  # When set, new chunks are embedded and indexed
         self._client: Optional[httpx.AsyncClient] = None
 
     @property
@@ -97,10 +106,10 @@ class ChunkingEngine:
         """
         Estimate token count for text.
 
-        Uses a simple approximation: ~4 characters per token for English.
-        For more accuracy, use tiktoken.
+        Uses the shared tokenizer (tiktoken when installed, otherwise a
+        character-class approximation), memoized per string.
         """
-        return len(text) // 4
+        return count_tokens(text)
 
     def should_chunk(self, messages: List[Message]) -> bool:
         """
@@ -236,7 +245,7 @@ class ChunkingEngine:
 
         if response.status_code == 200:
             chunk_id = UUID(response.json())
-            return Chunk(
+            chunk = Chunk(
                 id=chunk_id,
                 conversation_id=self.conversation.conversation_id,
                 content=content,
@@ -249,9 +258,45 @@ class ChunkingEngine:
                 messages_end_at=messages[-1].created_at if messages else None,
                 created_at=datetime.utcnow(),
             )
+            if self.embedding_service:
+                await self.embed_chunk(chunk)
+            return chunk
         else:
             raise Exception(f"Failed to create chunk: {response.text}")
 
+    async def embed_chunk(self, chunk: Chunk) -> bool:
+        """
+        Embed a chunk, store the embedding and add it to the local vector index.
+
+        Failures are logged rather than raised: the chunk itself is already
+        stored and can be embedded again later.
+
+        Returns:
+            True if the embedding was stored
+        """
+        try:
+            text = chunk.content[:MAX_INPUT_CHARS]
+            embedding = await self.embedding_service.generate_embedding(text)
+            await self.embedding_service.store_embedding(chunk.id, embedding)
+        except Exception as e:
+            logger.warning(f"Failed to embed chunk {chunk.id}: {e}")
+            return False
+
+        index = get_vector_index(self.conversation.user_id)
+        if index is not None:
+            index.add(
+                {
+                    "chunk_id": str(chunk.id),
+                    "conversation_id": str(chunk.conversation_id),
+                    "content": chunk.content,
+                    "summary": chunk.summary,
+                    "token_count": chunk.token_count,
+                    "created_at": chunk.created_at.isoformat() if chunk.created_at else None,
+                },
+                embedding,
+            )
+        return True
+
     async def auto_chunk(self) -> Optional[Chunk]:
         """
         Automatically chunk oldest messages if needed.
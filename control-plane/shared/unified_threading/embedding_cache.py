@@ -0,0 +1,325 @@
+"""
+Embedding Cache
+
+Content-addressed cache for embedding vectors, shared by every
+EmbeddingService in the process.
+
+Entries are keyed by (model, sha256(normalized text)), so the same chunk,
+lesson or query is only ever sent to OpenAI once. Two tiers:
+- In-process LRU of packed float32 arrays (~6 KB per 1536-d vector)
+- SQLite file storing vectors as float32 or float16 blobs, size-bounded
+  with least recently used rows evicted first; hits update last_access in
+  batches (on the next store, or every TOUCH_BATCH hits) rather than with
+  a write per lookup
+
+The disk file lives on a volume shared by several services, so its size
+is re-read from SQLite inside each write transaction before evicting.
+Async callers use aget_many/aput_many, which serve memory hits inline and
+run the disk tier in a worker thread.
+"""
+
+import os
+import time
+import asyncio
+import struct
+import hashlib
+import logging
+import sqlite3
+import threading
+import unicodedata
+from array import array
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional, List, Dict, Any
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+EMBEDDING_CACHE_ENABLED = os.getenv("EMBEDDING_CACHE_ENABLED", "true").lower() == "true"
+EMBEDDING_CACHE_MEMORY_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MEMORY_ENTRIES", "4096"))
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", "/opt/leveredge/data/embedding_cache.db")
+EMBEDDING_CACHE_DISK_MAX_MB = float(os.getenv("EMBEDDING_CACHE_DISK_MAX_MB", "512"))  # 0 disables the disk tier
+EMBEDDING_CACHE_DTYPE = os.getenv("EMBEDDING_CACHE_DTYPE", "float32")  # float32 or float16
+
+DTYPE_FORMATS = {"float32": "f", "float16": "e"}
+TOUCH_BATCH = 256  # Pending last_access updates before they are written
+
+
+def normalize_text(text: str) -> str:
+    """Unicode NFC with surrounding and repeated whitespace collapsed."""
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+def cache_key(model: str, text: str) -> str:
+    """Content address for a text embedded with model."""
+    digest = hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+    return f"{model}:{digest}"
+
+
+def pack_vector(vector: List[float], dtype: str = "float32") -> bytes:
+    """Little-endian float32/float16 blob."""
+    return struct.pack(f"<{len(vector)}{DTYPE_FORMATS[dtype]}", *vector)
+
+
+def unpack_vector(blob: bytes, dtype: str = "float32") -> array:
+    size = struct.calcsize(DTYPE_FORMATS[dtype])
+    return array("f", struct.unpack(f"<{len(blob) // size}{DTYPE_FORMATS[dtype]}", blob))
+
+
+class EmbeddingCache:
+    """
+    Two-tier embedding cache.
+
+    get_many/put_many block on the disk tier; aget_many/aput_many keep it
+    off the event loop. The memory lock is never held across disk I/O, so
+    memory hits do not wait behind a worker thread's SQLite write.
+    """
+
+    def __init__(
+        self,
+        path: Optional[str] = EMBEDDING_CACHE_PATH,
+        memory_entries: int = EMBEDDING_CACHE_MEMORY_ENTRIES,
+        max_disk_mb: float = EMBEDDING_CACHE_DISK_MAX_MB,
+        dtype: str = EMBEDDING_CACHE_DTYPE,
+    ):
+        if dtype not in DTYPE_FORMATS:
+            raise ValueError(f"Unsupported embedding cache dtype: {dtype}")
+        self.memory_entries = memory_entries
+        self.dtype = dtype
+        self.max_bytes = int(max_disk_mb * 1024 * 1024)
+        self._memory: "OrderedDict[str, array]" = OrderedDict()
+        self._lock = threading.Lock()  # Memory tier, pending touches and stats
+        self._disk_lock = threading.Lock()  # The SQLite connection
+        self._conn: Optional[sqlite3.Connection] = None
+        self._touched: Dict[str, float] = {}  # key -> last_access not yet written
+        self.total_bytes = 0
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+
+        if path and self.max_bytes > 0:
+            try:
+                self._open(Path(path))
+            except (OSError, sqlite3.Error) as e:
+                logger.warning(f"Embedding cache disk tier unavailable at {path}: {e}")
+                self._conn = None
+
+    def _open(self, path: Path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS embeddings (
+                key TEXT PRIMARY KEY,
+                dtype TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                last_access REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_access ON embeddings(last_access)")
+        self.total_bytes = self._conn.execute(
+            "SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings"
+        ).fetchone()[0]
+
+    # -------------------------------------------------------------------------
+    # Lookups
+    # -------------------------------------------------------------------------
+
+    def get(self, model: str, text: str) -> Optional[List[float]]:
+        """Cached vector for text, or None."""
+        return self.get_many(model, [text])[0]
+
+    def get_many(self, model: str, texts: List[str]) -> List[Optional[List[float]]]:
+        """Cached vectors in the order of texts; None for misses."""
+        keys = [cache_key(model, text) for text in texts]
+        memory = self._from_memory(keys)
+        disk = self._from_disk([key for key in dict.fromkeys(keys) if key not in memory])
+        return self._resolve(keys, memory, disk)
+
+    async def aget_many(self, model: str, texts: List[str]) -> List[Optional[List[float]]]:
+        """get_many with the disk tier read in a worker thread."""
+        keys = [cache_key(model, text) for text in texts]
+        memory = self._from_memory(keys)
+        missing = [key for key in dict.fromkeys(keys) if key not in memory]
+        disk = await asyncio.to_thread(self._from_disk, missing) if missing and self._conn is not None else {}
+        return self._resolve(keys, memory, disk)
+
+    def _from_memory(self, keys: List[str]) -> Dict[str, array]:
+        hits: Dict[str, array] = {}
+        now = time.time()
+        with self._lock:
+            for key in keys:
+                vector = self._memory.get(key)
+                if vector is None:
+                    continue
+                self._memory.move_to_end(key)
+                if self._conn is not None:
+                    self._touched[key] = now  # Keep hot rows off the disk tier's eviction list
+                hits[key] = vector
+        return hits
+
+    def _from_disk(self, keys: List[str]) -> Dict[str, array]:
+        """Disk-tier vectors for keys; blocking."""
+        hits: Dict[str, array] = {}
+        if not keys or self._conn is None:
+            return hits
+        now = time.time()
+        with self._disk_lock:
+            if self._conn is None:
+                return hits
+            for key in keys:
+                row = self._conn.execute(
+                    "SELECT dtype, vector FROM embeddings WHERE key = ?", (key,)
+                ).fetchone()
+                if row:
+                    hits[key] = unpack_vector(row[1], row[0])
+            with self._lock:
+                for key, vector in hits.items():
+                    self._touched[key] = now
+                    self._remember(key, vector)
+                flush = len(self._touched) >= TOUCH_BATCH
+            if flush:
+                self._flush_touches()
+        return hits
+
+    def _resolve(self, keys: List[str], memory: Dict[str, array],
+                 disk: Dict[str, array]) -> List[Optional[List[float]]]:
+        results: List[Optional[List[float]]] = []
+        with self._lock:
+            for key in keys:
+                if key in memory:
+                    self.stats["memory_hits"] += 1
+                    results.append(memory[key].tolist())
+                elif key in disk:
+                    self.stats["disk_hits"] += 1
+                    results.append(disk[key].tolist())
+                else:
+                    self.stats["misses"] += 1
+                    results.append(None)
+        return results
+
+    # -------------------------------------------------------------------------
+    # Stores
+    # -------------------------------------------------------------------------
+
+    def put(self, model: str, text: str, vector: List[float]):
+        """Cache one vector."""
+        self.put_many(model, [text], [vector])
+
+    def put_many(self, model: str, texts: List[str], vectors: List[List[float]]):
+        """Cache vectors for texts (pairs with a None vector are skipped)."""
+        rows = self._store_memory(model, texts, vectors)
+        if rows:
+            self._write(rows)
+
+    async def aput_many(self, model: str, texts: List[str], vectors: List[List[float]]):
+        """put_many with the disk write in a worker thread."""
+        rows = self._store_memory(model, texts, vectors)
+        if rows:
+            await asyncio.to_thread(self._write, rows)
+
+    def _store_memory(self, model: str, texts: List[str], vectors: List[List[float]]) -> List[tuple]:
+        """Remember vectors in memory; returns the rows for the disk tier."""
+        now = time.time()
+        rows = []
+        with self._lock:
+            for text, vector in zip(texts, vectors):
+                if vector is None:
+                    continue
+                key = cache_key(model, text)
+                self._remember(key, array("f", vector))
+                if self._conn is not None:
+                    rows.append((key, self.dtype, pack_vector(vector, self.dtype), now))
+                self.stats["stores"] += 1
+        return rows
+
+    def _flush_touches(self):
+        """Write pending last_access updates in one statement (caller holds the disk lock)."""
+        with self._lock:
+            touched, self._touched = self._touched, {}
+        if not touched:
+            return
+        try:
+            self._conn.executemany(
+                "UPDATE embeddings SET last_access = ? WHERE key = ?",
+                [(at, key) for key, at in touched.items()]
+            )
+        except sqlite3.Error as e:
+            logger.warning(f"Embedding cache access update failed: {e}")
+
+    def _remember(self, key: str, vector: array):
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def _write(self, rows: List[tuple]):
+        with self._disk_lock:
+            if self._conn is None:
+                return
+            # IMMEDIATE takes the write lock up front, so the size read below stays
+            # true for this transaction even with other services writing the same file
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                # Eviction below orders by last_access, so pending hits land first
+                self._flush_touches()
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO embeddings (key, dtype, vector, last_access) VALUES (?, ?, ?, ?)", rows
+                )
+                self.total_bytes = self._conn.execute(
+                    "SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings"
+                ).fetchone()[0]
+                self._evict()
+                self._conn.execute("COMMIT")
+            except sqlite3.Error as e:
+                self._conn.execute("ROLLBACK")
+                logger.warning(f"Embedding cache write failed: {e}")
+
+    def _evict(self):
+        """Drop least recently used rows until the disk tier fits max_bytes."""
+        while self.total_bytes > self.max_bytes:
+            victims = self._conn.execute(
+                "SELECT key, LENGTH(vector) FROM embeddings ORDER BY last_access LIMIT 256"
+            ).fetchall()
+            if not victims:
+                self.total_bytes = 0
+                return
+            for key, size in victims:
+                if self.total_bytes <= self.max_bytes:
+                    break
+                self._conn.execute("DELETE FROM embeddings WHERE key = ?", (key,))
+                self.total_bytes -= size
+                self.stats["evictions"] += 1
+
+    def close(self):
+        with self._disk_lock:
+            if self._conn is not None:
+                self._flush_touches()
+                self._conn.close()
+                self._conn = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        lookups = self.stats["memory_hits"] + self.stats["disk_hits"] + self.stats["misses"]
+        hits = self.stats["memory_hits"] + self.stats["disk_hits"]
+        return {
+            **self.stats,
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+            "memory_entries": len(self._memory),
+            "disk_bytes": self.total_bytes,
+            "disk_enabled": self._conn is not None,
+            "dtype": self.dtype,
+        }
+
+
+_shared_cache: Optional[EmbeddingCache] = None
+_shared_lock = threading.Lock()
+
+
+def get_embedding_cache() -> Optional[EmbeddingCache]:
+    """Process-wide cache (None when EMBEDDING_CACHE_ENABLED is false)."""
+    global _shared_cache
+    if not EMBEDDING_CACHE_ENABLED:
+        return None
+    with _shared_lock:
+        if _shared_cache is None:
+            _shared_cache = EmbeddingCache()
+        return _shared_cache
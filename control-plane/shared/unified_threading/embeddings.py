@@ -2,13 +2,34 @@
 Embedding Service
 
 Generates and manages vector embeddings for semantic search.
+
+Texts are embedded in packs: one OpenAI request carries up to
+EMBEDDING_MAX_INPUTS inputs or EMBEDDING_MAX_BATCH_TOKENS tokens, and
+packs run EMBEDDING_CONCURRENCY at a time. Pack sizes come from the shared
+tokenizer, and a pack OpenAI still rejects with a 400 is halved and
+retried. Single-text calls are merged by a micro-batcher, so concurrent
+callers share requests too.
+
+Vectors are cached by content (see embedding_cache), so a text already
+embedded with the same model never reaches OpenAI again.
 """
 
 import os
-from typing import Optional, List
+import asyncio
+from typing import Optional, List, Dict, Any, Tuple, Callable, Awaitable
 from uuid import UUID
 import httpx
 
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    np = None
+    NUMPY_AVAILABLE = False
+
+from .embedding_cache import EmbeddingCache, get_embedding_cache
+from .tokenizer import count_tokens
+
 # Configuration
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "")
 SUPABASE_URL = os.getenv("SUPABASE_URL", "")
@@ -17,6 +38,157 @@ SUPABASE_KEY = os.getenv("SUPABASE_SERVICE_KEY", os.getenv("SUPABASE_ANON_KEY",
 EMBEDDING_MODEL = "text-embedding-ada-002"
 EMBEDDING_DIMENSION = 1536
 
+# Batching (OpenAI allows 2048 inputs and 300K tokens per request)
+EMBEDDING_MAX_INPUTS = int(os.getenv("EMBEDDING_MAX_INPUTS", "2048"))
+EMBEDDING_MAX_BATCH_TOKENS = int(os.getenv("EMBEDDING_MAX_BATCH_TOKENS", "250000"))
+EMBEDDING_CONCURRENCY = int(os.getenv("EMBEDDING_CONCURRENCY", "4"))
+EMBEDDING_BATCH_WINDOW_MS = float(os.getenv("EMBEDDING_BATCH_WINDOW_MS", "5"))
+MAX_INPUT_CHARS = 30000  # ~7500 tokens, under the 8191 per-input limit
+
+
+def estimate_tokens(text: str) -> int:
+    """Token count for pack planning (the shared tokenizer; CJK and code are not undercounted)."""
+    return count_tokens(text) or 1
+
+
+def plan_batches(
+    texts: List[str],
+    max_inputs: int = EMBEDDING_MAX_INPUTS,
+    max_tokens: int = EMBEDDING_MAX_BATCH_TOKENS,
+) -> List[List[int]]:
+    """
+    Split texts into request-sized packs.
+
+    Args:
+        texts: Texts to embed
+        max_inputs: Most inputs per request
+        max_tokens: Most estimated tokens per request
+
+    Returns:
+        Lists of indexes into texts, in order
+    """
+    batches: List[List[int]] = []
+    current: List[int] = []
+    tokens = 0
+    for index, text in enumerate(texts):
+        text_tokens = estimate_tokens(text)
+        if current and (len(current) >= max_inputs or tokens + text_tokens > max_tokens):
+            batches.append(current)
+            current, tokens = [], 0
+        current.append(index)
+        tokens += text_tokens
+    if current:
+        batches.append(current)
+    return batches
+
+
+class EmbeddingRequestError(Exception):
+    """OpenAI rejected an embeddings request."""
+
+    def __init__(self, status_code: int, message: str):
+        super().__init__(message)
+        self.status_code = status_code
+
+    @property
+    def transient(self) -> bool:
+        """Rate limits and server errors, as opposed to a rejected input."""
+        return self.status_code == 429 or self.status_code >= 500
+
+
+def cosine_similarities(query, matrix) -> "np.ndarray":
+    """
+    Cosine similarity of a query against every row of a matrix (NumPy only).
+
+    Args:
+        query: Query vector
+        matrix: Candidate vectors, one per row; a float32 ndarray avoids a
+            conversion from Python lists
+
+    Returns:
+        Similarities in row order (0.0 for zero vectors)
+    """
+    matrix = np.asarray(matrix, dtype=np.float32)
+    query = np.asarray(query, dtype=np.float32)
+    norms = np.sqrt(np.einsum("ij,ij->i", matrix, matrix)) * np.linalg.norm(query)
+    dots = matrix @ query
+    return np.divide(dots, norms, out=np.zeros_like(dots), where=norms > 0)
+
+
+class EmbeddingBatcher:
+    """
+    Merges concurrent single-text requests into batched calls.
+
+    The first caller opens a short window (EMBEDDING_BATCH_WINDOW_MS);
+    every text submitted before it closes, or until max_inputs are
+    waiting, goes out through one embed_many call. Identical texts in a
+    window are embedded once.
+
+    If a batch is rejected (e.g. one empty or oversized input), it is
+    bisected and retried so only the callers of the bad texts get the
+    error. Transient failures (rate limits, server or network errors)
+    fail the whole window without retrying.
+    """
+
+    def __init__(
+        self,
+        embed_many: Callable[[List[str]], Awaitable[List[List[float]]]],
+        window_ms: float = EMBEDDING_BATCH_WINDOW_MS,
+        max_inputs: int = EMBEDDING_MAX_INPUTS,
+    ):
+        self.embed_many = embed_many
+        self.window = window_ms / 1000
+        self.max_inputs = max_inputs
+        self._pending: List[Tuple[str, asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._tasks: set = set()
+
+    async def embed(self, text: str) -> List[float]:
+        """Embed one text as part of the current window's batch."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((text, future))
+        if len(self._pending) >= self.max_inputs:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        pending, self._pending = self._pending, []
+        if pending:
+            task = asyncio.ensure_future(self._run(pending))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, pending: List[Tuple[str, asyncio.Future]]):
+        unique = list(dict.fromkeys(text for text, _ in pending))
+        results = await self._embed_isolated(unique)
+        for text, future in pending:
+            if not future.done():
+                if isinstance(results[text], Exception):
+                    future.set_exception(results[text])
+                else:
+                    future.set_result(results[text])
+
+    async def _embed_isolated(self, texts: List[str]) -> Dict[str, Any]:
+        """Vector or exception per text, bisecting rejected batches."""
+        try:
+            return dict(zip(texts, await self.embed_many(texts)))
+        except Exception as e:
+            transient = isinstance(e, httpx.TransportError) or (
+                isinstance(e, EmbeddingRequestError) and e.transient
+            )
+            if len(texts) == 1 or transient:
+                return {text: e for text in texts}
+        middle = len(texts) // 2
+        left, right = await asyncio.gather(
+            self._embed_isolated(texts[:middle]), self._embed_isolated(texts[middle:])
+        )
+        return {**left, **right}
+
 
 class EmbeddingService:
     """
@@ -32,12 +204,15 @@ class EmbeddingService:
         supabase_url: str = None,
         supabase_key: str = None,
         model: str = EMBEDDING_MODEL,
+        cache: Optional[EmbeddingCache] = None,
     ):
         self.openai_api_key = openai_api_key or OPENAI_API_KEY
         self.supabase_url = supabase_url or SUPABASE_URL
         self.supabase_key = supabase_key or SUPABASE_KEY
         self.model = model
         self._client: Optional[httpx.AsyncClient] = None
+        self.cache = cache or get_embedding_cache()
+        self._batcher = EmbeddingBatcher(self._embed_uncached)
 
     async def _get_client(self) -> httpx.AsyncClient:
         """Get or create HTTP client."""
@@ -54,15 +229,88 @@ class EmbeddingService:
         """
         Generate embedding for text using OpenAI API.
 
+        Cached vectors are returned without an API call; concurrent
+        misses are batched into shared requests.
+
         Args:
             text: Text to embed
 
         Returns:
             List of floats representing the embedding vector
         """
+        text = text[:MAX_INPUT_CHARS]
+        if self.cache is not None:
+            cached = (await self.cache.aget_many(self.model, [text]))[0]
+            if cached is not None:
+                return cached
+
         if not self.openai_api_key:
             raise ValueError("OpenAI API key not configured")
 
+        return await self._batcher.embed(text)
+
+    async def generate_embeddings(
+        self,
+        texts: List[str],
+        concurrency: int = EMBEDDING_CONCURRENCY,
+    ) -> List[List[float]]:
+        """
+        Generate embeddings for many texts in as few requests as possible.
+
+        Args:
+            texts: Texts to embed (truncated to MAX_INPUT_CHARS)
+            concurrency: Requests in flight at once
+
+        Returns:
+            Embedding vectors in the same order as texts
+        """
+        if not texts:
+            return []
+
+        texts = [text[:MAX_INPUT_CHARS] for text in texts]
+        if self.cache is not None:
+            embeddings = await self.cache.aget_many(self.model, texts)
+        else:
+            embeddings = [None] * len(texts)
+
+        missing = list(dict.fromkeys(text for text, vector in zip(texts, embeddings) if vector is None))
+        if missing:
+            if not self.openai_api_key:
+                raise ValueError("OpenAI API key not configured")
+            fresh = dict(zip(missing, await self._embed_uncached(missing, concurrency)))
+            embeddings = [vector if vector is not None else fresh[text] for text, vector in zip(texts, embeddings)]
+        return embeddings
+
+    async def _embed_uncached(
+        self,
+        texts: List[str],
+        concurrency: int = EMBEDDING_CONCURRENCY,
+    ) -> List[List[float]]:
+        """Embed texts through the API in packs and cache the results."""
+        embeddings: List[Optional[List[float]]] = [None] * len(texts)
+        semaphore = asyncio.Semaphore(max(1, concurrency))
+
+        async def run(batch: List[int]):
+            try:
+                async with semaphore:
+                    vectors = await self._request_embeddings([texts[i] for i in batch])
+            except EmbeddingRequestError as e:
+                # The token estimate can still let an over-limit pack through; halve it and retry
+                if e.status_code != 400 or len(batch) == 1:
+                    raise
+                middle = len(batch) // 2
+                await asyncio.gather(run(batch[:middle]), run(batch[middle:]))
+                return
+            for index, vector in zip(batch, vectors):
+                embeddings[index] = vector
+
+        await asyncio.gather(*(run(batch) for batch in plan_batches(texts)))
+        if self.cache is not None:
+            await self.cache.aput_many(self.model, texts, embeddings)
+        return embeddings
+
+    async def _request_embeddings(self, inputs: List[str]) -> List[List[float]]:
+        """One OpenAI embeddings request; vectors in input order."""
         client = await self._get_client()
 
         response = await client.post(
@@ -72,16 +320,16 @@ class EmbeddingService:
                 "Content-Type": "application/json",
             },
             json={
-                "input": text,
+                "input": inputs,
                 "model": self.model,
             },
         )
 
         if response.status_code == 200:
             data = response.json()
-            return data["data"][0]["embedding"]
+            return [item["embedding"] for item in sorted(data["data"], key=lambda item: item["index"])]
         else:
-            raise Exception(f"Failed to generate embedding: {response.text}")
+            raise EmbeddingRequestError(response.status_code, f"Failed to generate embedding: {response.text}")
 
     async def store_embedding(
         self,
@@ -136,9 +384,8 @@ class EmbeddingService:
             ID of the stored embedding
         """
         # Truncate text if too long (ada-002 has 8191 token limit)
-        max_chars = 30000  # ~7500 tokens
-        if len(text) > max_chars:
-            text = text[:max_chars]
+        if len(text) > MAX_INPUT_CHARS:
+            text = text[:MAX_INPUT_CHARS]
 
         embedding = await self.generate_embedding(text)
         return await self.store_embedding(chunk_id, embedding)
@@ -220,6 +467,12 @@ class EmbeddingService:
         if len(a) != len(b):
             raise ValueError("Vectors must have same dimension")
 
+        if NUMPY_AVAILABLE:
+            a = np.asarray(a, dtype=np.float64)
+            b = np.asarray(b, dtype=np.float64)
+            norm = np.linalg.norm(a) * np.linalg.norm(b)
+            return float(a @ b / norm) if norm else 0.0
+
         dot_product = sum(x * y for x, y in zip(a, b))
         norm_a = sum(x * x for x in a) ** 0.5
         norm_b = sum(x * x for x in b) ** 0.5
@@ -6,19 +6,40 @@ using semantic search and relevance scoring.
 """
 
 import os
+import json
+import math
+import asyncio
+import logging
 from dataclasses import dataclass, field
-from datetime import datetime, timedelta
-from typing import Optional, List, Dict, Any
+from datetime import datetime, timedelta, timezone
+from typing import Optional, List, Dict, Any, Tuple
 from uuid import UUID
 import httpx
 
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    np = None
+    NUMPY_AVAILABLE = False
+
 from .conversation import UnifiedConversation, Message
 from .chunking import Chunk, ChunkingEngine
-from .embeddings import EmbeddingService
+from .embeddings import EmbeddingService, cosine_similarities
+from .vector_index import VectorIndex, get_vector_index
+from .tokenizer import count_tokens
+
+logger = logging.getLogger(__name__)
 
 # Configuration
 SUPABASE_URL = os.getenv("SUPABASE_URL", "")
 SUPABASE_KEY = os.getenv("SUPABASE_SERVICE_KEY", os.getenv("SUPABASE_ANON_KEY", ""))
+SYNC_PAGE_SIZE = 500
+CHUNK_OVERHEAD_TOKENS = 8  # Header and separator lines per chunk in formatted context
+KNAPSACK_RESOLUTION = 512  # Budget steps the packer distinguishes
+
+# Background index syncs, keyed by user (held so tasks are not garbage collected)
+_index_tasks: Dict[str, asyncio.Task] = {}
 
 
 @dataclass
@@ -31,6 +52,8 @@ class RetrievalConfig:
     similarity_threshold: float = 0.7  # Minimum similarity to retrieve
     max_chunks_to_retrieve: int = 10  # Maximum chunks to consider
     recency_decay_hours: float = 24.0  # Hours for recency decay factor
+    summary_substitution: bool = True  # Pack a chunk's summary when the full text does not pay off
+    summary_value: float = 0.6  # Share of a chunk's score its summary is worth
 
     # Importance multipliers for special content
     importance_multipliers: Dict[str, float] = field(default_factory=lambda: {
@@ -41,6 +64,54 @@ class RetrievalConfig:
     })
 
 
+def knapsack_select(options: List[List[tuple]], budget: int) -> List[Optional[int]]:
+    """
+    Multiple-choice 0/1 knapsack.
+
+    Args:
+        options: Per item, the alternative (weight, value) pairs; at most
+            one alternative of each item is taken
+        budget: Total weight allowed
+
+    Returns:
+        Index of the chosen alternative per item, or None if left out
+
+    Weights are rounded up to budget / KNAPSACK_RESOLUTION steps, so the
+    selection never exceeds the budget and the table stays small.
+    """
+    if budget <= 0:
+        return [None] * len(options)
+    unit = max(1, math.ceil(budget / KNAPSACK_RESOLUTION))
+    capacity = budget // unit
+
+    # best[c]: highest value with total (rounded) weight <= c
+    best = [0.0] * (capacity + 1)
+    picks: List[List[int]] = []
+    for alternatives in options:
+        updated = best[:]
+        pick = [-1] * (capacity + 1)
+        for k, (weight, value) in enumerate(alternatives):
+            steps = math.ceil(weight / unit)
+            if steps > capacity or value <= 0:
+                continue
+            for c in range(steps, capacity + 1):
+                candidate = best[c - steps] + value
+                if candidate > updated[c]:
+                    updated[c] = candidate
+                    pick[c] = k
+        picks.append(pick)
+        best = updated
+
+    selected: List[Optional[int]] = [None] * len(options)
+    c = capacity
+    for i in reversed(range(len(options))):
+        k = picks[i][c]
+        if k >= 0:
+            selected[i] = k
+            c -= math.ceil(options[i][k][0] / unit)
+    return selected
+
+
 @dataclass
 class RetrievalResult:
     """Result of context retrieval."""
@@ -99,8 +170,39 @@ class ContextAssembler:
         await self.chunking_engine.close()
 
     def estimate_tokens(self, text: str) -> int:
-        """Estimate token count for text."""
-        return len(text) // 4
+        """Estimate token count for text (shared, memoized tokenizer)."""
+        return count_tokens(text)
+
+    def pack_chunks(self, chunks: List[Chunk], budget: int) -> List[tuple]:
+        """
+        Choose the chunks, or their summaries, that maximise total score within budget.
+
+        Args:
+            chunks: Scored candidates
+            budget: Tokens available for archived context
+
+        Returns:
+            (chunk, tokens) pairs in score order; chunk.use_summary records
+            which form was packed
+        """
+        options = []
+        for chunk in chunks:
+            score = chunk.combined_score or 0.0
+            alternatives = [(self.estimate_tokens(chunk.content) + CHUNK_OVERHEAD_TOKENS, score)]
+            if self.config.summary_substitution and chunk.summary:
+                alternatives.append((
+                    self.estimate_tokens(chunk.summary) + CHUNK_OVERHEAD_TOKENS,
+                    score * self.config.summary_value,
+                ))
+            options.append(alternatives)
+
+        packed = []
+        for chunk, alternatives, choice in zip(chunks, options, knapsack_select(options, budget)):
+            if choice is None:
+                continue
+            chunk.use_summary = choice == 1
+            packed.append((chunk, alternatives[choice][0]))
+        return packed
 
     def calculate_recency_score(self, chunk_created_at: datetime) -> float:
         """
@@ -139,6 +241,90 @@ class ContextAssembler:
         # Apply importance multiplier
         return base_score * importance_score
 
+    def rank_chunks(
+        self,
+        chunks: List[Chunk],
+        query_embedding: Optional[List[float]] = None,
+        embeddings=None,
+        top_k: Optional[int] = None,
+    ) -> List[Chunk]:
+        """
+        Score and order candidate chunks in one vectorized pass.
+
+        Similarity comes from query_embedding against embeddings when both
+        are given, otherwise from each chunk's existing similarity. Recency
+        and importance are applied as array operations and the best top_k
+        are selected with argpartition. Falls back to per-chunk scoring
+        without NumPy.
+
+        Args:
+            chunks: Candidate chunks
+            query_embedding: Query vector
+            embeddings: Candidate vectors aligned with chunks (a float32
+                ndarray is fastest)
+            top_k: Number of chunks to return (defaults to all)
+
+        Returns:
+            Chunks with similarity, recency and combined scores set, best first
+        """
+        if not chunks:
+            return []
+        top_k = min(top_k or len(chunks), len(chunks))
+        rescore = query_embedding is not None and embeddings is not None
+
+        if not NUMPY_AVAILABLE:
+            for i, chunk in enumerate(chunks):
+                if rescore:
+                    chunk.similarity = self.embedding_service.cosine_similarity(query_embedding, embeddings[i])
+                chunk.recency_score = self.calculate_recency_score(chunk.created_at)
+                chunk.combined_score = self.calculate_combined_score(
+                    chunk.similarity or 0.0,
+                    chunk.recency_score,
+                    chunk.importance_score,
+                )
+            return sorted(chunks, key=lambda c: c.combined_score, reverse=True)[:top_k]
+
+        count = len(chunks)
+        if rescore:
+            similarity = cosine_similarities(query_embedding, embeddings)
+        else:
+            similarity = np.fromiter((c.similarity or 0.0 for c in chunks), dtype=np.float64, count=count)
+        importance = np.fromiter((c.importance_score for c in chunks), dtype=np.float64, count=count)
+        recency = self._recency_scores(chunks)
+        combined = (
+            similarity * self.config.semantic_weight + recency * self.config.recency_weight
+        ) * importance
+
+        if top_k < count:
+            best = np.argpartition(-combined, top_k - 1)[:top_k]
+        else:
+            best = np.arange(count)
+        best = best[np.argsort(-combined[best], kind="stable")]
+
+        ranked = []
+        for i in best.tolist():
+            chunk = chunks[i]
+            chunk.similarity = float(similarity[i])
+            chunk.recency_score = float(recency[i])
+            chunk.combined_score = float(combined[i])
+            ranked.append(chunk)
+        return ranked
+
+    def _recency_scores(self, chunks: List[Chunk]) -> "np.ndarray":
+        """calculate_recency_score for every chunk (naive timestamps are UTC)."""
+        created = np.fromiter(
+            (
+                (c.created_at if c.created_at.tzinfo else c.created_at.replace(tzinfo=timezone.utc)).timestamp()
+                if c.created_at else np.nan
+                for c in chunks
+            ),
+            dtype=np.float64,
+            count=len(chunks),
+        )
+        age_hours = (datetime.now(timezone.utc).timestamp() - created) / 3600
+        scores = 1.0 / (1 + age_hours / self.config.recency_decay_hours)
+        return np.where(np.isnan(created), 0.5, scores)  # Default for unknown time
+
     async def semantic_search(
         self,
         query: str,
@@ -147,6 +333,9 @@ class ContextAssembler:
         """
         Search archived chunks by semantic similarity.
 
+        Uses the user's local vector index when it is warm; otherwise the
+        search_chunks_semantic RPC, while the index syncs in the background.
+
         Args:
             query: Search query
             top_k: Maximum results (defaults to config)
@@ -160,6 +349,17 @@ class ContextAssembler:
         # Generate query embedding
         query_embedding = await self.embedding_service.generate_embedding(query)
 
+        index = get_vector_index(self.conversation.user_id)
+        if index is not None:
+            if index.is_warm():
+                if index.needs_graph():
+                    self._schedule_index_task(index, asyncio.to_thread(index.build_graph))
+                matches = index.search(query_embedding, top_k, self.config.similarity_threshold)
+                return self._rank_chunks([
+                    {**row, "similarity": similarity} for row, similarity in matches
+                ])
+            self._schedule_index_task(index, self._sync_vector_index(index))
+
         # Format embedding for PostgreSQL
         embedding_str = f"[{','.join(str(x) for x in query_embedding)}]"
 
@@ -176,43 +376,107 @@ class ContextAssembler:
         )
 
         if response.status_code == 200:
-            data = response.json()
-            chunks = []
-            for row in data:
-                chunk = Chunk(
-                    id=UUID(row["chunk_id"]),
-                    conversation_id=self.conversation.conversation_id,
-                    content=row["content"],
-                    summary=row.get("summary"),
-                    token_count=row["token_count"],
-                    message_count=0,  # Not returned by search
-                    created_at=datetime.fromisoformat(row["created_at"].replace("Z", "+00:00")) if row.get("created_at") else None,
-                )
-                chunk.similarity = row["similarity"]
-                chunk.recency_score = self.calculate_recency_score(chunk.created_at)
-                chunk.combined_score = self.calculate_combined_score(
-                    chunk.similarity,
-                    chunk.recency_score,
-                )
-                chunks.append(chunk)
-
-            # Sort by combined score
-            chunks.sort(key=lambda c: c.combined_score or 0, reverse=True)
-            return chunks
+            return self._rank_chunks(response.json())
         else:
             # If semantic search fails, fall back to recent chunks
             return await self.get_recent_chunks(limit=top_k)
 
+    def _rank_chunks(self, rows: List[Dict[str, Any]]) -> List[Chunk]:
+        """Build scored Chunks from search rows, best combined score first."""
+        chunks = []
+        for row in rows:
+            chunk = Chunk(
+                id=UUID(row["chunk_id"]),
+                conversation_id=UUID(row["conversation_id"]) if row.get("conversation_id") else self.conversation.conversation_id,
+                content=row["content"],
+                summary=row.get("summary"),
+                token_count=row["token_count"],
+                message_count=0,  # Not returned by search
+                created_at=datetime.fromisoformat(row["created_at"].replace("Z", "+00:00")) if row.get("created_at") else None,
+            )
+            chunk.similarity = row["similarity"]
+            chunks.append(chunk)
+
+        return self.rank_chunks(chunks)
+
+    def _schedule_index_task(self, index: VectorIndex, work) -> None:
+        """Run index maintenance in the background, one task per user at a time."""
+        user_id = self.conversation.user_id
+        running = _index_tasks.get(user_id)
+        if running is not None and not running.done():
+            work.close()
+            return
+        _index_tasks[user_id] = asyncio.ensure_future(work)
+
+    async def _sync_vector_index(self, index: VectorIndex) -> None:
+        """Load every embedded chunk of the user's conversations into the local index."""
+        chunks = []
+        embeddings = []
+        index.begin_sync()
+        try:
+            # Own client: this outlives the request that scheduled it
+            async with httpx.AsyncClient(timeout=60.0) as client:
+                after: Optional[Tuple[str, str]] = None  # (created_at, id) of the last row read
+                while True:
+                    params = {
+                        "select": (
+                            "id,conversation_id,content,summary,token_count,created_at,"
+                            "aria_unified_embeddings!inner(embedding),aria_unified_conversations!inner(user_id)"
+                        ),
+                        # Same scope as search_chunks_semantic: every conversation of the user
+                        "aria_unified_conversations.user_id": f"eq.{self.conversation.user_id}",
+                        # id breaks created_at ties, so keyset pages neither skip nor repeat rows
+                        "order": "created_at.asc,id.asc",
+                        "limit": SYNC_PAGE_SIZE,
+                    }
+                    if after:
+                        created_at, chunk_id = after
+                        params["or"] = (
+                            f'(created_at.gt."{created_at}",'
+                            f'and(created_at.eq."{created_at}",id.gt."{chunk_id}"))'
+                        )
+                    response = await client.get(
+                        f"{self.conversation.supabase_url}/rest/v1/aria_unified_chunks",
+                        headers=self.headers,
+                        params=params,
+                    )
+                    if response.status_code != 200:
+                        logger.warning(f"Vector index sync failed for {self.conversation.user_id}: {response.text}")
+                        return
+                    rows = response.json()
+                    for row in rows:
+                        embedded = row["aria_unified_embeddings"]
+                        if isinstance(embedded, list):
+                            embedded = embedded[0] if embedded else None
+                        if not embedded:
+                            continue
+                        vector = embedded["embedding"]
+                        embeddings.append(json.loads(vector) if isinstance(vector, str) else vector)
+                        chunks.append({
+                            "chunk_id": row["id"],
+                            "conversation_id": row["conversation_id"],
+                            "content": row["content"],
+                            "summary": row.get("summary"),
+                            "token_count": row["token_count"],
+                            "created_at": row.get("created_at"),
+                        })
+                    if len(rows) < SYNC_PAGE_SIZE:
+                        break
+                    after = (rows[-1]["created_at"], rows[-1]["id"])
+
+            await asyncio.to_thread(index.replace_all, chunks, embeddings)
+            logger.info(f"Vector index for {self.conversation.user_id} synced ({len(chunks)} chunks)")
+        except Exception as e:
+            logger.warning(f"Vector index sync failed for {self.conversation.user_id}: {e}")
+        finally:
+            index.end_sync()
+
     async def get_recent_chunks(self, limit: int = 10) -> List[Chunk]:
         """Get most recent chunks (fallback when no query)."""
         chunks = await self.chunking_engine.get_chunks(limit=limit)
         for chunk in chunks:
-            chunk.recency_score = self.calculate_recency_score(chunk.created_at)
             chunk.similarity = 0.8  # Default similarity for recent chunks
-            chunk.combined_score = self.calculate_combined_score(
-                chunk.similarity,
-                chunk.recency_score,
-            )
+        self.rank_chunks(chunks)  # Sets scores; order stays most recent first
         return chunks
 
     async def get_context(
@@ -264,22 +528,19 @@ class ContextAssembler:
                 candidates = await self.get_recent_chunks()
                 retrieval_scores["search_method"] = "recency"
 
-            # 3. Fill budget with best chunks
-            for chunk in candidates:
-                if chunk.token_count <= remaining_budget:
-                    retrieved_chunks.append(chunk)
-                    archive_tokens += chunk.token_count
-                    remaining_budget -= chunk.token_count
-
-                    # Track retrieval scores
-                    retrieval_scores[str(chunk.id)] = {
-                        "similarity": chunk.similarity,
-                        "recency": chunk.recency_score,
-                        "combined": chunk.combined_score,
-                    }
+            # 3. Pack the budget with the highest-scoring mix of chunks and summaries
+            for chunk, tokens in self.pack_chunks(candidates, remaining_budget):
+                retrieved_chunks.append(chunk)
+                archive_tokens += tokens
+                remaining_budget -= tokens
 
-                if remaining_budget < 100:
-                    break
+                # Track retrieval scores
+                retrieval_scores[str(chunk.id)] = {
+                    "similarity": chunk.similarity,
+                    "recency": chunk.recency_score,
+                    "combined": chunk.combined_score,
+                    "summary": chunk.use_summary,
+                }
 
             # 4. Update retrieval counts for retrieved chunks
             await self._update_retrieval_counts([c.id for c in retrieved_chunks])
@@ -334,7 +595,7 @@ class ContextAssembler:
         if result.retrieved_chunks:
             parts.append("=== RELEVANT PAST CONTEXT ===\n")
             for chunk in reversed(result.retrieved_chunks):  # Chronological order
-                if chunk.summary:
+                if chunk.summary and chunk.use_summary is not False:
                     parts.append(f"[Summary from {chunk.created_at.date() if chunk.created_at else 'past'}]")
                     parts.append(chunk.summary)
                 else:
@@ -0,0 +1,150 @@
+"""
+Tokenizer
+
+Token counting for chunking and context assembly.
+
+- tiktoken (UNIFIED_TOKENIZER_ENCODING, cl100k_base by default) when it
+  is installed and the encoding loads, otherwise a character-class
+  approximation (the same one the API gateway uses for admission)
+- Counts are memoized in an LRU keyed by a digest of the text, so
+  re-scoring the same chunks and messages costs a hash and a dict lookup
+  and the memo does not hold on to the texts themselves
+- set_tokenizer() plugs in any callable(str) -> int, e.g. a
+  model-specific tokenizer
+"""
+
+import os
+import re
+import math
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Any, Optional
+
+try:
+    import tiktoken
+    TIKTOKEN_AVAILABLE = True
+except ImportError:
+    tiktoken = None
+    TIKTOKEN_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+UNIFIED_TOKENIZER = os.getenv("UNIFIED_TOKENIZER", "auto")  # auto, tiktoken or approximate
+UNIFIED_TOKENIZER_ENCODING = os.getenv("UNIFIED_TOKENIZER_ENCODING", "cl100k_base")
+TOKEN_MEMO_SIZE = int(os.getenv("UNIFIED_TOKEN_MEMO_SIZE", "8192"))
+
+# Keep TOKEN_CLASSES and approximate_tokens in step with the API gateway's
+# copy (control-plane/agents/gateway/token_estimator.py): the gateway ships
+# as a standalone service and cannot import this package.
+# tests/test_unified_threading.py checks the two agree.
+TOKEN_CLASSES = re.compile(
+    r"(?P<word>[A-Za-z]+)"
+    r"|(?P<digits>[0-9]+)"
+    r"|(?P<space>\s+)"
+    r"|(?P<cjk>[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af])"
+    r"|(?P<other>[^\x00-\x7f])"
+    r"|(?P<punct>.)",
+    re.S
+)
+
+
+def approximate_tokens(text: str) -> int:
+    """
+    Character-class approximation of BPE token counts.
+
+    Unlike len(text) // 4 this holds up for code (punctuation-heavy) and
+    non-English text (CJK is roughly a token per character).
+    """
+    tokens = 0.0
+    for match in TOKEN_CLASSES.finditer(text):
+        kind = match.lastgroup
+        length = match.end() - match.start()
+        if kind == "word":
+            tokens += math.ceil(length / 6)  # Common words are one token, long ones split
+        elif kind == "digits":
+            tokens += math.ceil(length / 3)
+        elif kind == "space":
+            tokens += 0 if length == 1 else 1  # A single space merges into the next word
+        elif kind == "cjk":
+            tokens += length
+        elif kind == "other":
+            tokens += length * 0.5
+        else:
+            tokens += length
+    return math.ceil(tokens)
+
+
+def load_tokenizer(name: str = UNIFIED_TOKENIZER) -> Callable[[str], int]:
+    """Token counting function for a configured tokenizer name."""
+    if name in ("auto", "tiktoken") and TIKTOKEN_AVAILABLE:
+        try:
+            encoding = tiktoken.get_encoding(UNIFIED_TOKENIZER_ENCODING)
+            return lambda text: len(encoding.encode(text, disallowed_special=()))
+        except Exception as e:
+            # Encodings are downloaded on first use; offline hosts fall back
+            logger.warning(f"tiktoken encoding unavailable, using approximation: {e}")
+    elif name == "tiktoken":
+        logger.warning("tiktoken not installed, using approximation")
+    return approximate_tokens
+
+
+class TokenCounter:
+    """Memoizing wrapper around a token counting function."""
+
+    def __init__(self, tokenize: Callable[[str], int], memo_size: int = TOKEN_MEMO_SIZE):
+        self.tokenize = tokenize
+        self.memo_size = memo_size
+        self._memo: "OrderedDict[bytes, int]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def count(self, text: Optional[str]) -> int:
+        """Tokens in text (0 for empty or None)."""
+        if not text:
+            return 0
+        key = hashlib.blake2b(text.encode("utf-8", "surrogatepass"), digest_size=16).digest()
+        with self._lock:
+            tokens = self._memo.get(key)
+            if tokens is not None:
+                self._memo.move_to_end(key)
+                self.hits += 1
+                return tokens
+        tokens = self.tokenize(text)
+        with self._lock:
+            self.misses += 1
+            self._memo[key] = tokens
+            while len(self._memo) > self.memo_size:
+                self._memo.popitem(last=False)
+        return tokens
+
+    __call__ = count
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {"hits": self.hits, "misses": self.misses, "memoized": len(self._memo)}
+
+
+_counter: Optional[TokenCounter] = None
+
+
+def get_token_counter() -> TokenCounter:
+    """Process-wide counter, created with the configured tokenizer on first use."""
+    global _counter
+    if _counter is None:
+        _counter = TokenCounter(load_tokenizer())
+    return _counter
+
+
+def set_tokenizer(tokenize: Callable[[str], int]) -> TokenCounter:
+    """Replace the process-wide tokenizer (the memo starts empty)."""
+    global _counter
+    _counter = TokenCounter(tokenize)
+    return _counter
+
+
+def count_tokens(text: Optional[str]) -> int:
+    """Token count of text with the process-wide tokenizer."""
+    return get_token_counter().count(text)
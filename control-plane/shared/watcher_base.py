@@ -286,6 +286,7 @@ class EventSubscriberBase(ABC):
         self.running = False
         self.events_processed = 0
         self.errors: List[str] = []
+        self.last_event_id: Optional[str] = None  # Resume cursor for reconnects
 
     @abstractmethod
     def get_name(self) -> str:
@@ -309,16 +310,24 @@ class EventSubscriberBase(ABC):
 
         while self.running:
             try:
-                async with httpx.AsyncClient(timeout=None) as client:
-                    # Use /events endpoint (SSE stream) or /agents/{name}/events
-                    url = f"{EVENT_BUS_URL}/events"
-
-                    async with client.stream("GET", url) as response:
+                async with httpx.AsyncClient(timeout=httpx.Timeout(10.0, read=None)) as client:
+                    # SSE stream of new events, filtered server-side
+                    url = f"{EVENT_BUS_URL}/events/stream"
+                    params = {"action": [f for f in filters if f != "*"]}
+                    headers = {"Accept": "text/event-stream"}
+                    if self.last_event_id:
+                        # Replay anything published while we were disconnected
+                        headers["Last-Event-ID"] = self.last_event_id
+
+                    async with client.stream("GET", url, params=params, headers=headers) as response:
                         async for line in response.aiter_lines():
                             if not self.running:
                                 break
 
-                            if line.startswith("data:"):
+                            if line.startswith("id:"):
+                                self.last_event_id = line[3:].strip()
+
+                            elif line.startswith("data:"):
                                 try:
                                     event = json.loads(line[5:])
                                     alert = await self.handle_event(event)
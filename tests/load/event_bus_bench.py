@@ -0,0 +1,443 @@
+#!/usr/bin/env python3
+"""
+Event Bus Offline Benchmark
+
+Starts control-plane/event-bus/event_bus.py against a throwaway database
+and measures, without touching any live deployment:
+
+- publish throughput (POST /events and POST /events/batch)
+- subscription-match cost as the number of patterns grows
+- per-agent inbox query latency as the events table grows (10k to 10M rows)
+- SSE fan-out delay from publish to delivery on /events/stream
+
+Results are printed as markdown tables in the benchmarks.md format and
+saved to reports/event_bus_bench_<timestamp>.md.
+
+Usage:
+    python event_bus_bench.py
+    python event_bus_bench.py --sizes 10000,100000,1000000,10000000
+    python event_bus_bench.py --publish 20000 --concurrency 50 --partitions 4
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import sqlite3
+import string
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import httpx
+
+REPO_ROOT = Path(__file__).resolve().parents[2]
+EVENT_BUS_DIR = REPO_ROOT / "control-plane" / "event-bus"
+SCHEMA_PATH = EVENT_BUS_DIR / "event-bus-schema.sql"
+REPORTS_DIR = Path(__file__).resolve().parent / "reports"
+
+BENCH_AGENTS = 10  # Inbox owners BENCH-AGENT-0..9 used by the table-size benchmark
+
+
+# =============================================================================
+# Helpers
+# =============================================================================
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def summarize(name: str, latencies: List[float], failures: int, elapsed: float) -> Dict:
+    """One Request Statistics row; latencies in the row's unit"""
+    values = sorted(latencies)
+    total = len(values) + failures
+    return {
+        "name": name,
+        "requests": total,
+        "failures": failures,
+        "median": percentile(values, 50),
+        "avg": sum(values) / len(values) if values else 0.0,
+        "p95": percentile(values, 95),
+        "p99": percentile(values, 99),
+        "rps": total / elapsed if elapsed > 0 else 0.0,
+    }
+
+
+def format_table(rows: List[Dict], unit: str = "ms") -> str:
+    lines = [
+        f"| Endpoint | Requests | Failures | Median ({unit}) | Avg ({unit}) | P95 ({unit}) | P99 ({unit}) | RPS |",
+        "|----------|----------|----------|-------------|----------|----------|----------|-----|",
+    ]
+    for r in rows:
+        lines.append(
+            f"| {r['name']} | {r['requests']:,} | {r['failures']} | {r['median']:.2f} | "
+            f"{r['avg']:.2f} | {r['p95']:.2f} | {r['p99']:.2f} | {r['rps']:,.0f} |"
+        )
+    return "\n".join(lines)
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_event_bus(db_path: Path, port: int, partitions: int) -> subprocess.Popen:
+    """Create a fresh schema and launch the event bus on it"""
+    conn = sqlite3.connect(db_path)
+    conn.executescript(SCHEMA_PATH.read_text())
+    conn.commit()
+    conn.close()
+
+    env = {
+        **os.environ,
+        "EVENT_BUS_DB_PATH": str(db_path),
+        "EVENT_BUS_PARTITIONS": str(partitions),
+        "EVENT_BUS_RETENTION_ENABLED": "false",
+    }
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "event_bus:app",
+         "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=EVENT_BUS_DIR, env=env
+    )
+
+
+async def wait_healthy(client: httpx.AsyncClient, timeout: float = 20.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if (await client.get("/health")).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError("Event bus did not become healthy")
+
+
+def random_event(action: Optional[str] = None) -> Dict:
+    return {
+        "source_agent": random.choice(["ATLAS", "HEPHAESTUS", "AEGIS", "CHRONOS", "ARGUS", "ALOY"]),
+        "action": action or random.choice([
+            "workflow_created", "deploy_started", "deploy_failed", "health_check_completed",
+            "credential_rotated", "backup_completed", "config_changed", "api_request",
+        ]),
+        "target": "bench",
+        "details": {"n": random.randint(0, 1_000_000)},
+    }
+
+
+# =============================================================================
+# Benchmarks
+# =============================================================================
+
+async def bench_publish(client: httpx.AsyncClient, total: int, concurrency: int) -> Dict:
+    latencies: List[float] = []
+    failures = 0
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def publish():
+        nonlocal failures
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                response = await client.post("/events", json=random_event())
+                if response.status_code != 200:
+                    failures += 1
+                    return
+            except httpx.HTTPError:
+                failures += 1
+                return
+            latencies.append((time.perf_counter() - started) * 1000)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(publish() for _ in range(total)))
+    return summarize("/events [publish]", latencies, failures, time.perf_counter() - started)
+
+
+async def bench_publish_batch(client: httpx.AsyncClient, total: int, batch_size: int,
+                              concurrency: int) -> Dict:
+    latencies: List[float] = []
+    failures = 0
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def publish():
+        nonlocal failures
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                response = await client.post("/events/batch", json=[random_event() for _ in range(batch_size)])
+                if response.status_code != 200:
+                    failures += 1
+                    return
+            except httpx.HTTPError:
+                failures += 1
+                return
+            latencies.append((time.perf_counter() - started) * 1000)
+
+    batches = max(1, total // batch_size)
+    started = time.perf_counter()
+    await asyncio.gather(*(publish() for _ in range(batches)))
+    row = summarize(f"/events/batch [{batch_size}/req]", latencies, failures, time.perf_counter() - started)
+    row["events_per_second"] = row["rps"] * batch_size
+    return row
+
+
+def bench_matching(pattern_counts: List[int], lookups: int) -> List[Dict]:
+    """Uncached match() cost per action as the subscription table grows (µs)"""
+    sys.path.insert(0, str(EVENT_BUS_DIR))
+    from subscriptions import SubscriptionMatcher
+
+    rng = random.Random(7)
+
+    def word(n=6):
+        return "".join(rng.choices(string.ascii_lowercase, k=n))
+
+    rows = []
+    for count in pattern_counts:
+        subscriptions = []
+        for i in range(count):
+            roll = rng.random()
+            if roll < 0.5:
+                pattern = f"{word()}_{word()}"
+            elif roll < 0.75:
+                pattern = f"{word()}_*"
+            elif roll < 0.98:
+                pattern = f"*_{word()}"
+            else:
+                pattern = f"{word(3)}_*_{word(3)}"
+            subscriptions.append((f"AGENT-{i % 200}", pattern, rng.randint(1, 10)))
+        actions = [f"{word()}_{word()}" for _ in range(lookups)]
+
+        matcher = SubscriptionMatcher(subscriptions)
+        latencies = []
+        started = time.perf_counter()
+        for action in actions:
+            t = time.perf_counter_ns()
+            matcher.match(action)
+            latencies.append((time.perf_counter_ns() - t) / 1000)
+        rows.append(summarize(f"match [{count:,} patterns]", latencies, 0, time.perf_counter() - started))
+    return rows
+
+
+def grow_events(db_path: Path, target_rows: int, chunk: int = 500_000):
+    """Bulk-insert synthetic events (and their deliveries) until the table has target_rows"""
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=OFF")
+    current = conn.execute("SELECT COUNT(*) FROM events").fetchone()[0]
+
+    while current < target_rows:
+        first = conn.execute("SELECT COALESCE(MAX(rowid), 0) + 1 FROM events").fetchone()[0]
+        last = first + min(chunk, target_rows - current) - 1
+        conn.execute("BEGIN")
+        conn.execute(f"""
+            WITH RECURSIVE seq(n) AS (SELECT ? UNION ALL SELECT n + 1 FROM seq WHERE n < ?)
+            INSERT INTO events (rowid, id, timestamp, source_agent, action, target,
+                                subscribed_agents, acknowledged_by, status, created_at, updated_at)
+            SELECT n, lower(hex(randomblob(16))), datetime('now'), 'BENCH-' || (n % 20),
+                   'bench_' || (n % 50), 'bench',
+                   json_array('BENCH-AGENT-' || (n % {BENCH_AGENTS})), '{{}}', 'pending',
+                   datetime('now'), datetime('now')
+            FROM seq
+        """, (first, last))
+        # 1% of deliveries left pending, the rest acknowledged
+        conn.execute(f"""
+            INSERT INTO event_deliveries (event_id, agent, event_seq, status)
+            SELECT id, 'BENCH-AGENT-' || (rowid % {BENCH_AGENTS}), rowid,
+                   CASE WHEN rowid % 100 = 0 THEN 'pending' ELSE 'acknowledged' END
+            FROM events WHERE rowid BETWEEN ? AND ?
+        """, (first, last))
+        conn.execute("COMMIT")
+        current += last - first + 1
+
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    conn.close()
+
+
+async def bench_reads(client: httpx.AsyncClient, size: int, requests: int) -> List[Dict]:
+    agent = "BENCH-AGENT-3"
+    targets = [
+        ("/agents/{agent}/events", f"/agents/{agent}/events", {"limit": 20}),
+        ("/agents/{agent}/events [unacked]", f"/agents/{agent}/events", {"limit": 20, "unacknowledged_only": True}),
+        ("/events/pending/{agent} [peek]", f"/events/pending/{agent}", {"limit": 100, "visibility_timeout": 0}),
+        ("/events [list]", "/events", {"limit": 50}),
+    ]
+
+    rows = []
+    for label, path, params in targets:
+        latencies, failures = [], 0
+        started = time.perf_counter()
+        for _ in range(requests):
+            t = time.perf_counter()
+            response = await client.get(path, params=params)
+            if response.status_code != 200:
+                failures += 1
+                continue
+            latencies.append((time.perf_counter() - t) * 1000)
+        rows.append(summarize(f"{label} [{size:,} rows]", latencies, failures, time.perf_counter() - started))
+    return rows
+
+
+async def bench_fanout(base_url: str, client: httpx.AsyncClient, subscribers: int, events: int) -> Dict:
+    """Publish-to-delivery delay across concurrent /events/stream subscribers"""
+    delays: List[float] = []
+    connected = asyncio.Event()
+    ready = 0
+
+    async def subscriber():
+        nonlocal ready
+        received = 0
+        timeout = httpx.Timeout(10.0, read=None)
+        async with httpx.AsyncClient(base_url=base_url, timeout=timeout) as stream_client:
+            async with stream_client.stream("GET", "/events/stream", params={"action": "bench_fanout"}) as response:
+                async for line in response.aiter_lines():
+                    if line.startswith(": connected"):
+                        ready += 1
+                        if ready == subscribers:
+                            connected.set()
+                    elif line.startswith("data:"):
+                        event = json.loads(line[5:])
+                        delays.append((time.time() - event["details"]["sent_at"]) * 1000)
+                        received += 1
+                        if received == events:
+                            return
+
+    tasks = [asyncio.create_task(subscriber()) for _ in range(subscribers)]
+    await asyncio.wait_for(connected.wait(), timeout=30)
+
+    started = time.perf_counter()
+    for _ in range(events):
+        await client.post("/events", json={
+            "source_agent": "BENCH", "action": "bench_fanout",
+            "details": {"sent_at": time.time()}
+        })
+        await asyncio.sleep(0.01)
+
+    done, pending = await asyncio.wait(tasks, timeout=30)
+    for task in pending:
+        task.cancel()
+    elapsed = time.perf_counter() - started
+
+    missed = subscribers * events - len(delays)
+    return summarize(f"/events/stream [{subscribers} subscribers]", delays, missed, elapsed)
+
+
+# =============================================================================
+# Report
+# =============================================================================
+
+def render_report(args, publish_rows, match_rows, read_rows, fanout_row) -> str:
+    date = datetime.now().strftime("%Y-%m-%d")
+    single = publish_rows[0]
+    batch = publish_rows[1]
+    fail_pct = 100 * single["failures"] / single["requests"] if single["requests"] else 0.0
+
+    return "\n".join([
+        "## Benchmark Summary",
+        "",
+        "| Date | Profile | Users | RPS | Avg (ms) | P95 (ms) | P99 (ms) | Fail % | Notes |",
+        "|------|---------|-------|-----|----------|----------|----------|--------|-------|",
+        f"| {date} | event-bus-bench | {args.concurrency} | {single['rps']:,.0f} | {single['avg']:.2f} | "
+        f"{single['p95']:.2f} | {single['p99']:.2f} | {fail_pct:.2f} | offline, "
+        f"{args.partitions} partition(s), batch {batch['events_per_second']:,.0f} events/s |",
+        "",
+        f"### Benchmark: {date} - Event bus offline benchmark",
+        "",
+        "**Test Configuration:**",
+        "- Profile: `custom` (event_bus_bench.py)",
+        f"- Users: {args.concurrency} concurrent publishers",
+        f"- Events: {args.publish:,} single publishes, {args.publish:,} batched ({args.batch_size}/request)",
+        f"- Partitions: {args.partitions}",
+        "- Host: local uvicorn on a temporary database",
+        "",
+        "#### Request Statistics",
+        "",
+        format_table(publish_rows + [fanout_row]),
+        "",
+        "#### Subscription Matching (uncached, per action)",
+        "",
+        format_table(match_rows, unit="µs"),
+        "",
+        "#### Inbox and Listing Latency vs Table Size",
+        "",
+        format_table(read_rows),
+        "",
+    ])
+
+
+async def run(args):
+    random.seed(args.seed)
+    workdir = Path(tempfile.mkdtemp(prefix="event-bus-bench-"))
+    db_path = workdir / "events.db"
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+
+    process = start_event_bus(db_path, port, args.partitions)
+    try:
+        limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+        async with httpx.AsyncClient(base_url=base_url, timeout=30.0, limits=limits) as client:
+            await wait_healthy(client)
+
+            print("Publishing...", file=sys.stderr)
+            publish_rows = [
+                await bench_publish(client, args.publish, args.concurrency),
+                await bench_publish_batch(client, args.publish, args.batch_size, max(1, args.concurrency // 10)),
+            ]
+
+            print("Measuring SSE fan-out...", file=sys.stderr)
+            fanout_row = await bench_fanout(base_url, client, args.subscribers, args.fanout_events)
+
+            print("Matching...", file=sys.stderr)
+            match_rows = bench_matching(args.pattern_counts, args.match_lookups)
+
+            read_rows = []
+            for size in args.sizes:
+                print(f"Growing events table to {size:,} rows...", file=sys.stderr)
+                grow_events(db_path, size)
+                read_rows.extend(await bench_reads(client, size, args.read_requests))
+    finally:
+        process.terminate()
+        process.wait(timeout=10)
+
+    report = render_report(args, publish_rows, match_rows, read_rows, fanout_row)
+    print(report)
+
+    output = Path(args.output) if args.output else REPORTS_DIR / f"event_bus_bench_{datetime.now():%Y%m%d_%H%M%S}.md"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(report)
+    print(f"Report written to {output}", file=sys.stderr)
+
+
+def parse_counts(value: str) -> List[int]:
+    return [int(v.replace("_", "")) for v in value.split(",") if v.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline event bus benchmark")
+    parser.add_argument("--publish", type=int, default=5000, help="Events for each publish benchmark")
+    parser.add_argument("--concurrency", type=int, default=20, help="Concurrent publishers")
+    parser.add_argument("--batch-size", type=int, default=100, help="Events per /events/batch request")
+    parser.add_argument("--partitions", type=int, default=1, help="EVENT_BUS_PARTITIONS for the bus under test")
+    parser.add_argument("--pattern-counts", type=parse_counts, default=[10, 100, 1000, 10000])
+    parser.add_argument("--match-lookups", type=int, default=5000, help="Distinct actions matched per pattern count")
+    parser.add_argument("--sizes", type=parse_counts, default=[10_000, 100_000, 1_000_000],
+                        help="Events table sizes for inbox latency (add 10000000 for the full run)")
+    parser.add_argument("--read-requests", type=int, default=200, help="Requests per read endpoint per size")
+    parser.add_argument("--subscribers", type=int, default=50, help="Concurrent SSE subscribers")
+    parser.add_argument("--fanout-events", type=int, default=100, help="Events published during fan-out")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="Report path (default: reports/event_bus_bench_<timestamp>.md)")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
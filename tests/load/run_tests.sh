@@ -11,6 +11,7 @@
 #   medium  - 50 users, moderate load
 #   heavy   - 200 users, stress test
 #   custom  - Use custom options
+#   event-bus-bench - Offline event bus benchmark (no live services needed)
 #
 # Examples:
 #   ./run_tests.sh light
@@ -193,9 +194,16 @@ run_with_profile() {
                 $extra_args
             ;;
 
+        event-bus-bench)
+            echo -e "${GREEN}Running offline Event Bus benchmark${NC}"
+            python3 event_bus_bench.py \
+                --output "reports/event_bus_bench_${TIMESTAMP}.md" \
+                $extra_args 2>&1 | tee "logs/event_bus_bench_${TIMESTAMP}.log"
+            ;;
+
         *)
             echo -e "${RED}Unknown profile: $profile${NC}"
-            echo "Available profiles: light, medium, heavy, custom, web, health-only, event-bus-only, chat-only, stress"
+            echo "Available profiles: light, medium, heavy, custom, web, health-only, event-bus-only, chat-only, stress, event-bus-bench"
             exit 1
             ;;
     esac
@@ -217,6 +225,7 @@ show_help() {
     echo "  event-bus-only Run only Event Bus tests"
     echo "  chat-only      Run only ARIA chat tests"
     echo "  stress         Maximum throughput stress test"
+    echo "  event-bus-bench Offline Event Bus benchmark (starts its own event bus)"
     echo ""
     echo "Options (pass to Locust):"
     echo "  --users N      Number of concurrent users"
@@ -244,7 +253,11 @@ main() {
     esac
 
     print_banner
-    check_prerequisites
+
+    # The offline benchmark starts its own event bus; no Locust or live host needed
+    if [ "$PROFILE" != "event-bus-bench" ]; then
+        check_prerequisites
+    fi
 
     # Shift to get extra args
     shift 2>/dev/null || true
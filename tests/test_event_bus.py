@@ -4,8 +4,15 @@ Event Bus Tests.
 Tests for the Event Bus (port 8099) - the inter-agent communication system.
 """
 
+import asyncio
+import importlib
+import json
+import sqlite3
+import sys
 import time
 import uuid
+from pathlib import Path
+from types import SimpleNamespace
 
 import httpx
 import pytest
@@ -184,6 +191,41 @@ class TestEventBusPublish:
             pytest.skip("Event Bus not available")
 
 
+    @pytest.mark.integration
+    @pytest.mark.core
+    async def test_publish_batch(
+        self,
+        async_client: httpx.AsyncClient,
+        base_url: str,
+    ):
+        """Test publishing an array of events in one request."""
+        url = f"{base_url}:{EVENT_BUS_PORT}/events/batch"
+
+        events = [
+            {
+                "source_agent": "INTEGRATION-TESTS",
+                "action": f"test_batch_{i % 3}",
+                "details": {"sequence": i}
+            }
+            for i in range(25)
+        ]
+
+        try:
+            response = await async_client.post(url, json=events, timeout=5.0)
+            if response.status_code == 404:
+                pytest.skip("Batch publish endpoint not available")
+
+            assert response.status_code == 200, (
+                f"Batch publish failed with status {response.status_code}: {response.text}"
+            )
+            data = response.json()
+            assert data["count"] == len(events)
+            assert len(set(data["ids"])) == len(events), "Batch ids must be unique"
+
+        except httpx.ConnectError:
+            pytest.skip("Event Bus not available")
+
+
 # =============================================================================
 # SUBSCRIBE TESTS
 # =============================================================================
@@ -306,6 +348,87 @@ class TestEventBusRetrieval:
         except httpx.ConnectError:
             pytest.skip("Event Bus not available")
 
+    @pytest.mark.integration
+    @pytest.mark.core
+    async def test_events_keyset_pagination(
+        self,
+        async_client: httpx.AsyncClient,
+        base_url: str,
+    ):
+        """Test paging through events with next_cursor and a field projection."""
+        url = f"{base_url}:{EVENT_BUS_PORT}/events"
+
+        try:
+            first = await async_client.get(
+                url,
+                params={"limit": 2, "fields": "action,timestamp"},
+                timeout=5.0
+            )
+            if first.status_code != 200:
+                pytest.skip("Event listing not available")
+
+            data = first.json()
+            for event in data["events"]:
+                assert set(event) <= {"action", "timestamp"}, f"Unexpected fields: {event}"
+
+            if not data.get("next_cursor"):
+                pytest.skip("Not enough events to page")
+
+            second = await async_client.get(
+                url,
+                params={"limit": 2, "fields": "action,timestamp", "before_id": data["next_cursor"]},
+                timeout=5.0
+            )
+            assert second.status_code == 200
+            assert all(
+                e["timestamp"] <= data["events"][-1]["timestamp"]
+                for e in second.json()["events"]
+            ), "Next page must not contain newer events"
+
+        except httpx.ConnectError:
+            pytest.skip("Event Bus not available")
+
+    @pytest.mark.integration
+    @pytest.mark.core
+    @pytest.mark.asyncio
+    async def test_retention_and_archive_query(
+        self,
+        async_client: httpx.AsyncClient,
+        base_url: str,
+    ):
+        """Test retention status and that archived events can be queried."""
+        try:
+            response = await async_client.get(
+                f"{base_url}:{EVENT_BUS_PORT}/retention",
+                timeout=5.0
+            )
+            if response.status_code == 404:
+                pytest.skip("Retention endpoint not available")
+
+            data = response.json()
+            assert "*" in data["policies"], "Retention must define a default TTL"
+            assert "hot_events" in data and "cold_events" in data
+
+            archive = await async_client.get(
+                f"{base_url}:{EVENT_BUS_PORT}/events/archive",
+                params={"limit": 5},
+                timeout=10.0
+            )
+            assert archive.status_code == 200
+            assert archive.json()["count"] <= 5
+
+            merged = await async_client.get(
+                f"{base_url}:{EVENT_BUS_PORT}/events",
+                params={"limit": 5, "include_archived": "true"},
+                timeout=10.0
+            )
+            assert merged.status_code == 200
+            timestamps = [e["timestamp"] for e in merged.json()["events"]]
+            assert timestamps == sorted(timestamps, reverse=True), "Merged page must stay newest first"
+
+        except httpx.ConnectError:
+            pytest.skip("Event Bus not available")
+
     @pytest.mark.integration
     @pytest.mark.core
     async def test_filter_events_by_source(
@@ -394,6 +517,387 @@ class TestEventBusDelivery:
             pytest.skip("Event Bus not available")
 
 
+    @pytest.mark.integration
+    @pytest.mark.core
+    async def test_agent_inbox_acknowledge(
+        self,
+        async_client: httpx.AsyncClient,
+        base_url: str,
+    ):
+        """Test an acknowledged event leaves the agent's unacknowledged inbox."""
+        bus_url = f"{base_url}:{EVENT_BUS_PORT}"
+
+        try:
+            pub_response = await async_client.post(
+                f"{bus_url}/events",
+                json={"source_agent": "INTEGRATION-TESTS", "action": "test_inbox_failed"},
+                timeout=5.0
+            )
+            if pub_response.status_code != 200:
+                pytest.skip("Could not publish event")
+
+            event_id = pub_response.json()["id"]
+            agent = "HADES"  # Subscribed to *_failed by default
+
+            inbox = await async_client.get(
+                f"{bus_url}/agents/{agent}/events",
+                params={"unacknowledged_only": True, "limit": 50},
+                timeout=5.0
+            )
+            assert event_id in [e["id"] for e in inbox.json()["events"]]
+
+            await async_client.post(
+                f"{bus_url}/events/{event_id}/acknowledge",
+                params={"agent": agent},
+                timeout=5.0
+            )
+
+            inbox = await async_client.get(
+                f"{bus_url}/agents/{agent}/events",
+                params={"unacknowledged_only": True, "limit": 50},
+                timeout=5.0
+            )
+            assert event_id not in [e["id"] for e in inbox.json()["events"]]
+
+        except httpx.ConnectError:
+            pytest.skip("Event Bus not available")
+
+    @pytest.mark.integration
+    @pytest.mark.core
+    @pytest.mark.asyncio
+    async def test_pending_lease_and_ack(
+        self,
+        async_client: httpx.AsyncClient,
+        base_url: str,
+    ):
+        """Test leased pending events are hidden until acked or the lease expires."""
+        bus_url = f"{base_url}:{EVENT_BUS_PORT}"
+        agent = "INTEGRATION-CONSUMER"
+
+        try:
+            sub_response = await async_client.post(
+                f"{bus_url}/subscriptions",
+                json={"agent_name": agent, "action_pattern": "test_consumer_*"},
+                timeout=5.0
+            )
+            if sub_response.status_code != 200:
+                pytest.skip("Subscription endpoint not available")
+            subscription_id = sub_response.json()["id"]
+
+            try:
+                await async_client.post(
+                    f"{bus_url}/events",
+                    json={"source_agent": "INTEGRATION-TESTS", "action": "test_consumer_event"},
+                    timeout=5.0
+                )
+
+                first = await async_client.get(
+                    f"{bus_url}/events/pending/{agent}",
+                    params={"limit": 1000, "visibility_timeout": 30},
+                    timeout=5.0
+                )
+                assert first.status_code == 200
+                leased = first.json()
+                assert isinstance(leased, list) and leased, "Expected at least one pending event"
+
+                second = await async_client.get(
+                    f"{bus_url}/events/pending/{agent}",
+                    params={"limit": 1000, "visibility_timeout": 30},
+                    timeout=5.0
+                )
+                assert not {e["id"] for e in leased} & {e["id"] for e in second.json()}, \
+                    "Leased events must not be redelivered before the timeout"
+
+                ack = await async_client.post(
+                    f"{bus_url}/events/ack",
+                    json={"subscriber": agent, "event_ids": [e["id"] for e in leased]},
+                    timeout=5.0
+                )
+                assert ack.json()["acked"] == len(leased)
+
+                consumer = (await async_client.get(f"{bus_url}/consumers/{agent}", timeout=5.0)).json()
+                assert consumer["pending"] == 0
+                assert consumer["committed_seq"] == consumer["head_seq"]
+            finally:
+                await async_client.delete(f"{bus_url}/subscriptions/{subscription_id}", timeout=5.0)
+
+        except httpx.ConnectError:
+            pytest.skip("Event Bus not available")
+
+
+# =============================================================================
+# IN-PROCESS TESTS
+# =============================================================================
+
+EVENT_BUS_DIR = Path(__file__).parent.parent / "control-plane" / "event-bus"
+
+
+@pytest.fixture
+def local_bus(tmp_path, monkeypatch):
+    """The event bus module running on a throwaway database (no server needed)."""
+    pytest.importorskip("fastapi")
+    db_path = tmp_path / "events.db"
+    with sqlite3.connect(db_path) as conn:
+        conn.executescript((EVENT_BUS_DIR / "event-bus-schema.sql").read_text())
+
+    monkeypatch.setenv("EVENT_BUS_DB_PATH", str(db_path))
+    monkeypatch.setenv("EVENT_BUS_RETENTION_ENABLED", "false")
+    monkeypatch.setenv("EVENT_BUS_RETENTION_POLICIES", json.dumps({"test_restart_*": -1}))
+    monkeypatch.syspath_prepend(str(EVENT_BUS_DIR))
+    for name in ("event_bus", "partitions", "store", "retention", "consumers", "subscriptions"):
+        sys.modules.pop(name, None)
+    module = importlib.import_module("event_bus")
+    yield module
+    sys.modules.pop("event_bus", None)
+
+
+class TestEventBusRestart:
+    """Test state that has to survive a restart of the bus."""
+
+    @pytest.mark.core
+    def test_seqs_not_reused_after_retention(self, local_bus):
+        """Test events published after retention archived the newest rows stay pending."""
+        from fastapi.testclient import TestClient
+
+        agent = "RESTART-CONSUMER"
+        with TestClient(local_bus.app) as client:
+            client.post("/subscriptions", json={"agent_name": agent, "action_pattern": "test_restart_*"})
+            for _ in range(3):
+                client.post("/events", json={"source_agent": "INTEGRATION-TESTS", "action": "test_restart_event"})
+            leased = client.get(f"/events/pending/{agent}").json()
+            client.post("/events/ack", json={"subscriber": agent, "event_ids": [e["id"] for e in leased]})
+            assert client.post("/retention/run").json()["archived"] == 3
+            committed = client.get(f"/consumers/{agent}").json()["committed_seq"]
+
+        with TestClient(local_bus.app) as client:
+            created = client.post(
+                "/events", json={"source_agent": "INTEGRATION-TESTS", "action": "test_restart_event"}
+            ).json()
+            pending = client.get(f"/events/pending/{agent}").json()
+            assert [e["id"] for e in pending] == [created["id"]], \
+                "Events published after a restart must not reuse archived or committed seqs"
+            assert pending[0]["seq"] > committed
+
+
+class TestEventBusHealthSizes:
+    """Test /health stays cheap as the event log grows."""
+
+    @pytest.mark.core
+    def test_health_reports_sizes_from_last_retention_pass(self, local_bus):
+        """Test /health reuses the counts from the last retention pass instead of counting rows."""
+        from fastapi.testclient import TestClient
+
+        with TestClient(local_bus.app) as client:
+            assert "hot_events" not in client.get("/health").json()["retention"]
+            client.post("/events", json={"source_agent": "INTEGRATION-TESTS", "action": "test_health_event"})
+            client.post("/retention/run")
+            client.post("/events", json={"source_agent": "INTEGRATION-TESTS", "action": "test_health_event"})
+
+            retention = client.get("/health").json()["retention"]
+            assert retention["hot_events"] == 1, "Counted at the retention pass, not per probe"
+            assert retention["last_run"]["archived"] == 0
+            assert client.get("/retention").json()["hot_events"] == 2
+
+
+class TestEventBusCursors:
+    """Test pagination cursors on the in-process bus."""
+
+    @pytest.mark.core
+    @pytest.mark.parametrize("before_id", ["2026-01-01T00:00:00|abc", "2026-01-01T00:00:00|"])
+    def test_malformed_cursor_is_rejected(self, local_bus, before_id):
+        """Test a timestamp|seq cursor with a non-numeric seq is a 400, not a 500."""
+        from fastapi.testclient import TestClient
+
+        with TestClient(local_bus.app) as client:
+            response = client.get("/events", params={"before_id": before_id})
+            assert response.status_code == 400
+            assert response.json()["detail"] == "Invalid cursor"
+
+
+class TestEventBusStreamReplay:
+    """Test the hand-over from Last-Event-ID replay to live events."""
+
+    @pytest.mark.core
+    def test_late_commit_below_cursor_is_delivered(self, local_bus):
+        """Test only replayed events are skipped live, not every event with a lower seq."""
+        from fastapi.testclient import TestClient
+
+        async def read_stream(last_event_id):
+            request = SimpleNamespace(is_disconnected=lambda: asyncio.sleep(0, result=False))
+            response = await local_bus.stream_events(
+                request, agent=None, action=None, source_agent=None, last_event_id=last_event_id
+            )
+            frames = response.body_iterator
+            replayed = await frames.__anext__()
+            assert await frames.__anext__() == ": connected\n\n"
+
+            subscriber = next(iter(local_bus.broadcaster.subscribers))
+            replayed_event = json.loads(replayed.split("data: ", 1)[1])
+            # A partition that flushed late, after the replay read past its seq
+            late_event = {**replayed_event, "id": "late-commit", "seq": replayed_event["seq"] - 1}
+            subscriber.queue.put_nowait(replayed_event)
+            subscriber.queue.put_nowait(late_event)
+            live = await frames.__anext__()
+            await frames.aclose()
+            return replayed_event, json.loads(live.split("data: ", 1)[1])
+
+        with TestClient(local_bus.app) as client:
+            for _ in range(2):
+                client.post("/events", json={"source_agent": "INTEGRATION-TESTS", "action": "test_stream"})
+            second, first = client.get("/events", params={"limit": 2}).json()["events"]
+            replayed, live = client.portal.call(read_stream, str(first["seq"]))
+
+        assert replayed["id"] == second["id"]
+        assert live["id"] == "late-commit", "The replayed event was sent twice or the late one dropped"
+
+
+@pytest.fixture
+def subscriptions(monkeypatch):
+    """The subscription matcher module, without the rest of the bus."""
+    monkeypatch.syspath_prepend(str(EVENT_BUS_DIR))
+    return importlib.import_module("subscriptions")
+
+
+class TestSubscriptionMatcher:
+    """Test in-memory routing keeps the SQL LIKE semantics it replaced."""
+
+    @pytest.mark.core
+    def test_exact_patterns_are_case_sensitive(self, subscriptions):
+        """Test patterns without '*' compare with '=', so case and '_' are literal."""
+        matcher = subscriptions.SubscriptionMatcher([("CHRONOS", "config_changed", 5)])
+        assert matcher.match("config_changed") == ["CHRONOS"]
+        assert matcher.match("Config_Changed") == []
+        assert matcher.match("configXchanged") == []
+
+    @pytest.mark.core
+    def test_prefix_and_suffix(self, subscriptions):
+        """Test trailing and leading wildcards match case-insensitively with '_' as any character."""
+        matcher = subscriptions.SubscriptionMatcher([
+            ("HERMES", "credential_*", 5),
+            ("PANOPTES", "*_failed", 3),
+        ])
+        assert matcher.match("credential_rotated") == ["HERMES"]
+        assert matcher.match("CREDENTIAL_ROTATED") == ["HERMES"]
+        assert matcher.match("credential-rotated") == ["HERMES"], "LIKE '_' matches any character"
+        assert matcher.match("credentials") == ["HERMES"]
+        assert matcher.match("credential") == []
+        assert matcher.match("credential_build_failed") == ["PANOPTES", "HERMES"]
+        assert matcher.match("deploy.FAILED") == ["PANOPTES"]
+
+    @pytest.mark.core
+    def test_like_fallback_and_catch_all(self, subscriptions):
+        """Test middle wildcards use the LIKE regex, '?' stays literal and '*' matches everything."""
+        matcher = subscriptions.SubscriptionMatcher([
+            ("CHRONOS", "deadline_*_due", 5),
+            ("ARIA", "*build?*", 5),
+            ("ARGUS", "*", 9),
+        ])
+        assert matcher.match("Deadline_invoice_DUE") == ["CHRONOS", "ARGUS"]
+        assert matcher.match("deadline_due") == ["ARGUS"]
+        assert matcher.match("nightly_build?_done") == ["ARIA", "ARGUS"]
+        assert matcher.match("nightly_builds") == ["ARGUS"]
+        assert matcher.stats()["like_patterns"] == 2
+
+    @pytest.mark.core
+    def test_parity_with_sql_routing(self, subscriptions):
+        """Test the matcher routes like the SQL query it replaced, for patterns that query matched."""
+        patterns = ["config_changed", "*", "credential_*", "*_failed", "*BUILD*", "a%b*", "x_?*", "deploy"]
+        actions = ["config_changed", "CONFIG_CHANGED", "credential_rotated", "Credentialx", "credential",
+                   "job_failed", "FAILED", "nightly_build", "aXYZb_end", "xy?z", "xy", "deploy", "Deploy"]
+        conn = sqlite3.connect(":memory:")
+        conn.execute("CREATE TABLE subs (agent TEXT, pattern TEXT)")
+        conn.executemany("INSERT INTO subs VALUES (?, ?)", [(f"A{i}", p) for i, p in enumerate(patterns)])
+        matcher = subscriptions.SubscriptionMatcher((f"A{i}", p, 5) for i, p in enumerate(patterns))
+        for action in actions:
+            expected = {row[0] for row in conn.execute("""
+                SELECT agent FROM subs
+                WHERE pattern = ? OR pattern = '*'
+                OR (pattern LIKE '%*' AND ? LIKE REPLACE(pattern, '*', '%'))
+                OR (pattern LIKE '*%' AND ? LIKE REPLACE(pattern, '*', '%'))
+            """, (action, action, action))}
+            assert set(matcher.match(action)) == expected, action
+
+    @pytest.mark.core
+    def test_lowest_priority_value_wins(self, subscriptions):
+        matcher = subscriptions.SubscriptionMatcher([
+            ("ARIA", "task_*", 7), ("ARIA", "task_done", 2), ("HERMES", "*", 5),
+        ])
+        assert matcher.match("task_done") == ["ARIA", "HERMES"]
+        assert matcher.match("task_started") == ["HERMES", "ARIA"]
+
+    @pytest.mark.core
+    def test_matches_are_rebuilt_on_subscribe_and_unsubscribe(self, local_bus):
+        """Test a cached match is replaced when the subscription set changes."""
+        from fastapi.testclient import TestClient
+
+        def routed(client):
+            return client.get("/subscriptions/match", params={"action": "test_matcher_event"}).json()
+
+        with TestClient(local_bus.app) as client:
+            assert "MATCHER-TEST" not in routed(client)["subscribed_agents"]
+            created = client.post(
+                "/subscriptions", json={"agent_name": "MATCHER-TEST", "action_pattern": "TEST_MATCHER_*"}
+            ).json()
+            assert "MATCHER-TEST" in routed(client)["subscribed_agents"]
+            client.delete(f"/subscriptions/{created['id']}")
+            assert "MATCHER-TEST" not in routed(client)["subscribed_agents"]
+
+
+# =============================================================================
+# STREAMING TESTS
+# =============================================================================
+
+class TestEventBusStream:
+    """Test Event Bus server-sent event stream."""
+
+    @pytest.mark.integration
+    @pytest.mark.core
+    @pytest.mark.slow
+    async def test_stream_receives_published_event(
+        self,
+        async_client: httpx.AsyncClient,
+        base_url: str,
+    ):
+        """Test a streaming subscriber is pushed a newly published event."""
+        import asyncio
+        import json
+
+        stream_url = f"{base_url}:{EVENT_BUS_PORT}/events/stream"
+        publish_url = f"{base_url}:{EVENT_BUS_PORT}/events"
+        unique_id = str(uuid.uuid4())
+
+        async def read_until_match():
+            async with async_client.stream(
+                "GET", stream_url, params={"action": "test_stream_*"}, timeout=10.0
+            ) as response:
+                assert response.status_code == 200
+                async for line in response.aiter_lines():
+                    if line.startswith("data:"):
+                        event = json.loads(line[5:])
+                        if (event.get("details") or {}).get("unique_id") == unique_id:
+                            return event
+
+        try:
+            reader = asyncio.create_task(read_until_match())
+            await asyncio.sleep(0.2)
+            await async_client.post(
+                publish_url,
+                json={
+                    "source_agent": "INTEGRATION-TESTS",
+                    "action": "test_stream_event",
+                    "details": {"unique_id": unique_id},
+                },
+                timeout=5.0,
+            )
+
+            event = await asyncio.wait_for(reader, timeout=5.0)
+            assert event["action"] == "test_stream_event"
+            assert "seq" in event, "Stream events must carry a resume cursor"
+
+        except httpx.ConnectError:
+            pytest.skip("Event Bus not available")
+
+
 # =============================================================================
 # ERROR HANDLING TESTS
 # =============================================================================
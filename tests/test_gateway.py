@@ -0,0 +1,1114 @@
+"""
+API Gateway Tests.
+
+In-process tests for the API gateway (port 8070) modules: limiter
+backends, response cache, request coalescing, fair queueing, token
+estimation, provider resilience, the batch lane and metrics. No running
+gateway or provider keys are needed.
+"""
+
+import asyncio
+import json
+import math
+import sqlite3
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+from types import SimpleNamespace
+
+import httpx
+import pytest
+
+
+GATEWAY_DIR = Path(__file__).parent.parent / "control-plane" / "agents" / "gateway"
+sys.path.insert(0, str(GATEWAY_DIR))
+
+from batch_lane import job_view  # noqa: E402
+from limiter_backend import MemoryBackend, RedisBackend, SQLiteBackend  # noqa: E402
+import prompt_cache  # noqa: E402
+from metrics import Histogram, HistogramFamily, render_samples  # noqa: E402
+from prompt_cache import PromptCacheHints  # noqa: E402
+from resilience import AdaptiveLimiter, CircuitBreaker, CircuitOpenError, ProviderGuard  # noqa: E402
+from response_cache import CachedResponse, ResponseCache, canonical_key, is_deterministic  # noqa: E402
+from scheduler import FairQueue  # noqa: E402
+from single_flight import SingleFlight  # noqa: E402
+from streaming import StreamMeter, stream_body  # noqa: E402
+from token_estimator import approximate_tokens, estimate_output_tokens, estimate_prompt_tokens  # noqa: E402
+
+
+# =============================================================================
+# LIMITER BACKEND TESTS
+# =============================================================================
+
+@pytest.fixture(params=["memory", "sqlite", "redis"])
+def limiter(request, tmp_path):
+    """Each limiter backend; redis runs against an in-process stand-in."""
+    if request.param == "memory":
+        return MemoryBackend()
+    if request.param == "sqlite":
+        return SQLiteBackend(str(tmp_path / "limits.db"))
+    fakeredis = pytest.importorskip("fakeredis")
+    pytest.importorskip("lupa")  # Lua scripting in the stand-in
+    return RedisBackend(namespace="test", client=fakeredis.FakeAsyncRedis())
+
+
+class TestLimiterBackend:
+    """Test bucket and usage semantics shared by every limiter backend."""
+
+    @pytest.mark.core
+    async def test_take_until_empty(self, limiter):
+        """Test takes succeed while tokens remain and fail without consuming once they run out."""
+        assert await limiter.take("bucket", 10, 0, 6) == (True, 4)
+        taken, tokens = await limiter.take("bucket", 10, 0, 6)
+        assert not taken and tokens == 4, "A failed take must leave the level unchanged"
+        assert await limiter.take("bucket", 10, 0, 4) == (True, 0)
+
+    @pytest.mark.core
+    async def test_force_charge_and_refund(self, limiter):
+        """Test forced charges may go negative and refunds are capped at capacity."""
+        assert await limiter.take("bucket", 10, 0, 25, force=True) == (True, -15)
+        taken, _ = await limiter.take("bucket", 10, 0, 1)
+        assert not taken, "Requests wait off the debt"
+        assert (await limiter.take("bucket", 10, 0, -40, force=True))[1] == 10
+
+    @pytest.mark.core
+    async def test_refill(self, limiter):
+        """Test an emptied bucket refills at refill_rate tokens per second."""
+        await limiter.take("bucket", 10, 100, 10)
+        await asyncio.sleep(0.05)
+        _, tokens = await limiter.take("bucket", 10, 100, 0)
+        assert 2 <= tokens <= 10
+
+    @pytest.mark.core
+    async def test_usage_counters(self, limiter):
+        """Test daily usage counters accumulate and reset."""
+        await limiter.add_usage({"service:openai:tokens": 100, "agent:ARIA:cost": 0.5})
+        await limiter.add_usage({"service:openai:tokens": 50})
+        usage = await limiter.get_usage()
+        assert usage["service:openai:tokens"] == 150
+        assert usage["agent:ARIA:cost"] == pytest.approx(0.5)
+        await limiter.reset_usage()
+        assert await limiter.get_usage() == {}
+
+
+class TestSQLiteLimiter:
+    """Test the SQLite backend across workers."""
+
+    @pytest.mark.core
+    async def test_shared_between_workers(self, tmp_path):
+        """Test two backends on one file see one bucket."""
+        path = str(tmp_path / "limits.db")
+        first, second = SQLiteBackend(path), SQLiteBackend(path)
+        await first.take("bucket", 10, 0, 7)
+        assert await second.take("bucket", 10, 0, 7) == (False, 3)
+
+    @pytest.mark.core
+    async def test_locked_file_does_not_block_event_loop(self, tmp_path):
+        """Test a take waiting on another worker's write lock leaves the event loop running."""
+        path = tmp_path / "limits.db"
+        backend = SQLiteBackend(str(path))
+        other = sqlite3.connect(path, isolation_level=None)
+        other.execute("BEGIN IMMEDIATE")
+
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                ticks += 1
+                await asyncio.sleep(0.01)
+
+        ticking = asyncio.create_task(ticker())
+        take = asyncio.create_task(backend.take("bucket", 10, 0, 1))
+        await asyncio.sleep(0.3)
+        other.execute("COMMIT")
+        assert await take == (True, 9)
+        ticking.cancel()
+        assert ticks >= 10, "The event loop stalled while the bucket row was locked"
+
+
+# =============================================================================
+# RESPONSE CACHE TESTS
+# =============================================================================
+
+CHAT = {"model": "gpt-4o-mini", "messages": [{"role": "user", "content": "hi"}], "temperature": 0}
+
+
+def cache_key(cache, body=CHAT, headers=None, agent_id="aria", cache_control=None):
+    return cache.key_for(
+        "openai", "/chat/completions", "POST", "gpt-4o-mini", body, headers or {}, agent_id, cache_control
+    )
+
+
+def cache_entry(data) -> CachedResponse:
+    return CachedResponse(status_code=200, data=data, tokens=1, cost=0, expires_at=time.time() + 60)
+
+
+class TestResponseCache:
+    """Test cache keys, TTLs and opt-outs."""
+
+    @pytest.mark.core
+    def test_key_ignores_credentials_and_key_order(self):
+        """Test keys are stable across dict order and API keys, but not across bodies."""
+        reordered = dict(reversed(list(CHAT.items())))
+        assert canonical_key("openai", "/chat/completions", "post", "m", CHAT, {"Authorization": "Bearer a"}) == \
+            canonical_key("openai", "/chat/completions", "POST", "m", reordered, {"authorization": "Bearer b"})
+        assert canonical_key("openai", "/chat/completions", "POST", "m", CHAT, {}) != \
+            canonical_key("openai", "/chat/completions", "POST", "m", {**CHAT, "max_tokens": 5}, {})
+
+    @pytest.mark.core
+    @pytest.mark.parametrize("endpoint, body, expected", [
+        ("/chat/completions", {"temperature": 0}, True),
+        ("/chat/completions", {"temperature": 0.2}, False),
+        ("/chat/completions", {}, False),
+        ("/chat/completions", {"temperature": 0, "stream": True}, False),
+        ("/models/gemini:generateContent", {"generationConfig": {"temperature": 0}}, True),
+        ("/embeddings", {"input": "text"}, True),
+    ])
+    def test_is_deterministic(self, endpoint, body, expected):
+        assert is_deterministic(endpoint, body) is expected
+
+    @pytest.mark.core
+    def test_opt_outs(self):
+        """Test no-store and a zero agent TTL bypass the cache."""
+        cache = ResponseCache(disk_path=None, agent_ttls={"ORACLE": 0})
+        assert cache_key(cache)
+        assert cache_key(cache, cache_control="no-store") is None
+        assert cache_key(cache, agent_id="oracle") is None
+        assert cache_key(cache, body={**CHAT, "temperature": 1}) is None
+        assert cache.stats["bypassed"] == 3
+
+    @pytest.mark.core
+    async def test_hit_and_expiry(self, monkeypatch):
+        """Test a stored response is served until its agent's TTL runs out."""
+        cache = ResponseCache(disk_path=None, default_ttl=60, agent_ttls={"scholar": 5})
+        key = cache_key(cache)
+        await cache.put(key, "scholar", 200, {"answer": 42}, tokens=30, cost=0.01)
+
+        hit = await cache.get(key, "aria")
+        assert hit.data == {"answer": 42}
+        assert cache.stats["tokens_saved"] == 30 and cache.hits_by_agent["aria"] == 1
+
+        now = time.time()
+        monkeypatch.setattr(time, "time", lambda: now + 6)
+        assert await cache.get(key, "aria") is None
+
+    @pytest.mark.core
+    async def test_errors_not_stored(self):
+        cache = ResponseCache(disk_path=None)
+        await cache.put(cache_key(cache), "aria", 429, {"error": "rate limited"}, tokens=0, cost=0)
+        assert await cache.get(cache_key(cache), "aria") is None
+
+    @pytest.mark.core
+    async def test_memory_lru_and_disk_tier(self, tmp_path):
+        """Test the memory tier evicts least recently used entries and the disk tier still serves them."""
+        cache = ResponseCache(memory_entries=2, disk_path=str(tmp_path / "cache.db"))
+        for i in range(3):
+            await cache.put(f"key-{i}", "aria", 200, {"i": i}, tokens=1, cost=0)
+
+        assert "key-0" not in cache.memory and cache.stats["memory_evictions"] == 1
+        assert (await cache.get("key-0", "aria")).data == {"i": 0}
+        assert cache.stats["disk_hits"] == 1
+        assert "key-0" in cache.memory, "Disk hits are promoted to memory"
+
+        restarted = ResponseCache(memory_entries=2, disk_path=str(tmp_path / "cache.db"))
+        assert (await restarted.get("key-2", "aria")).data == {"i": 2}
+
+    @pytest.mark.core
+    def test_disk_budget(self, tmp_path):
+        """Test the disk tier evicts least recently used rows to stay under its byte budget."""
+        cache = ResponseCache(disk_path=str(tmp_path / "cache.db"), disk_max_mb=0.01)
+        payload = {"text": "".join(chr(0x4e00 + (i * 7919) % 20000) for i in range(2000))}
+        for i in range(10):
+            cache.disk.put(f"key-{i}", cache_entry(payload))
+
+        assert cache.disk.total_bytes <= cache.disk.max_bytes
+        assert cache.disk.evictions > 0
+        assert cache.disk.get("key-9") is not None and cache.disk.get("key-0") is None
+
+
+# =============================================================================
+# FAIR QUEUE TESTS
+# =============================================================================
+
+def queued(agent_id: str, tokens: int = 1000, priority: int = 5, label: str = ""):
+    """Minimal stand-in for gateway.QueuedRequest."""
+    return SimpleNamespace(
+        agent_id=agent_id, estimated_tokens=tokens, priority=priority,
+        created_at=datetime.utcnow(), label=label
+    )
+
+
+async def drain(queue, count: int) -> list:
+    return [await queue.get() for _ in range(count)]
+
+
+class TestFairQueue:
+    """Test deficit round robin scheduling between agents."""
+
+    @pytest.mark.core
+    async def test_equal_share_under_flood(self):
+        """Test an agent with a deep backlog cannot starve one with a few requests."""
+        queue = FairQueue(maxsize=100, agent_maxsize=100, weights={})
+        for _ in range(50):
+            queue.put_nowait(queued("batch"))
+        for _ in range(5):
+            queue.put_nowait(queued("aria"))
+
+        first = [r.agent_id for r in await drain(queue, 10)]
+        assert first.count("aria") == 5, f"Expected an even split, got {first}"
+
+    @pytest.mark.core
+    async def test_weights(self):
+        """Test a weight of 3 gets three times the share of a weight of 1."""
+        queue = FairQueue(maxsize=100, agent_maxsize=100, weights={"aria": 3})
+        for _ in range(40):
+            queue.put_nowait(queued("aria"))
+            queue.put_nowait(queued("scholar"))
+
+        first = [r.agent_id for r in await drain(queue, 40)]
+        assert first.count("aria") == 30
+
+    @pytest.mark.core
+    async def test_token_cost(self):
+        """Test credit is spent in tokens, so large requests are served less often."""
+        queue = FairQueue(maxsize=100, agent_maxsize=100, weights={})
+        for _ in range(20):
+            queue.put_nowait(queued("big", tokens=4000))
+            queue.put_nowait(queued("small", tokens=1000))
+
+        first = [r.agent_id for r in await drain(queue, 20)]
+        assert first.count("small") == 4 * first.count("big")
+
+    @pytest.mark.core
+    async def test_priority_within_agent(self):
+        """Test an agent's requests leave in priority order, then arrival order."""
+        queue = FairQueue(maxsize=100, agent_maxsize=100, weights={})
+        for label, priority in (("low-1", 9), ("high", 1), ("low-2", 9)):
+            queue.put_nowait(queued("aria", priority=priority, label=label))
+
+        assert [r.label for r in await drain(queue, 3)] == ["high", "low-1", "low-2"]
+
+    @pytest.mark.core
+    @pytest.mark.parametrize("weights", [{"aria": 0}, {"aria": -2}])
+    def test_rejects_non_positive_weights(self, weights):
+        """Test weights that would never earn credit are rejected instead of hanging get()."""
+        with pytest.raises(ValueError):
+            FairQueue(maxsize=10, agent_maxsize=10, weights=weights)
+
+    @pytest.mark.core
+    def test_agent_limits(self):
+        """Test per-agent and total queue limits."""
+        queue = FairQueue(maxsize=3, agent_maxsize=2, weights={})
+        queue.put_nowait(queued("aria"))
+        queue.put_nowait(queued("aria"))
+        assert queue.agent_full("aria") and not queue.agent_full("scholar")
+        queue.put_nowait(queued("scholar"))
+        assert queue.full()
+
+
+# =============================================================================
+# REQUEST COALESCING TESTS
+# =============================================================================
+
+@pytest.fixture
+def gateway(monkeypatch):
+    """The gateway module with fresh in-memory state and no HTTP client."""
+    pytest.importorskip("fastapi")
+    import gateway as module
+
+    monkeypatch.setattr(module, "CACHE_ENABLED", False)
+    monkeypatch.setattr(module, "state", module.GatewayState())
+    return module
+
+
+def fake_forward(gateway, calls: list, delay: float = 0.05):
+    """Stand-in for forward_request that records each upstream call."""
+    async def forward_request(req, limits, model, cache_key, start_time):
+        calls.append(req.agent_id)
+        await asyncio.sleep(delay)
+        return gateway.ProxyResponse(
+            success=True, status_code=200, data={"call": len(calls)}, tokens_used=100, cost=0.01
+        )
+    return forward_request
+
+
+class TestSingleFlight:
+    """Test leader/follower coalescing."""
+
+    @pytest.mark.core
+    async def test_followers_share_leader_result(self):
+        """Test concurrent callers make one call and followers are counted per agent."""
+        flight = SingleFlight()
+        calls = []
+
+        async def call():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return "response"
+
+        results = await asyncio.gather(*(flight.do("key", agent, call) for agent in ("aria", "aria", "scholar")))
+
+        assert len(calls) == 1
+        assert results == [("response", False), ("response", True), ("response", True)]
+        assert flight.stats == {"leaders": 1, "coalesced": 2, "fallbacks": 0}
+        assert flight.coalesced_by_agent == {"aria": 1, "scholar": 1}
+
+    @pytest.mark.core
+    async def test_unshareable_result_falls_back(self):
+        """Test followers make their own call when the leader's result is not shareable."""
+        flight = SingleFlight()
+        calls = []
+
+        async def call():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return None if len(calls) == 1 else "response"
+
+        results = await asyncio.gather(
+            flight.do("key", "aria", call, shareable=lambda r: r is not None),
+            flight.do("key", "scholar", call, shareable=lambda r: r is not None),
+        )
+
+        assert results == [(None, False), ("response", False)]
+        assert flight.stats["fallbacks"] == 1 and not flight.coalesced_by_agent
+
+
+class TestGatewayCoalescing:
+    """Test which proxied requests share an upstream call."""
+
+    @staticmethod
+    def request(gateway, agent_id: str, **body):
+        return gateway.ProxyRequest(
+            service="openai", endpoint="/chat/completions", agent_id=agent_id,
+            body={"model": "gpt-4o-mini", "messages": [{"role": "user", "content": "hi"}], **body}
+        )
+
+    @pytest.mark.core
+    async def test_deterministic_requests_coalesce(self, gateway, monkeypatch):
+        """Test temperature=0 duplicates share one call and followers are not charged."""
+        calls = []
+        monkeypatch.setattr(gateway, "forward_request", fake_forward(gateway, calls))
+
+        leader, follower = await asyncio.gather(
+            gateway.proxy_request(self.request(gateway, "aria", temperature=0)),
+            gateway.proxy_request(self.request(gateway, "scholar", temperature=0)),
+        )
+
+        assert calls == ["aria"]
+        assert not leader.coalesced and leader.tokens_used == 100
+        assert follower.coalesced and follower.tokens_used == 0 and follower.cost == 0
+        assert follower.data == leader.data
+        assert gateway.state.stats["coalesced_requests"] == 1
+        assert gateway.state.stats["requests_by_agent"]["scholar"] == 1
+
+    @pytest.mark.core
+    @pytest.mark.parametrize("body", [{"temperature": 0.7}, {}, {"temperature": 0, "stream": True}])
+    async def test_sampled_requests_are_not_coalesced(self, gateway, monkeypatch, body):
+        """Test completions that may legitimately differ each get their own call."""
+        calls = []
+        monkeypatch.setattr(gateway, "forward_request", fake_forward(gateway, calls))
+
+        responses = await asyncio.gather(
+            gateway.proxy_request(self.request(gateway, "aria", **body)),
+            gateway.proxy_request(self.request(gateway, "scholar", **body)),
+        )
+
+        assert calls == ["aria", "scholar"]
+        assert not any(response.coalesced for response in responses)
+        assert gateway.state.stats["coalesced_requests"] == 0
+
+
+# =============================================================================
+# TOKEN ESTIMATION TESTS
+# =============================================================================
+
+class TestTokenEstimator:
+    """Test gateway-side token estimates."""
+
+    @pytest.mark.core
+    def test_approximation_by_character_class(self):
+        """Test code and CJK text count more tokens per character than English prose."""
+        prose = "The quick brown fox jumps over the lazy dog"
+        assert 8 <= approximate_tokens(prose) <= 12
+        assert approximate_tokens("{[()]};") == 7
+        assert approximate_tokens("\u4f60\u597d\u4e16\u754c") == 4
+
+    @pytest.mark.core
+    def test_prompt_shapes(self):
+        """Test OpenAI messages, Anthropic system blocks and Google contents are all counted."""
+        text = "Summarize the quarterly report"
+        openai = estimate_prompt_tokens("google", "m", {"messages": [{"role": "user", "content": text}]})
+        anthropic = estimate_prompt_tokens("anthropic", "m", {
+            "system": [{"type": "text", "text": text}],
+            "messages": [{"role": "user", "content": [{"type": "text", "text": text}]}],
+        })
+        google = estimate_prompt_tokens("google", "m", {"contents": [{"parts": [{"text": text}]}]})
+        assert openai == google > 0
+        assert anthropic > openai
+
+    @pytest.mark.core
+    def test_output_allowance(self):
+        assert estimate_output_tokens("/chat/completions", {"max_tokens": 100}) == 100
+        assert estimate_output_tokens("/chat/completions", {"max_tokens": 10**6}) == 4096
+        assert estimate_output_tokens("/embeddings", {"max_tokens": 100}) == 0
+
+
+class TestReconciliation:
+    """Test the TPM bucket is settled with real usage after each call."""
+
+    @staticmethod
+    async def send(gateway, usage):
+        async def respond(request):
+            return httpx.Response(200, json={"usage": usage, "choices": []})
+
+        gateway.state.http_client = httpx.AsyncClient(transport=httpx.MockTransport(respond))
+        limits = gateway.state.service_limits["openai"]
+        limits.tpm_bucket.refill_rate = 0  # Keep the level exact
+        req = gateway.ProxyRequest(
+            service="openai", endpoint="/chat/completions", agent_id="aria",
+            body={"model": "gpt-4o-mini", "max_tokens": 1000, "messages": [{"role": "user", "content": "hi"}]}
+        )
+        response = await gateway.forward_request(req, limits, "gpt-4o-mini", None, time.time())
+        await gateway.state.http_client.aclose()
+        return response, req.estimated_tokens, await limits.tpm_bucket.available()
+
+    @pytest.mark.core
+    async def test_over_estimate_is_refunded(self, gateway):
+        """Test the unused part of the output allowance goes back to the bucket."""
+        response, estimated, available = await self.send(
+            gateway, {"prompt_tokens": 10, "completion_tokens": 40}
+        )
+        assert response.success and response.tokens_used == 50
+        assert estimated > 1000
+        assert available == gateway.state.service_limits["openai"].tpm_bucket.capacity - 50
+        assert gateway.state.stats["estimate_abs_error"] == estimated - 50
+
+    @pytest.mark.core
+    async def test_under_estimate_is_charged(self, gateway):
+        """Test usage beyond the estimate is charged, so the next requests wait it off."""
+        response, estimated, available = await self.send(
+            gateway, {"prompt_tokens": 10, "completion_tokens": 3000}
+        )
+        assert response.tokens_used == 3010
+        assert available == gateway.state.service_limits["openai"].tpm_bucket.capacity - 3010
+        assert gateway.state.stats["reconciled_tokens"] == 3010
+
+
+class TestAdmission:
+    """Test TPM capacity is taken atomically, so concurrent requests cannot share it."""
+
+    @staticmethod
+    def request(gateway, agent_id: str):
+        req = gateway.ProxyRequest(
+            service="openai", endpoint="/chat/completions", agent_id=agent_id,
+            body={"model": "gpt-4o-mini", "max_tokens": 1000, "messages": [{"role": "user", "content": "hi"}]}
+        )
+        req.estimated_tokens = gateway.estimate_tokens(req, "openai", "gpt-4o-mini")
+        return req
+
+    @staticmethod
+    async def admit(gateway, req):
+        limits = gateway.state.service_limits["openai"]
+        rejection, _ = await gateway.admit_request(
+            req, limits, await gateway.state.agent_quota(req.agent_id), time.time()
+        )
+        return rejection
+
+    @pytest.mark.core
+    async def test_admission_debits_before_returning(self, gateway):
+        """Test requests admitted back to back each take their estimate from the bucket."""
+        bucket = gateway.state.service_limits["openai"].tpm_bucket
+        bucket.refill_rate = 0
+        reqs = [self.request(gateway, f"agent-{i}") for i in range(3)]
+        await bucket.adjust(bucket.capacity - 2 * reqs[0].estimated_tokens)  # Room for two
+        gateway.state.queues["openai"].maxsize = 0  # Anything not admitted at once is rejected
+
+        rejections = await asyncio.gather(*(self.admit(gateway, req) for req in reqs))
+        assert [r is None for r in rejections] == [True, True, False]
+        assert await bucket.available() == 0
+
+    @pytest.mark.core
+    async def test_queue_releases_only_what_it_takes(self, gateway, monkeypatch):
+        """Test the queue processor takes capacity per request instead of releasing every waiter."""
+        monkeypatch.setattr(gateway, "QUEUE_TIMEOUT", 2.0)
+        bucket = gateway.state.service_limits["openai"].tpm_bucket
+        bucket.refill_rate = 0.001  # Effectively no refill, without dividing by zero
+        await bucket.adjust(bucket.capacity)
+        processor = asyncio.create_task(gateway.state._process_queue("openai"))
+        reqs = [self.request(gateway, f"agent-{i}") for i in range(5)]
+        try:
+            pending = [asyncio.create_task(self.admit(gateway, req)) for req in reqs]
+            await asyncio.sleep(0.05)
+            await bucket.adjust(-2 * reqs[0].estimated_tokens)  # Room for exactly two
+            rejections = await asyncio.gather(*pending)
+        finally:
+            processor.cancel()
+        assert sum(r is None for r in rejections) == 2
+        assert all(r.status_code == 408 for r in rejections if r)
+        assert await bucket.available() < reqs[0].estimated_tokens
+
+
+# =============================================================================
+# STREAM METERING TESTS
+# =============================================================================
+
+def sse(*events) -> bytes:
+    return b"".join(b"data: " + json.dumps(event).encode() + b"\n\n" for event in events)
+
+
+PROMPT = {"model": "m", "messages": [{"role": "user", "content": "Summarize the quarterly report"}]}
+
+
+class TestStreamMeter:
+    """Test usage parsing over each provider's SSE stream."""
+
+    @staticmethod
+    def feed_all(meter, payload: bytes, size: int = 7) -> tuple:
+        """Feed in small pieces so events split across chunks; returns the summed deltas"""
+        deltas = [meter.feed(payload[i:i + size]) for i in range(0, len(payload), size)]
+        deltas.append(meter.unbooked())
+        return sum(d[0] for d in deltas), sum(d[1] for d in deltas)
+
+    @pytest.mark.core
+    def test_first_delta_carries_prompt_estimate(self):
+        """Test the prompt estimate is booked with the first chunk, not silently held."""
+        meter = StreamMeter("openai", "m", PROMPT)
+        estimate = estimate_prompt_tokens("openai", "m", PROMPT)
+        assert meter.input_tokens == estimate > 0
+        assert meter.feed(b": keep-alive\n") == (estimate, 0)
+        assert meter.feed(b": keep-alive\n") == (0, 0)
+
+    @pytest.mark.core
+    def test_openai_usage_replaces_estimate(self):
+        """Test OpenAI text deltas are estimated until the include_usage chunk reports real counts."""
+        meter = StreamMeter("openai", "m", PROMPT)
+        payload = sse(
+            {"choices": [{"delta": {"content": "Revenue grew"}}]},
+            {"choices": [{"delta": {"content": " nine percent."}}]},
+            {"choices": [], "usage": {"prompt_tokens": 920, "completion_tokens": 6,
+                                      "prompt_tokens_details": {"cached_tokens": 512}}},
+        ) + b"data: [DONE]\n\n"
+        assert self.feed_all(meter, payload) == (920, 6)
+        assert meter.total_tokens == 926
+        assert meter.cache_read_tokens == 512
+        assert meter.events == 3 and meter.ttft_ms is not None
+
+    @pytest.mark.core
+    def test_openai_without_usage_keeps_estimates(self):
+        """Test a stream with no usage chunk still books its prompt and output estimates."""
+        meter = StreamMeter("openai", "m", PROMPT)
+        input_tokens, output_tokens = self.feed_all(
+            meter, sse({"choices": [{"delta": {"content": "Revenue grew nine percent."}}]})
+        )
+        assert input_tokens == estimate_prompt_tokens("openai", "m", PROMPT)
+        assert output_tokens == approximate_tokens("Revenue grew nine percent.")
+        assert input_tokens + output_tokens == meter.total_tokens
+
+    @pytest.mark.core
+    def test_anthropic_cache_tokens_count_as_input(self):
+        """Test Anthropic cache reads and writes are added to input, and message_delta settles output."""
+        meter = StreamMeter("anthropic", "m", PROMPT)
+        payload = sse(
+            {"type": "message_start", "message": {"usage": {
+                "input_tokens": 20, "output_tokens": 1,
+                "cache_read_input_tokens": 800, "cache_creation_input_tokens": 100}}},
+            {"type": "content_block_delta", "delta": {"type": "text_delta", "text": "Revenue grew"}},
+            {"type": "message_delta", "usage": {"output_tokens": 42}},
+        )
+        assert self.feed_all(meter, payload) == (920, 42)
+        assert (meter.cache_read_tokens, meter.cache_write_tokens) == (800, 100)
+
+    @pytest.mark.core
+    def test_google_usage_metadata(self):
+        """Test Google candidate parts are estimated until usageMetadata arrives."""
+        meter = StreamMeter("google", "m", {"contents": [{"parts": [{"text": "Summarize"}]}]})
+        first = meter.feed(sse({"candidates": [{"content": {"parts": [{"text": "Revenue grew"}]}}]}))
+        assert first[1] == approximate_tokens("Revenue grew")
+        meter.feed(sse({"candidates": [], "usageMetadata": {
+            "promptTokenCount": 300, "candidatesTokenCount": 5, "cachedContentTokenCount": 100}}))
+        assert (meter.input_tokens, meter.output_tokens, meter.cache_read_tokens) == (300, 5, 100)
+
+    @pytest.mark.core
+    def test_openai_body_requests_usage(self):
+        body = stream_body("openai", {"model": "m", "stream_options": {"foo": 1}})
+        assert body["stream"] is True
+        assert body["stream_options"] == {"foo": 1, "include_usage": True}
+        assert "stream_options" not in stream_body("anthropic", {"model": "m"})
+        assert stream_body("google", {"model": "m"}) == {"model": "m"}
+
+
+class TestStreamBooking:
+    """Test streamed usage reaches the agent counters exactly once."""
+
+    @staticmethod
+    async def stream(gateway, service: str, payload: bytes):
+        sent = []
+
+        async def respond(request):
+            sent.append(json.loads(request.content))
+            return httpx.Response(200, content=payload, headers={"content-type": "text/event-stream"})
+
+        gateway.state.http_client = httpx.AsyncClient(transport=httpx.MockTransport(respond))
+        req = gateway.ProxyRequest(
+            service=service, endpoint="/chat/completions", agent_id="aria",
+            body={**PROMPT, "max_tokens": 100}
+        )
+        response = await gateway.proxy_stream(req)
+        async for _ in response.body_iterator:
+            pass
+        await gateway.state.http_client.aclose()
+        return sent[0]
+
+    @pytest.mark.core
+    async def test_anthropic_reported_usage_is_booked(self, gateway):
+        """Test the booked total is the reported usage, not the difference from the estimate."""
+        payload = sse(
+            {"type": "message_start", "message": {"usage": {"input_tokens": 920, "output_tokens": 1}}},
+            {"type": "content_block_delta", "delta": {"type": "text_delta", "text": "Revenue grew"}},
+            {"type": "message_delta", "usage": {"output_tokens": 30}},
+        )
+        await self.stream(gateway, "anthropic", payload)
+        assert gateway.state.stats["tokens_by_agent"]["aria"] == 950
+        assert gateway.state.stats["tokens_by_service"]["anthropic"] == 950
+
+    @pytest.mark.core
+    async def test_openai_estimate_is_booked_without_usage(self, gateway):
+        """Test an OpenAI stream that never reports usage still books prompt plus output."""
+        sent = await self.stream(gateway, "openai", sse({"choices": [{"delta": {"content": "Revenue grew"}}]}))
+        assert sent["stream_options"] == {"include_usage": True}
+        expected = estimate_prompt_tokens("openai", "m", PROMPT) + approximate_tokens("Revenue grew")
+        assert gateway.state.stats["tokens_by_agent"]["aria"] == expected
+
+
+# =============================================================================
+# PROMPT CACHE TESTS
+# =============================================================================
+
+SYSTEM_PROMPT = "You are the scheduling agent. Follow the runbook exactly. " * 300
+MODEL = "claude-sonnet-4-20250514"
+
+
+def conversation(*turns: str, system: str = SYSTEM_PROMPT) -> dict:
+    roles = ["user", "assistant"]
+    return {
+        "model": MODEL,
+        "system": system,
+        "messages": [{"role": roles[i % 2], "content": text} for i, text in enumerate(turns)],
+    }
+
+
+def breakpoints(body) -> int:
+    return json.dumps(body).count('"cache_control"')
+
+
+class TestPromptCacheHints:
+    """Test cache breakpoints are only added to prefixes that have repeated."""
+
+    @pytest.mark.core
+    def test_system_breakpoint_after_min_seen(self):
+        """Test the system prompt is marked once it has been seen min_seen times."""
+        hints = PromptCacheHints(min_seen=2)
+        body = conversation("What is on today?")
+        assert hints.annotate("chronos", MODEL, body) is None
+
+        annotated = hints.annotate("chronos", MODEL, body)
+        assert annotated["system"] == [{"type": "text", "text": SYSTEM_PROMPT, "cache_control": {"type": "ephemeral"}}]
+        assert body["system"] == SYSTEM_PROMPT, "The caller's body is not modified"
+        assert hints.stats["system_breakpoints"] == 1
+
+    @pytest.mark.core
+    def test_prefixes_are_per_agent(self):
+        hints = PromptCacheHints(min_seen=2)
+        assert hints.annotate("chronos", MODEL, conversation("hi")) is None
+        assert hints.annotate("hermes", MODEL, conversation("hi")) is None
+
+    @pytest.mark.core
+    def test_short_prefix_is_not_marked(self):
+        """Test prefixes under the model's minimum cacheable length get no breakpoint."""
+        hints = PromptCacheHints(min_seen=1)
+        assert hints.annotate("chronos", MODEL, conversation("hi", system="Be brief.")) is None
+
+    @pytest.mark.core
+    def test_at_most_two_breakpoints(self):
+        """Test a long stable conversation gets the system breakpoint plus one on its longest stable prefix."""
+        hints = PromptCacheHints(min_seen=2)
+        history = [f"Turn {i}: reschedule the standup" for i in range(6)]
+        hints.annotate("chronos", MODEL, conversation(*history, "Latest question"))
+        annotated = hints.annotate("chronos", MODEL, conversation(*history, "A new question"))
+
+        assert breakpoints(annotated) == 2
+        assert "cache_control" in annotated["messages"][5]["content"][-1]
+        assert isinstance(annotated["messages"][6]["content"], str), "The new turn has not repeated"
+
+    @pytest.mark.core
+    def test_caller_managed_requests_are_skipped(self):
+        """Test requests that already carry cache_control are sent unchanged."""
+        hints = PromptCacheHints(min_seen=1)
+        body = conversation("hi")
+        body["system"] = [{"type": "text", "text": SYSTEM_PROMPT, "cache_control": {"type": "ephemeral"}}]
+        assert hints.annotate("chronos", MODEL, body) is None
+        assert hints.stats["caller_managed"] == 1
+        assert hints.get_stats()["tracked_prefixes"] == 0
+
+    @pytest.mark.core
+    def test_tools_only_prefix_marks_last_tool(self):
+        """Test a stable prefix without a system prompt puts the breakpoint on the last tool."""
+        hints = PromptCacheHints(min_seen=1)
+        tools = [{"name": f"tool_{i}", "description": SYSTEM_PROMPT, "input_schema": {}} for i in range(2)]
+        body = {"model": MODEL, "tools": tools, "messages": [{"role": "user", "content": "hi"}]}
+        annotated = hints.annotate("chronos", MODEL, body)
+        assert annotated["tools"][-1]["cache_control"] == {"type": "ephemeral"}
+        assert "cache_control" not in annotated["tools"][0]
+        assert "cache_control" not in tools[-1]
+
+    @pytest.mark.core
+    def test_sightings_expire_after_window(self, monkeypatch):
+        """Test a prefix last seen longer ago than the provider cache lifetime starts counting again."""
+        clock = SimpleNamespace(now=1000.0)
+        monkeypatch.setattr(prompt_cache, "time", SimpleNamespace(time=lambda: clock.now))
+        hints = PromptCacheHints(min_seen=2, window=300)
+        body = conversation("What is on today?")
+
+        assert hints.annotate("chronos", MODEL, body) is None
+        clock.now += 301
+        assert hints.annotate("chronos", MODEL, body) is None
+        clock.now += 299
+        assert hints.annotate("chronos", MODEL, body) is not None
+
+
+class TestCachedPricing:
+    """Test prompt-cache reads and writes are priced at their provider multipliers."""
+
+    @pytest.mark.core
+    def test_anthropic_read_and_write_multipliers(self, gateway):
+        uncached = gateway.calculate_cost("anthropic", MODEL, 1_000_000, 0)
+        assert uncached == pytest.approx(3.00)
+        read = gateway.calculate_cost("anthropic", MODEL, 1_000_000, 0, cache_read_tokens=800_000)
+        assert read == pytest.approx(0.2 * 3.00 + 0.8 * 0.1 * 3.00)
+        written = gateway.calculate_cost("anthropic", MODEL, 1_000_000, 0, cache_write_tokens=1_000_000)
+        assert written == pytest.approx(1.25 * 3.00)
+
+    @pytest.mark.core
+    def test_output_and_other_providers(self, gateway):
+        cost = gateway.calculate_cost("openai", "gpt-4o", 1_000_000, 1_000_000, cache_read_tokens=500_000)
+        assert cost == pytest.approx(0.5 * 2.50 + 0.5 * 0.5 * 2.50 + 10.00)
+        assert gateway.calculate_cost("openai", "unknown-model", 1000, 1000) == 0
+
+
+# =============================================================================
+# PROVIDER RESILIENCE TESTS
+# =============================================================================
+
+class TestCircuitBreaker:
+    """Test closed -> open -> half_open -> closed transitions."""
+
+    @staticmethod
+    def tripped(cooldown: float = 60) -> CircuitBreaker:
+        breaker = CircuitBreaker(window=10, min_requests=4, failure_rate=0.5, cooldown=cooldown)
+        for ok in (True, False, True, False):
+            breaker.record(ok)
+        return breaker
+
+    @pytest.mark.core
+    def test_opens_on_failure_rate(self):
+        """Test the breaker opens once enough outcomes show the failure rate."""
+        breaker = CircuitBreaker(window=10, min_requests=4, failure_rate=0.5, cooldown=60)
+        for ok in (False, False, True):
+            breaker.record(ok)
+        assert breaker.state == "closed", "Below min_requests the breaker stays closed"
+        breaker.record(False)
+        assert breaker.state == "open" and not breaker.allow()
+        assert 59 < breaker.retry_in() <= 60
+
+    @pytest.mark.core
+    def test_single_probe_after_cooldown(self):
+        """Test one probe is let through after the cooldown and success closes the circuit."""
+        breaker = self.tripped(cooldown=0)
+        assert breaker.allow() and breaker.state == "half_open"
+        assert not breaker.allow(), "Only one probe at a time"
+        breaker.record(True)
+        assert breaker.state == "closed" and not breaker.outcomes
+
+    @pytest.mark.core
+    def test_failed_probe_reopens(self):
+        breaker = self.tripped(cooldown=0)
+        assert breaker.allow()
+        breaker.cooldown = 60
+        breaker.record(False)
+        assert breaker.state == "open" and not breaker.allow()
+
+    @pytest.mark.core
+    def test_abandoned_probe_lets_another_through(self):
+        breaker = self.tripped(cooldown=0)
+        assert breaker.allow()
+        breaker.abandon_probe()
+        assert breaker.allow()
+
+    @pytest.mark.core
+    def test_retry_after_hold(self):
+        """Test a provider Retry-After pauses sends without opening the circuit."""
+        breaker = CircuitBreaker()
+        breaker.hold(5)
+        assert not breaker.allow() and breaker.state == "closed"
+        assert 4 < breaker.held_for() <= 5
+
+
+class TestProviderGuard:
+    """Test retries and fail-fast through the provider guard."""
+
+    @staticmethod
+    def guard(monkeypatch, **breaker) -> ProviderGuard:
+        monkeypatch.setattr("resilience.backoff_delay", lambda attempt: 0)
+        guard = ProviderGuard("openai")
+        guard.breaker = CircuitBreaker(**breaker)
+        return guard
+
+    @pytest.mark.core
+    async def test_retries_overloaded_response(self, monkeypatch):
+        """Test a 503 is retried and the retry's success is returned."""
+        guard = self.guard(monkeypatch)
+        statuses = iter([503, 200])
+
+        async def call():
+            return httpx.Response(next(statuses))
+
+        response = await guard.send(call, timeout=1)
+        assert response.status_code == 200
+        assert guard.stats["attempts"] == 2 and guard.stats["retries"] == 1
+        assert guard.limiter.inflight == 0
+
+    @pytest.mark.core
+    async def test_open_circuit_fails_fast(self, monkeypatch):
+        """Test that once failures open the circuit, check() and send() reject without calling upstream."""
+        # Three failed attempts (the call and both retries) open the circuit
+        guard = self.guard(monkeypatch, window=4, min_requests=3, failure_rate=0.5, cooldown=60)
+        calls = 0
+
+        async def call():
+            nonlocal calls
+            calls += 1
+            raise httpx.ConnectError("refused")
+
+        with pytest.raises(httpx.ConnectError):
+            await guard.send(call, timeout=1)
+        assert guard.breaker.state == "open" and calls == 3
+
+        made = calls
+        with pytest.raises(CircuitOpenError):
+            guard.check()
+        with pytest.raises(CircuitOpenError):
+            await guard.send(call, timeout=1)
+        assert calls == made
+        assert guard.get_stats()["circuit"] == "open"
+
+    @pytest.mark.core
+    async def test_client_errors_do_not_trip(self, monkeypatch):
+        """Test 4xx other than 429 count as healthy provider responses."""
+        guard = self.guard(monkeypatch, window=4, min_requests=2, failure_rate=0.5, cooldown=60)
+
+        async def call():
+            return httpx.Response(400)
+
+        for _ in range(4):
+            assert (await guard.send(call, timeout=1)).status_code == 400
+        assert guard.breaker.state == "closed" and guard.stats["retries"] == 0
+
+
+class TestAdaptiveLimiter:
+    """Test AIMD concurrency limits."""
+
+    @pytest.mark.core
+    def test_backs_off_on_overload_and_grows_when_used(self):
+        """Test overload cuts the limit multiplicatively and a busy healthy provider grows it."""
+        limiter = AdaptiveLimiter(initial=16, minimum=1, maximum=64)
+        limiter.observe(0.1, overloaded=True)
+        assert limiter.limit == pytest.approx(16 * 0.7)
+        limiter.observe(0.1, overloaded=True)
+        assert limiter.limit == pytest.approx(16 * 0.7), "One burst of failures is one decrease"
+
+        reduced = limiter.limit
+        limiter.inflight = int(reduced)
+        limiter.observe(0.1, overloaded=False)
+        assert limiter.limit > reduced
+
+
+# =============================================================================
+# BATCH LANE TESTS
+# =============================================================================
+
+@pytest.fixture
+def batch_lane(gateway, tmp_path, monkeypatch):
+    """A batch lane on the stub provider (GATEWAY_BATCH_PROVIDER=stub), driven by hand."""
+    import batch_lane as module
+
+    monkeypatch.setattr(module, "BATCH_PROVIDER", "stub")
+
+    async def log_event(*args, **kwargs):
+        pass
+
+    return module.BatchLane(
+        module.BatchStore(str(tmp_path / "batch.db")), None, gateway.state.service_limits,
+        gateway.state.providers, gateway.get_base_url, gateway.extract_token_usage,
+        gateway.record_batch_usage, log_event
+    )
+
+
+def batch_job(endpoint: str, body: dict, agent_id: str = "scholar") -> dict:
+    model = body.get("model", "gpt-4o-mini")
+    return {"agent_id": agent_id, "service": "openai", "endpoint": endpoint, "model": model,
+            "body": body, "callback_url": None}
+
+
+class TestBatchLane:
+    """Test the offline lane end to end against the stub provider."""
+
+    @staticmethod
+    async def flush(lane):
+        for jobs in lane.store.claim_due(max_items=500, max_wait=0):
+            await lane._dispatch(jobs)
+        for batch in lane.store.claim_polls(interval=0):
+            await lane._poll(batch)
+
+    @pytest.mark.core
+    async def test_embeddings_are_packed(self, batch_lane, gateway):
+        """Test embedding jobs share one multi-input call and each gets its own vectors back."""
+        inputs = [["alpha", "beta"], "gamma", ["delta", "epsilon", "zeta"]]
+        queued = batch_lane.submit([
+            batch_job("/v1/embeddings", {"model": "text-embedding-3-small", "input": item}) for item in inputs
+        ])
+        assert {job["mode"] for job in queued} == {"pack"}
+
+        await self.flush(batch_lane)
+
+        assert batch_lane.stats["packed_calls"] == 1
+        for job, item in zip(queued, inputs):
+            view = job_view(batch_lane.store.get(job["job_id"]))
+            assert view["status"] == "completed"
+            assert len(view["data"]["data"]) == len(item if isinstance(item, list) else [item])
+            assert [vector["index"] for vector in view["data"]["data"]] == list(range(len(view["data"]["data"])))
+        assert gateway.state.stats["batch_requests"] == 3
+
+    @pytest.mark.core
+    async def test_chat_goes_through_provider_batch(self, batch_lane, gateway):
+        """Test chat jobs are submitted as one provider batch, completed on poll and billed at the discount."""
+        queued = batch_lane.submit([
+            batch_job("/v1/chat/completions", {"model": "gpt-4o-mini", "messages": [{"role": "user", "content": f"q{i}"}]})
+            for i in range(3)
+        ])
+        assert {job["mode"] for job in queued} == {"provider"}
+        tpm = gateway.state.service_limits["openai"].tpm_bucket
+        before = await tpm.available()
+
+        await self.flush(batch_lane)
+
+        assert batch_lane.stats["provider_batches"] == 1
+        views = [job_view(batch_lane.store.get(job["job_id"])) for job in queued]
+        assert {view["status"] for view in views} == {"completed"}
+        assert len({view["batch_id"] for view in views}) == 1
+        assert views[0]["data"]["choices"][0]["message"]["content"].startswith("[stub]")
+        assert await tpm.available() >= before, "Provider batches never touch the real-time bucket"
+        assert gateway.state.stats["batch_saved_cost"] > 0
+
+    @pytest.mark.core
+    async def test_partial_group_waits(self, batch_lane):
+        """Test a group below max_items is held until its oldest job has waited max_wait."""
+        batch_lane.submit([batch_job("/v1/embeddings", {"model": "text-embedding-3-small", "input": "x"})])
+        assert batch_lane.store.claim_due(max_items=500, max_wait=300) == []
+        assert len(batch_lane.store.claim_due(max_items=1, max_wait=300)) == 1
+
+    @pytest.mark.core
+    async def test_headroom_is_taken_atomically(self, batch_lane, gateway):
+        """Test concurrent bulk calls cannot both pass the reserve check on the same tokens."""
+        bucket = gateway.state.service_limits["openai"].tpm_bucket
+        bucket.refill_rate = 0
+        reserve = int(bucket.capacity * 0.5)
+        await bucket.adjust(bucket.capacity - reserve - 1500)  # Reserve plus room for one call
+
+        waits = [asyncio.create_task(batch_lane._wait_for_headroom("openai", 1000)) for _ in range(2)]
+        done, pending = await asyncio.wait(waits, timeout=0.2)
+        for task in pending:
+            task.cancel()
+        assert len(done) == 1 and done.pop().result() == 1000
+        assert await bucket.available() == reserve + 500
+
+
+# =============================================================================
+# METRICS TESTS
+# =============================================================================
+
+class TestHistogram:
+    """Test log-linear histogram percentiles."""
+
+    @pytest.mark.core
+    def test_percentiles_within_bucket_error(self):
+        """Test percentiles are within one sub-bucket (12.5%) of the exact nearest-rank value."""
+        histogram = Histogram()
+        values = [1.5 ** (i % 30) + i * 0.37 for i in range(1000)]
+        for value in values:
+            histogram.observe(value)
+
+        ordered = sorted(values)
+        for pct in (50, 95, 99):
+            exact = ordered[math.ceil(pct / 100 * len(ordered)) - 1]
+            assert exact <= histogram.percentile(pct) <= exact * 1.125
+        assert histogram.percentile(100) == max(values)
+        assert histogram.count == 1000 and histogram.sum == pytest.approx(sum(values))
+
+    @pytest.mark.core
+    def test_out_of_range_values(self):
+        histogram = Histogram(minimum=1.0, octaves=4)
+        for value in (0.2, -5, 1000):
+            histogram.observe(value)
+        assert histogram.counts[0] == 2 and histogram.counts[-1] == 1
+        assert histogram.percentile(50) == 1.0
+        assert histogram.percentile(99) == 1000
+
+    @pytest.mark.core
+    def test_empty(self):
+        assert Histogram().percentile(99) == 0.0
+
+
+class TestPrometheusRendering:
+    """Test the /metrics exposition format."""
+
+    @pytest.mark.core
+    def test_histogram_family(self):
+        """Test cumulative le buckets in exported units, _sum and _count per label set."""
+        family = HistogramFamily("latency_seconds", "Latency", ("service",), octaves=3, scale=0.001)
+        for value in (1.5, 3, 3, 100):
+            family.observe(("openai",), value)
+
+        lines = family.render()
+        assert lines[:2] == ["# HELP latency_seconds Latency", "# TYPE latency_seconds histogram"]
+        assert lines[2:] == [
+            'latency_seconds_bucket{service="openai",le="0.001"} 0',
+            'latency_seconds_bucket{service="openai",le="0.002"} 1',
+            'latency_seconds_bucket{service="openai",le="0.004"} 3',
+            'latency_seconds_bucket{service="openai",le="0.008"} 3',
+            'latency_seconds_bucket{service="openai",le="+Inf"} 4',
+            'latency_seconds_sum{service="openai"} 0.1075',
+            'latency_seconds_count{service="openai"} 4',
+        ]
+
+    @pytest.mark.core
+    def test_series_cap_and_label_escaping(self):
+        """Test label sets past max_series fold into "other" and label values are escaped."""
+        family = HistogramFamily("tokens", "Tokens", ("model",), max_series=2)
+        for model in ('a"b', "c", "d", "e"):
+            family.observe((model,), 10)
+
+        assert set(family.series) == {('a"b',), ("c",), ("other",)}
+        assert family.series[("other",)].count == 2
+        assert any('model="a\\"b"' in line for line in family.render())
+
+    @pytest.mark.core
+    def test_render_samples(self):
+        lines = render_samples("requests_total", "counter", "Requests", {
+            (("service", "openai"),): 3, (): 7.5,
+        })
+        assert lines == [
+            "# HELP requests_total Requests", "# TYPE requests_total counter",
+            "requests_total 7.5", 'requests_total{service="openai"} 3',
+        ]
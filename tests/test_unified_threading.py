@@ -0,0 +1,588 @@
+"""
+Unified Threading Tests.
+
+In-process tests for control-plane/shared/unified_threading: embedding
+batching and caching, the local vector index, chunk ranking and context
+packing. OpenAI and Supabase are replaced by fakes.
+"""
+
+import asyncio
+import copy
+import importlib.util
+import itertools
+import random
+import re
+import sys
+import threading
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from types import SimpleNamespace
+from uuid import uuid4
+
+import httpx
+import pytest
+
+
+SHARED_DIR = Path(__file__).parent.parent / "control-plane" / "shared"
+sys.path.insert(0, str(SHARED_DIR))
+
+from unified_threading import embedding_cache, embeddings, retrieval, vector_index  # noqa: E402
+from unified_threading.chunking import Chunk  # noqa: E402
+from unified_threading.conversation import UnifiedConversation  # noqa: E402
+from unified_threading.embedding_cache import EmbeddingCache, cache_key  # noqa: E402
+from unified_threading.retrieval import knapsack_select  # noqa: E402
+from unified_threading.tokenizer import TokenCounter, approximate_tokens  # noqa: E402
+from unified_threading.embeddings import (  # noqa: E402
+    EmbeddingBatcher,
+    EmbeddingRequestError,
+    EmbeddingService,
+    estimate_tokens,
+    plan_batches,
+)
+
+
+def fake_vector(text: str, dimension: int = 8) -> list:
+    """Deterministic stand-in embedding."""
+    return [float((hash(text) >> shift) & 0xFF) for shift in range(0, dimension * 8, 8)]
+
+
+# =============================================================================
+# EMBEDDING BATCHING TESTS
+# =============================================================================
+
+class TestPlanBatches:
+    """Test splitting texts into request-sized packs."""
+
+    @pytest.mark.core
+    def test_input_limit(self):
+        """Test packs hold at most max_inputs texts, in order."""
+        batches = plan_batches(["a"] * 5, max_inputs=2)
+        assert batches == [[0, 1], [2, 3], [4]]
+
+    @pytest.mark.core
+    def test_token_limit(self):
+        """Test packs stay under max_tokens and an oversized text gets a pack of its own."""
+        texts = ["x" * 400, "x" * 400, "x" * 4000, "x" * 40]
+        batches = plan_batches(texts, max_tokens=250)
+        assert batches == [[0, 1], [2], [3]]
+        for batch in batches:
+            if len(batch) > 1:
+                assert sum(estimate_tokens(texts[i]) for i in batch) <= 250
+
+    @pytest.mark.core
+    def test_cjk_is_not_undercounted(self):
+        """Test CJK text is planned at about a token per character, not four characters per token."""
+        text = "\u4f60\u597d" * 50
+        assert estimate_tokens(text) >= len(text)
+        assert plan_batches([text] * 3, max_tokens=250) == [[0, 1], [2]]
+
+    @pytest.mark.core
+    def test_empty(self):
+        assert plan_batches([]) == []
+
+
+class TestEmbedPacks:
+    """Test packs the API rejects as too large are split and retried."""
+
+    @pytest.mark.core
+    async def test_rejected_pack_is_halved(self, monkeypatch):
+        calls = []
+
+        async def request_embeddings(inputs):
+            calls.append(len(inputs))
+            if len(inputs) > 2:
+                raise EmbeddingRequestError(400, "Requested too many tokens for one request")
+            return [fake_vector(text) for text in inputs]
+
+        service = EmbeddingService(openai_api_key="test", cache=EmbeddingCache(path=None))
+        monkeypatch.setattr(service, "_request_embeddings", request_embeddings)
+        texts = [f"text {i}" for i in range(5)]
+
+        assert await service.generate_embeddings(texts) == [fake_vector(text) for text in texts]
+        assert sorted(calls) == [1, 2, 2, 3, 5], "5 -> 2 + 3 -> 2 + 1"
+
+    @pytest.mark.core
+    async def test_single_bad_input_still_raises(self, monkeypatch):
+        async def request_embeddings(inputs):
+            raise EmbeddingRequestError(400, "Invalid input")
+
+        service = EmbeddingService(openai_api_key="test", cache=EmbeddingCache(path=None))
+        monkeypatch.setattr(service, "_request_embeddings", request_embeddings)
+        with pytest.raises(EmbeddingRequestError):
+            await service.generate_embeddings(["a", "b", "c"])
+
+
+class TestEmbeddingBatcher:
+    """Test merging concurrent single-text requests."""
+
+    @pytest.mark.core
+    async def test_concurrent_callers_share_one_call(self):
+        """Test one window produces one embed_many call with duplicates removed."""
+        calls = []
+
+        async def embed_many(texts):
+            calls.append(list(texts))
+            return [fake_vector(text) for text in texts]
+
+        batcher = EmbeddingBatcher(embed_many, window_ms=5)
+        texts = ["alpha", "beta", "alpha", "gamma"]
+        results = await asyncio.gather(*(batcher.embed(text) for text in texts))
+
+        assert calls == [["alpha", "beta", "gamma"]]
+        assert results == [fake_vector(text) for text in texts]
+
+    @pytest.mark.core
+    async def test_max_inputs_flushes_early(self):
+        """Test a full window is sent without waiting for the timer."""
+        calls = []
+
+        async def embed_many(texts):
+            calls.append(len(texts))
+            return [fake_vector(text) for text in texts]
+
+        batcher = EmbeddingBatcher(embed_many, window_ms=10_000, max_inputs=3)
+        await asyncio.wait_for(
+            asyncio.gather(*(batcher.embed(f"text {i}") for i in range(3))), timeout=1.0
+        )
+        assert calls == [3]
+
+    @pytest.mark.core
+    async def test_bad_input_fails_only_its_caller(self):
+        """Test a rejected batch is bisected so other callers still get vectors."""
+        calls = []
+
+        async def embed_many(texts):
+            calls.append(list(texts))
+            if "BAD" in texts:
+                raise EmbeddingRequestError(400, "Invalid input")
+            return [fake_vector(text) for text in texts]
+
+        batcher = EmbeddingBatcher(embed_many, window_ms=5)
+        texts = ["ok1", "ok2", "BAD", "ok3", "ok4"]
+        results = await asyncio.gather(*(batcher.embed(text) for text in texts), return_exceptions=True)
+
+        assert isinstance(results[2], EmbeddingRequestError)
+        assert [results[i] for i in (0, 1, 3, 4)] == [fake_vector(texts[i]) for i in (0, 1, 3, 4)]
+        assert len(calls) <= 2 * len(texts), "Bisection should stay within O(n) calls"
+
+    @pytest.mark.core
+    async def test_transient_failure_is_not_retried(self):
+        """Test rate limits fail the window once instead of bisecting into more requests."""
+        calls = []
+
+        async def embed_many(texts):
+            calls.append(list(texts))
+            raise EmbeddingRequestError(429, "Rate limited")
+
+        batcher = EmbeddingBatcher(embed_many, window_ms=5)
+        results = await asyncio.gather(*(batcher.embed(f"t{i}") for i in range(4)), return_exceptions=True)
+
+        assert len(calls) == 1
+        assert all(isinstance(result, EmbeddingRequestError) for result in results)
+
+
+# =============================================================================
+# EMBEDDING CACHE TESTS
+# =============================================================================
+
+MODEL = "text-embedding-3-small"
+
+
+def disk_access(cache, text: str) -> float:
+    return cache._conn.execute(
+        "SELECT last_access FROM embeddings WHERE key = ?", (cache_key(MODEL, text),)
+    ).fetchone()[0]
+
+
+class TestEmbeddingCache:
+    """Test the two-tier content-addressed embedding cache."""
+
+    @pytest.mark.core
+    def test_key_normalizes_whitespace_and_unicode(self):
+        assert cache_key(MODEL, "  caf\u00e9\n  menu ") == cache_key(MODEL, "cafe\u0301 menu")
+        assert cache_key(MODEL, "a") != cache_key("other-model", "a")
+
+    @pytest.mark.core
+    def test_memory_lru(self):
+        """Test the memory tier drops the least recently used vector."""
+        cache = EmbeddingCache(path=None, memory_entries=2)
+        cache.put_many(MODEL, ["a", "b"], [[1.0], [2.0]])
+        assert cache.get(MODEL, "a") == [1.0]
+        cache.put(MODEL, "c", [3.0])
+
+        assert cache.get_many(MODEL, ["a", "b", "c"]) == [[1.0], None, [3.0]]
+        assert cache.stats["misses"] == 1
+
+    @pytest.mark.core
+    def test_disk_tier_survives_restart(self, tmp_path):
+        path = str(tmp_path / "cache.db")
+        cache = EmbeddingCache(path=path, memory_entries=1)
+        cache.put_many(MODEL, ["a", "b"], [[0.5, 0.25], [1.0, 2.0]])
+        cache.close()
+
+        reopened = EmbeddingCache(path=path)
+        assert reopened.get_many(MODEL, ["a", "b"]) == [[0.5, 0.25], [1.0, 2.0]]
+        assert reopened.stats["disk_hits"] == 2
+
+    @pytest.mark.core
+    def test_float16_storage(self, tmp_path):
+        """Test float16 rows take half the space and round-trip to within float16 precision."""
+        vector = [0.123456, -0.987654, 0.5]
+        cache = EmbeddingCache(path=str(tmp_path / "cache.db"), memory_entries=0, dtype="float16")
+        cache.put(MODEL, "text", vector)
+
+        assert cache.total_bytes == 2 * len(vector)
+        assert cache.get(MODEL, "text") == pytest.approx(vector, abs=1e-3)
+
+    @pytest.mark.core
+    def test_rejects_unknown_dtype(self):
+        with pytest.raises(ValueError):
+            EmbeddingCache(path=None, dtype="int8")
+
+    @pytest.mark.core
+    def test_disk_eviction_keeps_recently_hit_rows(self, tmp_path, monkeypatch):
+        """Test the disk budget evicts least recently used rows, counting batched hits."""
+        dimension = 256  # 1 KB per float32 row
+        cache = EmbeddingCache(path=str(tmp_path / "cache.db"), memory_entries=0, max_disk_mb=4 / 1024)
+        clock = iter(range(1000))
+        monkeypatch.setattr(embedding_cache, "time", SimpleNamespace(time=lambda: float(next(clock))))
+
+        cache.put_many(MODEL, ["a", "b", "c", "d"], [[float(i)] * dimension for i in range(4)])
+        assert cache.get(MODEL, "a") is not None, "Hit the oldest row"
+        cache.put(MODEL, "e", [4.0] * dimension)
+
+        assert cache.total_bytes <= cache.max_bytes
+        assert cache.stats["evictions"] == 1
+        assert cache.get(MODEL, "a") is not None
+        assert cache.get(MODEL, "b") is None
+
+    @pytest.mark.core
+    def test_hits_update_last_access_in_batches(self, tmp_path, monkeypatch):
+        """Test disk hits do not write per lookup; access times are written once TOUCH_BATCH pile up."""
+        monkeypatch.setattr(embedding_cache, "TOUCH_BATCH", 3)
+        clock = iter(range(1000))
+        monkeypatch.setattr(embedding_cache, "time", SimpleNamespace(time=lambda: float(next(clock))))
+        cache = EmbeddingCache(path=str(tmp_path / "cache.db"), memory_entries=0)
+        texts = ["a", "b", "c"]
+        cache.put_many(MODEL, texts, [[1.0]] * 3)
+        stored = disk_access(cache, "a")
+
+        cache.get_many(MODEL, texts[:2])
+        assert disk_access(cache, "a") == stored
+        cache.get(MODEL, "c")
+        assert disk_access(cache, "a") > stored and not cache._touched
+
+    @pytest.mark.core
+    def test_eviction_counts_rows_from_other_processes(self, tmp_path):
+        """Test the disk budget is checked against the shared file, not just this instance's writes."""
+        path = str(tmp_path / "cache.db")
+        dimension = 256  # 1 KB per float32 row
+        first = EmbeddingCache(path=path, memory_entries=0, max_disk_mb=4 / 1024)
+        second = EmbeddingCache(path=path, memory_entries=0, max_disk_mb=4 / 1024)
+        first.put_many(MODEL, ["a", "b", "c"], [[float(i)] * dimension for i in range(3)])
+        second.put_many(MODEL, ["d", "e"], [[float(i)] * dimension for i in range(2)])
+
+        assert second.total_bytes == 4 * 1024
+        assert second._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0] == 4
+        assert second.stats["evictions"] == 1
+
+    @pytest.mark.core
+    async def test_async_disk_tier_runs_in_worker_thread(self, tmp_path, monkeypatch):
+        """Test aget_many/aput_many serve memory hits inline and read and write SQLite off the loop."""
+        cache = EmbeddingCache(path=str(tmp_path / "cache.db"), memory_entries=1)
+        threads = []
+
+        def recording(method):
+            def run(*args):
+                threads.append(threading.current_thread())
+                return method(*args)
+            return run
+
+        monkeypatch.setattr(cache, "_from_disk", recording(cache._from_disk))
+        monkeypatch.setattr(cache, "_write", recording(cache._write))
+
+        await cache.aput_many(MODEL, ["a", "b"], [[1.0], [2.0]])
+        assert await cache.aget_many(MODEL, ["a", "b", "c"]) == [[1.0], [2.0], None]
+        assert len(threads) == 2 and threading.current_thread() not in threads
+        assert (cache.stats["memory_hits"], cache.stats["disk_hits"], cache.stats["misses"]) == (1, 1, 1)
+
+        assert await cache.aget_many(MODEL, ["a"]) == [[1.0]]
+        assert len(threads) == 2, "Memory hits never leave the loop"
+
+
+# =============================================================================
+# VECTOR INDEX TESTS
+# =============================================================================
+
+def clustered_vectors(count: int, dimension: int, clusters: int = 50, seed: int = 0):
+    """Unit vectors grouped around random centres, like topic-clustered chunks."""
+    np = pytest.importorskip("numpy")
+    rng = np.random.default_rng(seed)
+    centres = rng.standard_normal((clusters, dimension))
+    vectors = centres[rng.integers(0, clusters, count)] + 0.5 * rng.standard_normal((count, dimension))
+    return (vectors / np.linalg.norm(vectors, axis=1, keepdims=True)).astype(np.float32)
+
+
+def chunk(i: int) -> dict:
+    return {"chunk_id": f"chunk-{i}", "content": f"content {i}", "token_count": 10}
+
+
+@pytest.fixture
+def index(tmp_path):
+    pytest.importorskip("numpy")
+    return vector_index.VectorIndex(tmp_path / "index", dimension=32)
+
+
+class TestVectorIndex:
+    """Test the local nearest-neighbour index."""
+
+    @pytest.mark.core
+    def test_graph_recall_against_exact(self, index, monkeypatch):
+        """Test graph search finds at least 95% of the exact top 10 on clustered vectors."""
+        vectors = clustered_vectors(1000, 32)
+        queries = clustered_vectors(50, 32, seed=1)
+        index.replace_all([chunk(i) for i in range(len(vectors))], vectors.tolist())
+
+        exact = [{row["chunk_id"] for row, _ in index.search(query, top_k=10)} for query in queries]
+        monkeypatch.setattr(vector_index, "VECTOR_INDEX_GRAPH_THRESHOLD", 0)
+        index.build_graph()
+        assert index.meta["graph_size"] == len(vectors)
+
+        found = sum(
+            len(expected & {row["chunk_id"] for row, _ in index.search(query, top_k=10)})
+            for query, expected in zip(queries, exact)
+        )
+        assert found / (10 * len(queries)) >= 0.95
+
+    @pytest.mark.core
+    def test_update_replaces_metadata_and_vector(self, index, tmp_path, monkeypatch):
+        """Test re-adding a chunk id updates it in place, in the graph and after a reload."""
+        monkeypatch.setattr(vector_index, "VECTOR_INDEX_GRAPH_THRESHOLD", 0)
+        vectors = clustered_vectors(200, 32)
+        index.replace_all([chunk(i) for i in range(200)], vectors.tolist())
+
+        target = clustered_vectors(1, 32, seed=2)[0]
+        index.add({**chunk(7), "content": "edited"}, target.tolist())
+
+        assert index.count == 200
+        best, similarity = index.search(target.tolist(), top_k=1)[0]
+        assert best["chunk_id"] == "chunk-7" and best["content"] == "edited"
+        assert similarity == pytest.approx(1.0, abs=1e-5)
+
+        reloaded = vector_index.VectorIndex(tmp_path / "index", dimension=32)
+        assert reloaded.count == 200
+        assert reloaded.chunks[7]["content"] == "edited"
+
+    @pytest.mark.core
+    def test_sync_keeps_chunks_added_meanwhile(self, index):
+        """Test replace_all keeps chunks added between begin_sync and the snapshot landing."""
+        vectors = clustered_vectors(3, 32)
+        index.begin_sync()
+        index.add(chunk(99), vectors[0].tolist())
+        index.replace_all([chunk(0), chunk(1)], vectors[1:].tolist())
+        index.end_sync()
+
+        assert {row["chunk_id"] for row in index.chunks} == {"chunk-0", "chunk-1", "chunk-99"}
+        assert index.search(vectors[0].tolist(), top_k=1)[0][0]["chunk_id"] == "chunk-99"
+
+
+class TestVectorIndexSync:
+    """Test loading the local index from Supabase page by page."""
+
+    @pytest.mark.core
+    async def test_keyset_pages_do_not_skip_tied_timestamps(self, assembler, monkeypatch):
+        """Test chunks sharing a created_at across a page boundary are all loaded exactly once."""
+        monkeypatch.setattr(retrieval, "SYNC_PAGE_SIZE", 3)
+        stamp = "2026-01-01T00:00:00+00:00"
+        rows = [
+            {"id": f"chunk-{i}", "conversation_id": "c", "content": f"text {i}", "summary": None,
+             "token_count": 2, "created_at": stamp if i < 5 else "2026-01-02T00:00:00+00:00",
+             "aria_unified_embeddings": [{"embedding": [float(i)]}]}
+            for i in (4, 0, 6, 2, 1, 3, 5)
+        ]
+        keyset = re.compile(r'\(created_at\.gt\."(.+?)",and\(created_at\.eq\."(.+?)",id\.gt\."(.+?)"\)\)')
+
+        def respond(request):
+            params = request.url.params
+            assert params["order"] == "created_at.asc,id.asc" and "offset" not in params
+            page = sorted(rows, key=lambda row: (row["created_at"], row["id"]))
+            if "or" in params:
+                after, _, after_id = keyset.fullmatch(params["or"]).groups()
+                page = [row for row in page if (row["created_at"], row["id"]) > (after, after_id)]
+            return httpx.Response(200, json=page[:int(params["limit"])])
+
+        real_client = httpx.AsyncClient
+        monkeypatch.setattr(
+            retrieval.httpx, "AsyncClient",
+            lambda **kwargs: real_client(transport=httpx.MockTransport(respond), **kwargs)
+        )
+        loaded = {}
+        index = SimpleNamespace(
+            begin_sync=lambda: None, end_sync=lambda: None,
+            replace_all=lambda chunks, embeddings: loaded.update(chunks=chunks, embeddings=embeddings),
+        )
+        await assembler._sync_vector_index(index)
+
+        assert [row["chunk_id"] for row in loaded["chunks"]] == [f"chunk-{i}" for i in range(7)]
+        assert loaded["embeddings"] == [[float(i)] for i in range(7)]
+
+
+# =============================================================================
+# CHUNK RANKING TESTS
+# =============================================================================
+
+@pytest.fixture
+def assembler():
+    conversation = UnifiedConversation(uuid4(), "test-user", supabase_url="http://supabase.test", supabase_key="key")
+    return retrieval.ContextAssembler(
+        conversation, embedding_service=EmbeddingService(cache=EmbeddingCache(path=None))
+    )
+
+
+def candidate_chunks(count: int, seed: int = 0) -> list:
+    """Chunks with naive, aware and missing timestamps and varied importance."""
+    rng = random.Random(seed)
+    now = datetime.now(timezone.utc)
+    chunks = []
+    for i in range(count):
+        created = now - timedelta(hours=rng.uniform(0, 200))
+        created = [created, created.replace(tzinfo=None), None][i % 3]
+        chunks.append(Chunk(
+            id=uuid4(), conversation_id=uuid4(), content=f"chunk {i}", created_at=created,
+            importance_score=rng.choice([1.0, 1.3, 1.5]), similarity=rng.uniform(0.5, 1.0),
+        ))
+    return chunks
+
+
+class TestRankChunks:
+    """Test the vectorized ranking against the per-chunk fallback."""
+
+    @staticmethod
+    def rank_both(assembler, monkeypatch, chunks, **kwargs):
+        pytest.importorskip("numpy")
+        vectorized = assembler.rank_chunks(copy.deepcopy(chunks), **kwargs)
+        monkeypatch.setattr(retrieval, "NUMPY_AVAILABLE", False)
+        monkeypatch.setattr(embeddings, "NUMPY_AVAILABLE", False)
+        fallback = assembler.rank_chunks(copy.deepcopy(chunks), **kwargs)
+        return vectorized, fallback
+
+    @staticmethod
+    def assert_same(vectorized, fallback):
+        assert [c.id for c in vectorized] == [c.id for c in fallback]
+        for fast, slow in zip(vectorized, fallback):
+            assert fast.similarity == pytest.approx(slow.similarity, abs=1e-6)
+            assert fast.recency_score == pytest.approx(slow.recency_score, rel=1e-6)
+            assert fast.combined_score == pytest.approx(slow.combined_score, rel=1e-6)
+
+    @pytest.mark.core
+    def test_existing_similarity(self, assembler, monkeypatch):
+        """Test ranking by stored similarity matches the fallback, including top_k."""
+        chunks = candidate_chunks(60)
+        self.assert_same(*self.rank_both(assembler, monkeypatch, chunks))
+        vectorized, fallback = self.rank_both(assembler, monkeypatch, chunks, top_k=7)
+        assert len(vectorized) == 7
+        self.assert_same(vectorized, fallback)
+
+    @pytest.mark.core
+    def test_rescored_from_embeddings(self, assembler, monkeypatch):
+        """Test query-vs-candidate similarity matches the fallback's cosine_similarity."""
+        rng = random.Random(1)
+        chunks = candidate_chunks(40)
+        vectors = [[rng.uniform(-1, 1) for _ in range(16)] for _ in chunks]
+        vectors[5] = [0.0] * 16  # Zero vectors score 0, not NaN
+        query = [rng.uniform(-1, 1) for _ in range(16)]
+
+        vectorized, fallback = self.rank_both(
+            assembler, monkeypatch, chunks, query_embedding=query, embeddings=vectors, top_k=10
+        )
+        self.assert_same(vectorized, fallback)
+
+    @pytest.mark.core
+    def test_empty(self, assembler):
+        assert assembler.rank_chunks([]) == []
+
+
+# =============================================================================
+# CONTEXT PACKING TESTS
+# =============================================================================
+
+def brute_force(options: list, budget: int) -> float:
+    """Best total value over every combination of alternatives (None = left out)."""
+    best = 0.0
+    for choice in itertools.product(*[[None] + list(range(len(alts))) for alts in options]):
+        picked = [options[i][k] for i, k in enumerate(choice) if k is not None]
+        if sum(weight for weight, _ in picked) <= budget:
+            best = max(best, sum(value for _, value in picked))
+    return best
+
+
+class TestKnapsackSelect:
+    """Test multiple-choice knapsack packing."""
+
+    @pytest.mark.core
+    @pytest.mark.parametrize("seed", range(20))
+    def test_matches_brute_force(self, seed):
+        """Test small instances (exact weight resolution) reach the brute-force optimum within budget."""
+        rng = random.Random(seed)
+        options = []
+        for _ in range(rng.randint(1, 6)):
+            full = (rng.randint(1, 60), rng.uniform(0.1, 1.0))
+            summary = (rng.randint(1, full[0]), full[1] * 0.6)
+            options.append([full, summary] if rng.random() < 0.6 else [full])
+        budget = rng.randint(10, 150)
+
+        selected = knapsack_select(options, budget)
+        picked = [options[i][k] for i, k in enumerate(selected) if k is not None]
+        assert sum(weight for weight, _ in picked) <= budget
+        assert sum(value for _, value in picked) == pytest.approx(brute_force(options, budget))
+
+    @pytest.mark.core
+    def test_large_budget_stays_within_budget(self):
+        """Test rounding weights up to budget steps never overshoots a large budget."""
+        rng = random.Random(7)
+        options = [[(rng.randint(100, 3000), rng.random())] for _ in range(40)]
+        selected = knapsack_select(options, 8000)
+        assert sum(options[i][k][0] for i, k in enumerate(selected) if k is not None) <= 8000
+        assert any(k is not None for k in selected)
+
+    @pytest.mark.core
+    def test_edge_cases(self):
+        assert knapsack_select([[(10, 1.0)]], 0) == [None]
+        assert knapsack_select([[(10, 1.0)]], 5) == [None]
+        assert knapsack_select([[(10, 0.0)]], 50) == [None], "Worthless chunks are not packed"
+        assert knapsack_select([], 100) == []
+
+
+class TestTokenizer:
+    """Test token counting for context assembly."""
+
+    @pytest.mark.core
+    def test_memo_keyed_by_digest(self):
+        """Test repeated texts hit the memo and the memo does not keep the texts."""
+        calls = []
+        counter = TokenCounter(lambda text: calls.append(text) or len(text.split()), memo_size=2)
+        text = "some chunk content " * 100
+
+        assert counter.count(text) == counter.count(text) == 300
+        assert len(calls) == 1 and counter.hits == 1
+        assert all(isinstance(key, bytes) and len(key) == 16 for key in counter._memo)
+
+        counter.count("a")
+        counter.count("b")
+        assert counter.count(text) == 300 and len(calls) == 4, "Least recently used entry was evicted"
+        assert counter.count(None) == counter.count("") == 0
+
+    @pytest.mark.core
+    def test_approximation_matches_gateway_copy(self):
+        """Test the copy of the gateway's approximation has not drifted from it."""
+        path = SHARED_DIR.parent / "agents" / "gateway" / "token_estimator.py"
+        spec = importlib.util.spec_from_file_location("gateway_token_estimator", path)
+        gateway_estimator = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(gateway_estimator)
+
+        samples = [
+            "The quick brown fox", "def f(x): return {'a': [x, 42]}", "\u4f60\u597d\uff0c\u4e16\u754c",
+            "caf\u00e9 na\u00efve r\u00e9sum\u00e9", "  multiple   spaces\n\n\tand tabs ", "1234567890" * 3,
+        ]
+        for text in samples:
+            assert approximate_tokens(text) == gateway_estimator.approximate_tokens(text), text